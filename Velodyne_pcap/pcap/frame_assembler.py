@@ -0,0 +1,430 @@
+#!/usr/bin/python
+"""
+Streaming assembly of VLP-16 data packets into 360 degree frames.
+
+Packets come from a capture (pcap or lidar_container.py file) or a live UDP
+port, are copied (or received) into a preallocated batch and decoded a batch
+at a time (see vlp16_decoder.py).  A frame ends where the azimuth of the
+points wraps around the cut angle, which usually falls inside a packet: the
+points fired before the wrap close the frame, the others open the next one.
+The batch is decoded as soon as a packet starts past the cut angle, so a frame
+is yielded one packet after its last point was fired.
+
+Frames are written to two preallocated point arrays used in turn, so memory
+and allocations stay flat however long the stream is: a frame is valid until
+the next one is requested (copy it to keep it longer).
+
+Usage:
+------
+$ python3 frame_assembler.py <capture.pcap|capture.lcap> [--cut=<deg>] [--keep_empty]
+$ python3 frame_assembler.py --port=2368 [--frames=N]
+"""
+import argparse
+import socket
+import struct
+import sys
+import time
+
+import numpy as np
+
+from lidar_container import open_capture
+from pcap_reader import DATA_PAYLOAD_LEN, KIND_DATA, VELODYNE_DATA_PORT
+from vlp16_decoder import (BLOCK_FLAG, BLOCK_LEN, BLOCKS, CHANNELS, POINT_DTYPE, RETURN_MODE_DUAL, decode_packets,
+						   packet_gaps)
+
+_FIRST_AZIMUTH = struct.Struct('<2xH')
+_STAMP_MODE = struct.Struct('<IB')
+_STAMP_POS = BLOCKS * BLOCK_LEN
+
+# points of a rotation at 300 rpm in dual return mode (the most a VLP-16 fires per rotation)
+MAX_FRAME_POINTS = 2 * 151 * BLOCKS * CHANNELS
+
+
+class Frame:
+	"""
+	One rotation of points.
+
+	Attributes:
+	-----------
+	number: int
+		Frames yielded before this one.
+	points: np.ndarray
+		POINT_DTYPE view into a buffer refilled once the next frame is requested.
+	start, end: float
+		Time of the first and last point (s).
+	packets: int
+		Packets holding points of the frame (a packet split by the cut counts
+		in both frames).
+	missing: int
+		Packets lost inside the frame (sensor timestamp gaps).
+	complete: bool
+		False for the first and last frames of a stream (started or ended
+		mid-rotation) and for frames truncated to the buffer size.
+	"""
+	__slots__ = ('number', 'points', 'start', 'end', 'packets', 'missing', 'complete')
+
+	def __init__(self, number, points, packets, missing, complete):
+		self.number = number
+		self.points = points
+		self.start = float(points['timestamp'][0]) if len(points) else 0.
+		self.end = float(points['timestamp'][-1]) if len(points) else 0.
+		self.packets = packets
+		self.missing = missing
+		self.complete = complete
+
+	@property
+	def duration(self):
+		return self.end - self.start
+
+
+class FrameStats:
+	"""
+	Timing of the last `history` frames.
+
+	Attributes:
+	-----------
+	frames, partial, points, missing, overflow: int
+		Frames yielded, incomplete frames, points yielded, packets lost and
+		points dropped because a frame outgrew its buffer.
+	"""
+
+	def __init__(self, history=256):
+		self.frames = 0
+		self.partial = 0
+		self.points = 0
+		self.missing = 0
+		self.overflow = 0
+		self.packets = 0
+		self._history = history
+		self._starts = np.zeros(history)
+		self._durations = np.zeros(history)
+		self._packets = np.zeros(history, dtype=np.int64)
+		self._missing = np.zeros(history, dtype=np.int64)
+
+	def record(self, frame):
+		self.frames += 1
+		self.points += len(frame.points)
+		self.missing += frame.missing
+		if not frame.complete:
+			self.partial += 1
+			return
+		i = self.packets % self._history
+		self._starts[i] = frame.start
+		self._durations[i] = frame.duration
+		self._packets[i] = frame.packets
+		self._missing[i] = frame.missing
+		self.packets += 1
+
+	def _recent(self, values):
+		return values[:min(self.packets, self._history)]
+
+	@property
+	def rate(self):
+		"""
+		Rotation rate (Hz) over the recent complete frames.
+		"""
+		starts = np.sort(self._recent(self._starts))
+		if len(starts) < 2 or starts[-1] <= starts[0]:
+			return 0.
+		return (len(starts) - 1) / (starts[-1] - starts[0])
+
+	def summary(self):
+		text = 'frames: {} ({} partial), points: {}, missing packets: {}'.format(
+			self.frames, self.partial, self.points, self.missing)
+		if self.packets:
+			packets = self._recent(self._packets)
+			durations = self._recent(self._durations)
+			text += '\nrotation: {:.2f} Hz, {:.1f} ms per frame (max {:.1f} ms), packets per frame: {:.1f} ' \
+					'(min {}, max {}), frames with gaps: {}'.format(
+						self.rate, 1e3 * durations.mean(), 1e3 * durations.max(), packets.mean(), packets.min(),
+						packets.max(), np.count_nonzero(self._recent(self._missing)))
+		if self.overflow:
+			text += '\npoints dropped (frame buffer full): {}'.format(self.overflow)
+		return text
+
+
+class FrameAssembler:
+	"""
+	Group VLP-16 data packets into frames of one rotation.
+
+	Parameters:
+	-----------
+	cut: float
+		Azimuth (deg) where a frame ends and the next begins.
+	max_points: int
+		Capacity of each of the two frame buffers (extra points are dropped
+		and counted in stats.overflow).
+	batch: int
+		Packets decoded at once when no frame ends sooner.
+	drop_empty: bool
+		If True (Default) channels without a return are left out.
+	pcap_time: bool
+		If True (Default) points are stamped with the time given with their
+		packet, else with the sensor's seconds past the hour.
+
+	Example:
+	--------
+	>>> assembler = FrameAssembler()
+	>>> for frame in assembler.frames(reader.packets(kinds=(KIND_DATA,))):
+	...     print(frame.number, len(frame.points), frame.packets)
+	>>> print(assembler.stats.summary())
+	"""
+
+	def __init__(self, cut=0., max_points=MAX_FRAME_POINTS, batch=32, drop_empty=True, pcap_time=True):
+		self.cut = cut % 360.
+		self.drop_empty = drop_empty
+		self.pcap_time = pcap_time
+		self.stats = FrameStats()
+		self._cut = int(round(self.cut * 100)) % 36000
+		self._payloads = np.zeros((batch, DATA_PAYLOAD_LEN), dtype=np.uint8)
+		self._slots = [memoryview(row) for row in self._payloads]
+		self._times = np.zeros(batch)
+		self._stamps = np.zeros(batch, dtype=np.int64)
+		self._pending = 0
+		self._decoded = np.empty(batch * BLOCKS * CHANNELS, dtype=POINT_DTYPE)
+		self._buffers = [np.empty(max_points, dtype=POINT_DTYPE), np.empty(max_points, dtype=POINT_DTYPE)]
+		self._active = 0
+		self._fill = 0
+		self._number = 0
+		self._last_rel = None           # azimuth past the cut of the last point decoded
+		self._last_block_rel = None     # same for the first block of the last packet
+		self._last_stamp = None
+		self._dual = False
+		self._frame_packets = 0
+		self._frame_missing = 0
+		self._frame_overflow = False
+		self._started = False           # a wrap was seen: frames from now on are whole rotations
+
+	# ----------------------------------------------------------------- input
+
+	def slot(self):
+		"""
+		Memory the next packet payload goes to (e.g. for sock.recv_into).
+		"""
+		return self._slots[self._pending]
+
+	def commit(self, ts=0.):
+		"""
+		Take the payload written to slot().
+
+		Returns:
+		--------
+		frames: tuple or list
+			Frames completed by this packet (usually none).
+		"""
+		self._times[self._pending] = ts
+		stamp, mode = _STAMP_MODE.unpack_from(self._slots[self._pending], _STAMP_POS)
+		self._stamps[self._pending] = stamp
+		self._dual = mode == RETURN_MODE_DUAL
+		self._pending += 1
+		rel = (_FIRST_AZIMUTH.unpack_from(self._slots[self._pending - 1])[0] - self._cut) % 36000
+		wrapped = self._last_block_rel is not None and rel < self._last_block_rel - 18000
+		self._last_block_rel = rel
+		if wrapped or self._pending == len(self._payloads):
+			return self._decode()
+		return ()
+
+	def push(self, payload, ts=0.):
+		"""
+		Copy a data packet payload (1206 bytes) and take it, see commit().
+		"""
+		self._slots[self._pending][:] = payload
+		return self.commit(ts)
+
+	def frames(self, packets):
+		"""
+		Generator over the frames of an iterable of packets (objects with `ts`
+		and `payload`, e.g. PcapReader.packets(kinds=(KIND_DATA,))), ending
+		with the last (partial) frame.
+		"""
+		push = self.push
+		for packet in packets:
+			if len(packet.payload) != DATA_PAYLOAD_LEN:
+				continue
+			for frame in push(packet.payload, packet.ts):
+				yield frame
+		for frame in self.flush():
+			yield frame
+
+	def flush(self):
+		"""
+		Decode the packets pending and yield the frame in progress.
+		"""
+		frames = list(self._decode())
+		if self._fill:
+			frames.append(self._emit(complete=False))
+		return frames
+
+	# -------------------------------------------------------------- assembly
+
+	def _decode(self):
+		n = self._pending
+		if n == 0:
+			return ()
+		self._pending = 0
+		payloads = self._payloads[:n]
+		times = self._times[:n] if self.pcap_time else None
+		points = decode_packets(payloads, times, drop_empty=False, out=self._decoded)
+
+		# point -> packet: 32 points per valid block
+		flags = payloads[:, :_STAMP_POS].reshape(n, BLOCKS, BLOCK_LEN)[:, :, :2].copy().view('<u2')[..., 0]
+		per_packet = np.count_nonzero(flags == BLOCK_FLAG, axis=1) * CHANNELS
+		packet_end = np.cumsum(per_packet)
+
+		# missing packets before every packet, counted in the frame of its first point
+		gaps = packet_gaps(self._stamps[:n], self._last_stamp, self._dual)
+		self._last_stamp = int(self._stamps[n - 1])
+
+		rel = np.rint(points['azimuth'] * 100).astype(np.int32)
+		rel -= self._cut
+		rel %= 36000
+		# the two blocks of a dual return pair are fired at the same azimuths: the
+		# wraps are found on the first block, the second follows it channel by channel
+		second = _second_blocks(payloads, flags == BLOCK_FLAG)
+		lead = rel if second is None else rel[~second]
+		steps = np.zeros(len(lead), dtype=np.int64)
+		steps[1:] = np.diff(lead) < -18000
+		if len(lead) and self._last_rel is not None and lead[0] < self._last_rel - 18000:
+			steps[0] = 1
+		if len(lead):
+			self._last_rel = int(lead[-1])
+		frame_of = np.cumsum(steps)
+		if second is not None:
+			lead_frame, frame_of = frame_of, np.empty(len(rel), dtype=np.int64)
+			frame_of[~second] = lead_frame
+			follow = np.flatnonzero(second)
+			frame_of[follow] = frame_of[follow - CHANNELS]
+		wraps = int(steps.sum())
+		packet_of = np.repeat(np.arange(n), per_packet)
+		keep = (points['x'] != 0) | (points['y'] != 0) if self.drop_empty else None
+		missing = np.bincount(np.append(frame_of, wraps)[packet_end - per_packet], weights=gaps,
+							  minlength=wraps + 1)
+		if second is not None and wraps:
+			# a pair split by the cut: its two blocks' points go to the same two frames
+			order = np.argsort(frame_of, kind='stable')
+			points, frame_of, packet_of = points[order], frame_of[order], packet_of[order]
+			if keep is not None:
+				keep = keep[order]
+
+		frames = []
+		bounds = np.searchsorted(frame_of, np.arange(wraps + 2)).tolist()
+		for k in range(wraps + 1):
+			begin, end = bounds[k], bounds[k + 1]
+			self._append(points, keep, begin, end)
+			if end > begin:
+				self._frame_packets += int(packet_of[end - 1] - packet_of[begin]) + 1
+			self._frame_missing += int(missing[k])
+			if k < wraps:
+				frames.append(self._emit(complete=self._started and not self._frame_overflow))
+				self._started = True
+		return frames
+
+	def _append(self, points, keep, begin, end):
+		part = points[begin:end]
+		if keep is not None:
+			part = part[keep[begin:end]]
+		buffer = self._buffers[self._active]
+		room = len(buffer) - self._fill
+		if len(part) > room:
+			self.stats.overflow += len(part) - room
+			self._frame_overflow = True
+			part = part[:room]
+		buffer[self._fill:self._fill + len(part)] = part
+		self._fill += len(part)
+
+	def _emit(self, complete):
+		frame = Frame(self._number, self._buffers[self._active][:self._fill], self._frame_packets,
+					  self._frame_missing, complete)
+		self.stats.record(frame)
+		self._number += 1
+		self._active = 1 - self._active
+		self._fill = 0
+		self._frame_packets = 0
+		self._frame_missing = 0
+		self._frame_overflow = False
+		return frame
+
+
+def _second_blocks(payloads, valid):
+	"""
+	Mask of the decoded points (valid blocks) fired by the second block of a
+	dual return pair, None if no packet is in dual return mode.
+	"""
+	dual = payloads[:, _STAMP_POS + 4] == RETURN_MODE_DUAL
+	if not dual.any():
+		return None
+	second = np.zeros_like(valid)
+	second[:, 1::2] = valid[:, 1::2] & valid[:, 0::2] & dual[:, None]
+	return np.repeat(second[valid], CHANNELS)
+
+
+def frames_from_socket(assembler, port=VELODYNE_DATA_PORT, host='', timeout=1.):
+	"""
+	Generator over the frames of the data packets received on a UDP port,
+	each packet received straight into the assembler batch.
+	"""
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+	sock.bind((host, port))
+	sock.settimeout(timeout)
+	recv_into = sock.recv_into
+	commit = assembler.commit
+	now = time.time
+	try:
+		while True:
+			try:
+				size = recv_into(assembler.slot())
+			except socket.timeout:
+				continue
+			if size != DATA_PAYLOAD_LEN:
+				continue
+			for frame in commit(now()):
+				yield frame
+	finally:
+		sock.close()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Assemble VLP-16 data packets into 360 degree frames')
+	parser.add_argument('capture', nargs='?', help='pcap capture or container (lidar_container.py).')
+	parser.add_argument('--port', type=int, default=None, help='Assemble the packets received on this UDP port instead.')
+	parser.add_argument('--host', default='', help='Local address to bind with --port.')
+	parser.add_argument('--cut', type=float, default=0., help='Azimuth (deg) where frames are cut.')
+	parser.add_argument('--keep_empty', action='store_true', help='Keep the channels without a return.')
+	parser.add_argument('--frames', type=int, default=None, help='Stop after N frames.')
+	parser.add_argument('--verbose', action='store_true', help='Print every frame.')
+	args = parser.parse_args()
+	if (args.capture is None) == (args.port is None):
+		parser.error('give a capture or --port')
+
+	assembler = FrameAssembler(cut=args.cut, drop_empty=not args.keep_empty)
+	reader = None
+	try:
+		if args.capture is not None:
+			reader = open_capture(args.capture)
+			frames = assembler.frames(reader.packets(kinds=(KIND_DATA,)))
+		else:
+			frames = frames_from_socket(assembler, args.port, args.host)
+	except (OSError, ValueError) as e:
+		print('[Error] ' + str(e))
+		sys.exit(1)
+
+	t0 = time.perf_counter()
+	try:
+		for frame in frames:
+			if args.verbose:
+				print('[Frame] {} {:.3f} s: {} points, {} packets, {} missing{}'.format(
+					frame.number, frame.start, len(frame.points), frame.packets, frame.missing,
+					'' if frame.complete else ' (partial)'))
+			if args.frames is not None and assembler.stats.frames >= args.frames:
+				break
+	except KeyboardInterrupt:
+		pass
+	elapsed = time.perf_counter() - t0
+	frames.close()
+	if reader is not None:
+		reader.close()
+	for line in assembler.stats.summary().splitlines():
+		print('[Info] ' + line)
+	print('[Info] {:.2f} s ({:.0f} frames/s)'.format(elapsed, assembler.stats.frames / max(elapsed, 1e-9)))
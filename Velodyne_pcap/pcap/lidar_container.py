@@ -0,0 +1,663 @@
+#!/usr/bin/python
+"""
+Seekable chunk-compressed container for LiDAR captures (".lcap").
+
+The pcap records (record header and frame, exactly as in the capture) are
+stored in independently compressed chunks of a few MB, cut on record
+boundaries.  Consecutive VLP-16 records share almost all their header and
+azimuth bytes, so they compress well, and USB write bandwidth is what limits
+a capture on the Pi.  The packet table (size, timestamp and class of every
+packet) and the chunk table are stored compressed at the end of the file,
+so a time window only decompresses the chunks holding it.
+
+Layout:
+-------
+	file header     b'LCAP', version, codec, level, record header length, pcap global header
+	chunk *         b'CHNK', compressed size, raw size, packets, first/last timestamp, compressed records
+	index           b'LIDX', chunk table, compressed packet table
+	footer          position of the index, b'LEND'
+
+Every chunk header is self-describing, so a container whose writer was
+interrupted (no index) is still read by walking the chunks.  Converting a
+capture to a container and back gives the same bytes.
+
+Usage:
+------
+$ python3 lidar_container.py pack flight.pcap flight.lcap [--codec=zlib|lzma] [--level=N] [--chunk_size=4M] [--workers=N]
+$ python3 lidar_container.py unpack flight.lcap flight.pcap [--from=12:30] [--to=15:00] [--kind=data]
+$ python3 lidar_container.py info flight.lcap
+"""
+import argparse
+import collections
+import concurrent.futures
+import lzma
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+
+import numpy as np
+
+from pcap_reader import (GLOBAL_HEADER_LEN, INDEX_DTYPE, KIND_DATA, KIND_POSITION, PACKET_INFO_DTYPE, Packet,
+						 PcapReader, locate_rows, parse_time, search_timestamps, write_index)
+from pcap_tools import CaptureWriter, parse_kinds, parse_size
+
+CONTAINER_MAGIC = b'LCAP'
+CONTAINER_VERSION = 1
+CONTAINER_SUFFIX = '.lcap'
+CODECS = {'zlib': 1, 'lzma': 2}
+DEFAULT_LEVEL = {'zlib': 6, 'lzma': 6}
+
+FILE_HEADER = struct.Struct('<4sHBBH24s')
+CHUNK_HEADER = struct.Struct('<4sIIIdd')
+INDEX_HEADER = struct.Struct('<4sII')
+FOOTER = struct.Struct('<Q4s')
+CHUNK_MAGIC = b'CHNK'
+INDEX_MAGIC = b'LIDX'
+FOOTER_MAGIC = b'LEND'
+
+# position: start of the compressed records in the container
+# raw_offset: start of the chunk records in the equivalent pcap capture
+CHUNK_DTYPE = np.dtype([('position', '<i8'), ('comp_len', '<u4'), ('raw_len', '<u4'), ('raw_offset', '<i8'),
+						('first_row', '<i8'), ('packets', '<u4'), ('first_ts', '<f8'), ('last_ts', '<f8')])
+
+# packet table columns (record offsets follow from the sizes, records being contiguous)
+PACKET_COLUMNS = (('caplen', '<u4'), ('ts', '<f8'), ('kind', 'u1'), ('sport', '<u2'), ('dport', '<u2'),
+				  ('payload', '<u4'))
+
+# decompressed bytes handed to the replay at once
+SEGMENT_SIZE = 32 << 20
+
+
+def is_container(path):
+	with open(path, 'rb') as f:
+		return f.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC
+
+
+def compress(raw, codec, level):
+	if codec == 'lzma':
+		return lzma.compress(raw, preset=level)
+	return zlib.compress(raw, level)
+
+
+def decompress(data, codec):
+	if codec == 'lzma':
+		return lzma.decompress(data)
+	return zlib.decompress(data)
+
+
+def pack_packets(index, info):
+	"""
+	Packet table bytes: one column after the other, zlib compressed.
+	"""
+	columns = [index['caplen'], index['ts']] + [info[name] for name in ('kind', 'sport', 'dport', 'payload')]
+	return zlib.compress(b''.join(np.ascontiguousarray(column).tobytes() for column in columns))
+
+
+def unpack_packets(data, count):
+	raw = zlib.decompress(data)
+	columns = {}
+	pos = 0
+	for name, dtype in PACKET_COLUMNS:
+		dtype = np.dtype(dtype)
+		columns[name] = np.frombuffer(raw, dtype=dtype, count=count, offset=pos)
+		pos += dtype.itemsize * count
+	return columns
+
+
+class ContainerWriter:
+	"""
+	Streaming writer: pcap records in, compressed chunks out.
+
+	write() takes the bytes that follow the global header of a pcap capture,
+	in pieces of any size (whole records are not required: an incomplete last
+	record waits for the next write). A chunk is compressed every time
+	`chunk_size` bytes of complete records are pending.
+
+	Parameters:
+	-----------
+	path: str
+		Container to create.
+	global_header: bytes
+		Global header of the capture (24 bytes): byte order, timestamp
+		resolution, snaplen and link type of the records.
+	record_header_len: int
+		16 (standard pcap) or 24 (64-bit Velodyne_pcap build).
+	codec: str
+		'zlib' or 'lzma'.
+	level: int
+		Compression level (zlib 1-9, lzma preset 0-9), DEFAULT_LEVEL if None.
+	chunk_size: int
+		Uncompressed bytes per chunk.
+	workers: int
+		Chunks compressed in parallel (zlib and lzma release the GIL).
+
+	Example:
+	--------
+	>>> with ContainerWriter('flight.lcap', global_header, codec='zlib', level=1) as writer:
+	...     writer.write(records)
+	"""
+
+	def __init__(self, path, global_header, record_header_len=16, codec='zlib', level=None, chunk_size=4 << 20,
+				 workers=1):
+		if codec not in CODECS:
+			raise ValueError('unknown codec %r (%s)' % (codec, ', '.join(CODECS)))
+		self.path = path
+		self.global_header = bytes(global_header[:GLOBAL_HEADER_LEN])
+		self.record_header_len = record_header_len
+		self.codec = codec
+		self.level = DEFAULT_LEVEL[codec] if level is None else level
+		self.chunk_size = chunk_size
+		self.packets = 0
+		self.raw_bytes = GLOBAL_HEADER_LEN
+		self._pending = bytearray(self.global_header)
+		self._chunks = []
+		self._indexes = []
+		self._infos = []
+		self._queue = collections.deque()
+		self._pool = concurrent.futures.ThreadPoolExecutor(workers) if workers > 1 else None
+		self._workers = workers
+		self._file = open(path, 'wb')
+		self._file.write(FILE_HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, CODECS[codec], self.level,
+										  record_header_len, self.global_header))
+
+	@property
+	def bytes_written(self):
+		return self._file.tell() if self._file is not None else os.path.getsize(self.path)
+
+	def write(self, data):
+		pending = len(self._pending) - GLOBAL_HEADER_LEN
+		if pending and pending + len(data) > self.chunk_size:
+			self._cut(final=False)
+		self._pending += data
+		if len(self._pending) - GLOBAL_HEADER_LEN >= self.chunk_size:
+			self._cut(final=False)
+
+	def _cut(self, final):
+		"""
+		Compress the complete records pending (and, at the end, the trailing
+		bytes of an incomplete record, so that the capture is kept byte for
+		byte).
+		"""
+		data = bytes(self._pending)
+		reader = PcapReader(self.path, self.record_header_len, data=data)
+		index = reader.index.copy()
+		info = reader.classify().copy()
+		reader.close()
+		end = GLOBAL_HEADER_LEN if len(index) == 0 else int(index['offset'][-1]) + int(index['caplen'][-1])
+		if final:
+			end = len(data)
+		if end == GLOBAL_HEADER_LEN:
+			return
+		self._pending = bytearray(self.global_header)
+		self._pending += memoryview(data)[end:]
+
+		index['offset'] += self.raw_bytes - GLOBAL_HEADER_LEN
+		chunk = np.zeros(1, dtype=CHUNK_DTYPE)[0]
+		chunk['raw_len'] = end - GLOBAL_HEADER_LEN
+		chunk['raw_offset'] = self.raw_bytes
+		chunk['first_row'] = self.packets
+		chunk['packets'] = len(index)
+		if len(index):
+			chunk['first_ts'], chunk['last_ts'] = index['ts'][0], index['ts'][-1]
+		self.raw_bytes += end - GLOBAL_HEADER_LEN
+		self.packets += len(index)
+		self._indexes.append(index)
+		self._infos.append(info)
+
+		raw = memoryview(data)[GLOBAL_HEADER_LEN:end]
+		if self._pool is None:
+			self._write_chunk(chunk, compress(raw, self.codec, self.level))
+			return
+		self._queue.append((chunk, self._pool.submit(compress, raw, self.codec, self.level)))
+		while self._queue and (len(self._queue) > 2 * self._workers or self._queue[0][1].done()):
+			chunk, future = self._queue.popleft()
+			self._write_chunk(chunk, future.result())
+
+	def _write_chunk(self, chunk, compressed):
+		chunk['comp_len'] = len(compressed)
+		self._file.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(compressed), int(chunk['raw_len']), int(chunk['packets']),
+										   float(chunk['first_ts']), float(chunk['last_ts'])))
+		chunk['position'] = self._file.tell()
+		self._file.write(compressed)
+		self._chunks.append(chunk)
+
+	def flush(self):
+		"""
+		Compress the complete records pending and write every chunk compressed.
+		"""
+		self._cut(final=False)
+		while self._queue:
+			chunk, future = self._queue.popleft()
+			self._write_chunk(chunk, future.result())
+		self._file.flush()
+
+	def sync(self):
+		self._file.flush()
+		os.fsync(self._file.fileno())
+
+	def close(self):
+		"""
+		Write the last chunk and the index.
+
+		Returns:
+		--------
+		packets: int
+		"""
+		if self._file is None:
+			return self.packets
+		self._cut(final=True)
+		while self._queue:
+			chunk, future = self._queue.popleft()
+			self._write_chunk(chunk, future.result())
+		if self._pool is not None:
+			self._pool.shutdown()
+		index = np.concatenate(self._indexes) if self._indexes else np.empty(0, dtype=INDEX_DTYPE)
+		info = np.concatenate(self._infos) if self._infos else np.empty(0, dtype=PACKET_INFO_DTYPE)
+		chunks = np.array(self._chunks, dtype=CHUNK_DTYPE)
+		packets = pack_packets(index, info)
+		position = self._file.tell()
+		self._file.write(INDEX_HEADER.pack(INDEX_MAGIC, len(chunks), len(packets)))
+		self._file.write(chunks.tobytes())
+		self._file.write(packets)
+		self._file.write(FOOTER.pack(position, FOOTER_MAGIC))
+		self._file.close()
+		self._file = None
+		return self.packets
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+class ContainerReader:
+	"""
+	Random access to a container: the packet table is read at open, chunks
+	are decompressed on demand.
+
+	Mirrors the PcapReader API used by the replay (index, timestamps,
+	classify, select, locate), with record offsets given in the equivalent
+	pcap capture. load() and segments() return PcapReader objects over
+	decompressed chunks.
+
+	Attributes:
+	-----------
+	chunks: np.ndarray
+		Chunk table (CHUNK_DTYPE).
+	index: np.ndarray
+		INDEX_DTYPE row of every packet.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self._mm = None
+		self._file = open(path, 'rb')
+		self.size = os.fstat(self._file.fileno()).st_size
+		if self.size < FILE_HEADER.size:
+			self._file.close()
+			raise ValueError('%s: file too small to be a LiDAR container' % path)
+		self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		magic, version, codec, level, record_header_len, global_header = FILE_HEADER.unpack_from(self._mm, 0)
+		codecs = {number: name for name, number in CODECS.items()}
+		if magic != CONTAINER_MAGIC or version != CONTAINER_VERSION or codec not in codecs:
+			self.close()
+			raise ValueError('%s: not a LiDAR container (version %d)' % (path, CONTAINER_VERSION))
+		self.codec = codecs[codec]
+		self.level = level
+		self.record_header_len = record_header_len
+		self.global_header = global_header
+		template = PcapReader(path, record_header_len, data=global_header)
+		self.endian, self.ts_divisor, self.linktype = template.endian, template.ts_divisor, template.linktype
+		template.close()
+		self._search_ts = None
+		if not self._load_index():
+			print('[Info] ' + path + ': no index (interrupted writer?), walking the chunks')
+			self._recover()
+
+	def _load_index(self):
+		if self.size < FILE_HEADER.size + FOOTER.size:
+			return False
+		position, magic = FOOTER.unpack_from(self._mm, self.size - FOOTER.size)
+		if magic != FOOTER_MAGIC or position + INDEX_HEADER.size > self.size:
+			return False
+		magic, count, packed = INDEX_HEADER.unpack_from(self._mm, position)
+		if magic != INDEX_MAGIC:
+			return False
+		position += INDEX_HEADER.size
+		self.chunks = np.frombuffer(self._mm, dtype=CHUNK_DTYPE, count=count, offset=position).copy()
+		position += CHUNK_DTYPE.itemsize * count
+		packets = int(self.chunks['packets'].sum())
+		with memoryview(self._mm) as view:
+			columns = unpack_packets(view[position:position + packed], packets)
+		self._set_packets(columns)
+		return True
+
+	def _set_packets(self, columns):
+		caplen = columns['caplen']
+		n = len(caplen)
+		self.index = np.empty(n, dtype=INDEX_DTYPE)
+		self.index['caplen'] = caplen
+		self.index['ts'] = columns['ts']
+		# records are contiguous inside a chunk
+		record = caplen.astype(np.int64) + self.record_header_len
+		before = np.concatenate([[0], np.cumsum(record)[:-1]])
+		chunk = np.repeat(np.arange(len(self.chunks)), self.chunks['packets'])
+		self.index['offset'] = self.chunks['raw_offset'][chunk] + self.record_header_len + \
+			before - before[self.chunks['first_row'][chunk]] if n else np.empty(0, dtype=np.int64)
+		self._info = np.empty(n, dtype=PACKET_INFO_DTYPE)
+		for name in ('kind', 'sport', 'dport', 'payload'):
+			self._info[name] = columns[name]
+
+	def _recover(self):
+		chunks, indexes, infos = [], [], []
+		position = FILE_HEADER.size
+		raw_offset = GLOBAL_HEADER_LEN
+		rows = 0
+		while position + CHUNK_HEADER.size <= self.size:
+			magic, comp_len, raw_len, packets, first_ts, last_ts = CHUNK_HEADER.unpack_from(self._mm, position)
+			position += CHUNK_HEADER.size
+			if magic != CHUNK_MAGIC or position + comp_len > self.size:
+				break
+			chunk = np.array([(position, comp_len, raw_len, raw_offset, rows, packets, first_ts, last_ts)],
+							 dtype=CHUNK_DTYPE)[0]
+			part = PcapReader(self.path, self.record_header_len, data=self.global_header + self.read_chunk(chunk))
+			indexes.append(part.index)
+			infos.append(part.classify())
+			part.close()
+			chunks.append(chunk)
+			position += comp_len
+			raw_offset += raw_len
+			rows += packets
+		self.chunks = np.array(chunks, dtype=CHUNK_DTYPE)
+		index = np.concatenate(indexes) if indexes else np.empty(0, dtype=INDEX_DTYPE)
+		info = np.concatenate(infos) if infos else np.empty(0, dtype=PACKET_INFO_DTYPE)
+		columns = {'caplen': index['caplen'], 'ts': index['ts']}
+		columns.update((name, info[name]) for name in ('kind', 'sport', 'dport', 'payload'))
+		self._set_packets(columns)
+
+	# --------------------------------------------------------------- access
+
+	def __len__(self):
+		return len(self.index)
+
+	@property
+	def timestamps(self):
+		return self.index['ts']
+
+	@property
+	def duration(self):
+		if len(self.index) == 0:
+			return 0.
+		return float(self.index['ts'][-1] - self.index['ts'][0])
+
+	@property
+	def raw_size(self):
+		"""
+		Size of the equivalent pcap capture.
+		"""
+		if len(self.chunks) == 0:
+			return GLOBAL_HEADER_LEN
+		return int(self.chunks['raw_offset'][-1] + self.chunks['raw_len'][-1])
+
+	def locate(self, start=None, stop=None):
+		"""
+		Index rows [first, last) of the packets stamped in [start, stop), see
+		PcapReader.locate.
+		"""
+		if self._search_ts is None:
+			self._search_ts = search_timestamps(self.index['ts'])
+		return locate_rows(self._search_ts, start, stop)
+
+	def classify(self):
+		return self._info
+
+	def select(self, kinds=(KIND_DATA, KIND_POSITION)):
+		return np.flatnonzero(np.isin(self._info['kind'], kinds))
+
+	def chunk_of(self, rows):
+		return np.searchsorted(self.chunks['first_row'], rows, side='right') - 1
+
+	def read_chunk(self, chunk):
+		"""
+		Decompressed records of a chunk (a row of self.chunks).
+		"""
+		position, comp_len = int(chunk['position']), int(chunk['comp_len'])
+		with memoryview(self._mm) as view:
+			raw = decompress(view[position:position + comp_len], self.codec)
+		if len(raw) != chunk['raw_len']:
+			raise ValueError('%s: chunk at %d is corrupted' % (self.path, position))
+		return raw
+
+	def load(self, first, last):
+		"""
+		Chunks [first, last) as an in-memory pcap capture.
+
+		Returns:
+		--------
+		reader: PcapReader
+			Index rows of the reader are the container rows from
+			self.chunks['first_row'][first] on.
+		"""
+		chunks = self.chunks[first:last]
+		data = bytearray(self.global_header)
+		for chunk in chunks:
+			data += self.read_chunk(chunk)
+		base = int(chunks['first_row'][0])
+		index = self.index[base:base + int(chunks['packets'].sum())].copy()
+		index['offset'] -= int(chunks['raw_offset'][0]) - GLOBAL_HEADER_LEN
+		return PcapReader(self.path, self.record_header_len, index=index, data=data)
+
+	def segments(self, rows, size=SEGMENT_SIZE):
+		"""
+		Generator over the given (increasing) rows, a few chunks at a time:
+		the next chunks are decompressed in a thread while the current ones
+		are used.
+
+		Returns:
+		--------
+		(reader, local rows) tuples: a PcapReader over about `size` bytes of
+		decompressed chunks and the positions of the requested rows in its index.
+		"""
+		rows = np.asarray(rows, dtype=np.int64)
+		if len(rows) == 0:
+			return
+		chunk_ids = self.chunk_of(rows)
+		needed = np.unique(chunk_ids)
+		groups = []
+		start = 0
+		for k in range(1, len(needed) + 1):
+			if k == len(needed) or needed[k] != needed[k - 1] + 1 or \
+					self.chunks['raw_len'][needed[start]:needed[k - 1] + 1].sum() + self.chunks['raw_len'][needed[k]] > size:
+				groups.append((int(needed[start]), int(needed[k - 1]) + 1))
+				start = k
+		bounds = np.searchsorted(chunk_ids, [first for first, _ in groups] + [len(self.chunks)])
+		with concurrent.futures.ThreadPoolExecutor(1) as pool:
+			pending = pool.submit(self.load, *groups[0])
+			for g, group in enumerate(groups):
+				reader = pending.result()
+				if g + 1 < len(groups):
+					pending = pool.submit(self.load, *groups[g + 1])
+				base = int(self.chunks['first_row'][group[0]])
+				try:
+					yield reader, rows[bounds[g]:bounds[g + 1]] - base
+				finally:
+					reader.close()
+
+	def packets(self, kinds=(KIND_DATA, KIND_POSITION), start=0, stop=None):
+		"""
+		Generator over the packets of the given classes, see PcapReader.packets.
+		"""
+		for part, rows in self.segments(self.select(kinds)[start:stop]):
+			info = part.classify()
+			view = memoryview(part.buf)
+			for i in rows.tolist():
+				offset, caplen, ts = part.index[i]
+				kind, sport, dport, payload = info[i]
+				yield Packet(float(ts), int(kind), int(sport), int(dport), view[offset + payload:offset + caplen])
+
+	def to_pcap(self, path):
+		"""
+		Write the original capture back (same bytes) with its index.
+
+		Returns:
+		--------
+		packets: int
+		"""
+		with open(path, 'wb') as f:
+			f.write(self.global_header)
+			for chunk in self.chunks:
+				f.write(self.read_chunk(chunk))
+		try:
+			write_index(path, self.index, self.record_header_len, self.raw_size, self.raw_size)
+		except OSError:
+			pass
+		return len(self.index)
+
+	def close(self):
+		if self._mm is not None:
+			self._mm.close()
+			self._mm = None
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+def open_capture(path):
+	"""
+	PcapReader or ContainerReader, depending on the file.
+	"""
+	return ContainerReader(path) if is_container(path) else PcapReader(path)
+
+
+def pack(reader, path, codec='zlib', level=None, chunk_size=4 << 20, workers=1):
+	"""
+	Convert an open pcap capture (every byte, even a truncated last record)
+	into a container.
+
+	Returns:
+	--------
+	packets: int
+	"""
+	begins = reader.index['offset'] - reader.record_header_len
+	cuts = np.searchsorted(begins, np.arange(GLOBAL_HEADER_LEN + chunk_size, reader.size, chunk_size))
+	cuts = np.unique(np.concatenate([begins[cuts[cuts < len(begins)]], [GLOBAL_HEADER_LEN, reader.size]]))
+	view = memoryview(reader.buf)
+	try:
+		with ContainerWriter(path, view[:GLOBAL_HEADER_LEN], reader.record_header_len, codec, level, chunk_size,
+							 workers) as writer:
+			for begin, end in zip(cuts[:-1].tolist(), cuts[1:].tolist()):
+				writer.write(view[begin:end])
+	finally:
+		view.release()
+	return writer.packets
+
+
+def unpack(container, path, kinds=None, t_from=None, t_to=None):
+	"""
+	Write the packets of a time window and/or classes as a pcap capture,
+	decompressing only the chunks holding them.
+
+	Returns:
+	--------
+	packets: int
+	"""
+	first, last = container.locate(t_from, t_to)
+	rows = np.arange(first, last)
+	if kinds is not None:
+		rows = rows[np.isin(container.classify()['kind'][rows], kinds)]
+	return write_rows(container, path, rows)
+
+
+def write_rows(capture, path, rows):
+	"""
+	Write the packets of the given (increasing) index rows of a PcapReader
+	or ContainerReader as a pcap capture in the same format.
+
+	Returns:
+	--------
+	packets: int
+	"""
+	if not isinstance(capture, ContainerReader):
+		with CaptureWriter(path, capture) as writer:
+			writer.write(capture, rows)
+		return writer.packets
+	template = PcapReader(path, capture.record_header_len, data=capture.global_header)
+	writer = CaptureWriter(path, template)
+	try:
+		for reader, local in capture.segments(rows):
+			writer.write(reader, local)
+	finally:
+		template.close()
+		packets = writer.close()
+	return packets
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Convert pcap captures to and from chunk-compressed containers')
+	commands = parser.add_subparsers(dest='command', required=True)
+	command = commands.add_parser('pack', help='Compress a pcap capture into a container.')
+	command.add_argument('pcap')
+	command.add_argument('out')
+	command.add_argument('--codec', default='zlib', choices=sorted(CODECS))
+	command.add_argument('--level', type=int, default=None, help='Compression level (zlib 1-9, lzma 0-9).')
+	command.add_argument('--chunk_size', default='4M', help='Uncompressed bytes per chunk.')
+	command.add_argument('--workers', type=int, default=1, help='Chunks compressed in parallel.')
+	command = commands.add_parser('unpack', help='Write a container (or a window of it) as a pcap capture.')
+	command.add_argument('container')
+	command.add_argument('out')
+	command.add_argument('--from', dest='time_from', default=None,
+						 help='Start of the time window (formats of lidar_pcap_replay.py --from).')
+	command.add_argument('--to', dest='time_to', default=None, help='End of the time window.')
+	command.add_argument('--kind', default='all', help='Comma separated packet classes to keep: data, position, other or all.')
+	command = commands.add_parser('info', help='Print the chunks and packets of a container.')
+	command.add_argument('container')
+	args = parser.parse_args(argv)
+
+	t0 = time.perf_counter()
+	try:
+		if args.command == 'pack':
+			with PcapReader(args.pcap) as reader:
+				packets = pack(reader, args.out, args.codec, args.level, parse_size(args.chunk_size), args.workers)
+				raw = reader.size
+			written = os.path.getsize(args.out)
+			elapsed = time.perf_counter() - t0
+			print('[Info] packets: ' + str(packets) + ', {:.1f} MB -> {:.1f} MB ({:.1f}%)'.format(
+				raw / 1e6, written / 1e6, 100. * written / raw))
+			print('[Info] {:.2f} s ({:.0f} MB/s of capture)'.format(elapsed, raw / 1e6 / max(elapsed, 1e-9)))
+		elif args.command == 'unpack':
+			with ContainerReader(args.container) as container:
+				if args.time_from is None and args.time_to is None and args.kind == 'all':
+					packets = container.to_pcap(args.out)
+				else:
+					first, last = float(container.timestamps[0]), float(container.timestamps[-1])
+					t_from = None if args.time_from is None else parse_time(args.time_from, first, last)
+					t_to = None if args.time_to is None else parse_time(args.time_to, first, last)
+					packets = unpack(container, args.out, parse_kinds(args.kind), t_from, t_to)
+			elapsed = time.perf_counter() - t0
+			print('[Info] packets written: ' + str(packets) + ' in {:.2f} s'.format(elapsed))
+		else:
+			with ContainerReader(args.container) as container:
+				kinds = container.classify()['kind']
+				print('[Info] codec: ' + container.codec + ' (level ' + str(container.level) + '), record header: ' +
+					  str(container.record_header_len) + ' bytes')
+				print('[Info] chunks: ' + str(len(container.chunks)) + ', packets: ' + str(len(container)) +
+					  ' (data ' + str(np.count_nonzero(kinds == KIND_DATA)) + ', position ' +
+					  str(np.count_nonzero(kinds == KIND_POSITION)) + ')')
+				print('[Info] duration: {:.2f} s'.format(container.duration))
+				print('[Info] {:.1f} MB of capture in {:.1f} MB ({:.1f}%)'.format(
+					container.raw_size / 1e6, container.size / 1e6, 100. * container.size / container.raw_size))
+	except (OSError, ValueError, zlib.error, lzma.LZMAError) as e:
+		print('[Error] ' + str(e))
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
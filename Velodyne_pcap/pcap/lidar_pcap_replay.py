@@ -1,166 +1,173 @@
 #!/usr/bin/python
-import time, socket, sys, numpy as np, socket
+"""
+Replay the Velodyne packets of a pcap capture over UDP.
+
+The pcap magic and the record header layout (32 or 64-bit Velodyne_pcap build)
+are detected from the file, so the same script replays every capture.  Each
+packet is sent to the UDP port it was recorded on (2368 for data, 8308 for
+position packets) unless --port is given.
+
+Packets are sent at capture pace by default, --speed=N replays N times faster,
+--max-rate caps the packet rate and --fast sends as fast as possible.  The
+achieved throughput and send-time error are printed at the end.
+
+Chunk-compressed containers (lidar_container.py) are replayed directly: only
+the chunks holding the packets replayed are decompressed, a few MB ahead of
+the send loop.
+
+--from/--to select a time window ("12:30" from the start of the capture,
+"-5:00" from its end, "12:30:00Z" UTC time of day, an ISO date or @epoch).
+The window is located by binary search over the packet index, so replay
+starts right away wherever the window is in the capture.
+
+Usage: lidar_pcap_replay.py <xyz.pcap|xyz.lcap> [--start=<N>] [--end=<N>] [--from=<time>] [--to=<time>]
+                            [--kind=data|position|other|all]
+                            [--host=<ip>] [--port=<N>] [--speed=<N>|--fast] [--max-rate=<N>]
+"""
+import argparse
+import itertools
+import sys
+import time
+
+import numpy as np
+
+from lidar_container import ContainerReader, open_capture
+from pcap_reader import KIND_DATA, KIND_NAMES, KIND_POSITION, parse_time
+from replay_scheduler import ReplayScheduler, ReplayStats, schedule
 
 # ImportError: No module named numpy
 # 	http://stackoverflow.com/questions/7818811/import-error-no-module-named-numpy
 
-def print_help_and_exit():
-	print('Usage: replay_cap.py <xyz.pcap> [--start=<N>|--end=<N>]')
-	sys.exit()
-
-
-if len(sys.argv) < 2:
-	print_help_and_exit()
-
-
-file_name = sys.argv[1]
-try:
-	pcap_file = open(file_name, 'rb')
-except:
-	print_help_and_exit()
-
-# get pcap info
-packet_counter = 0
-
-global_header = pcap_file.read(24)
-while 1:
-	try:
-		# in handler function: sizeof(local_header)=16
-		"""
-		struct pcap_pkthdr {
-			struct timeval ts;	/* time stamp */
-			bpf_u_int32 caplen;	/* length of portion present */
-			bpf_u_int32 len;	/* length this packet (off wire) */
-		};
-
-		struct timeval
-		  {
-		    __time_t tv_sec;		/* Seconds.  */
-		    __suseconds_t tv_usec;	/* Microseconds.  */
-		  };
-
-		__time_t & __suseconds_t following:
-			/* X32 kernel interface is 64-bit.  */
-			#if defined __x86_64__ && defined __ILP32__
-			# define __SYSCALL_SLONG_TYPE	__SQUAD_TYPE
-			# define __SYSCALL_ULONG_TYPE	__UQUAD_TYPE
-			#else
-			# define __SYSCALL_SLONG_TYPE	__SLONGWORD_TYPE
-			# define __SYSCALL_ULONG_TYPE	__ULONGWORD_TYPE
-			#endif
-		__SQUAD_TYPE: __quad_t --> int
-		__UQUAD_TYPE: __u_quad_t --> unsigned int
-		__SLONGWORD_TYPE: long int
-		__ULONGWORD_TYPE: unsigned long int
-		"""
-		packet_header = np.fromstring(pcap_file.read(24), 'uint32')
-		if len(packet_header) < 1:
-			if packet_counter == 0:
-				print('[Error] packet format error: bad file or use 32-bit replayer')
-				pcap_file.close()
-				sys.exit()
-			else:
-				break
-
-		timestamp = packet_header[0] + packet_header[1]/1e6
-		
-		if packet_counter == 0:
-			start_time = timestamp
-
-		duration = timestamp - start_time
-
-		size = packet_header[2]
-		if size != 114:
-			pcap_file.read(size)
-			continue
-		pcap_file.read(114)
-
-		packet_counter += 1
-	except KeyboardInterrupt:
-		break
-
-pcap_file.close()
-if duration < 0.:
-	print('[Error] packet format error: bad file or use 32-bit replayer')
-	sys.exit()
-
-print('[Info] packet\'s #: ' + str(packet_counter))
-print('[Info] duration: ' + str(int(duration/60)) + ':' + "{:.2f}".format(duration%60))
-
-# replay pcap file
-START = 1
-END  = 1000000000
-try:
-	for arg in sys.argv[2:]:
-		if arg.startswith('--start='):
-			START = int(arg[8:])
-		elif arg.startswith('--end='):
-			END = int(arg[6:])
-except:
-	print_help_and_exit()
-
-replay_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-ADDR = ('127.0.0.1', 3000)
-
-try:
-	pcap_file = open(file_name, 'rb')
-except:
-	print_help_and_exit()
-
-packet_index = 0
-last_duration = 0.
-global_header = pcap_file.read(24)
-while 1:
+def format_duration(duration):
+	return str(int(duration/60)) + ':' + "{:.2f}".format(duration%60)
+
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description='Replay Velodyne packets from a pcap capture')
+	parser.add_argument('pcap', help='Capture recorded by Velodyne_pcap (any build) or tcpdump, or a container.')
+	parser.add_argument('--start', type=int, default=1, help='First packet to replay (1-based).')
+	parser.add_argument('--end', type=int, default=None, help='Last packet to replay.')
+	parser.add_argument('--from', dest='time_from', default=None,
+						help='Start of the time window: [[H:]M:]S from the start (negative: from the end), '
+							 'HH:MM:SSZ (UTC), YYYY-MM-DDTHH:MM:SS (UTC) or @epoch.')
+	parser.add_argument('--to', dest='time_to', default=None, help='End of the time window (same formats).')
+	parser.add_argument('--kind', default='data,position',
+						help='Comma separated packet classes to replay: data, position, other or all.')
+	parser.add_argument('--host', default='127.0.0.1', help='Receiver IP.')
+	parser.add_argument('--port', type=int, default=None,
+						help='Receiver port for every packet (default: recorded destination port).')
+	parser.add_argument('--speed', type=float, default=1., help='Replay speed multiplier (default: real time).')
+	parser.add_argument('--fast', action='store_true', help='Replay as fast as possible.')
+	parser.add_argument('--max-rate', type=float, default=None, help='Maximum packets per second.')
+	args = parser.parse_args(argv)
+	if args.speed <= 0:
+		parser.error('--speed must be positive')
+	if args.fast:
+		args.speed = float('inf')
+	if args.kind == 'all':
+		args.kinds = tuple(KIND_NAMES.values())
+	else:
+		try:
+			args.kinds = tuple(KIND_NAMES[k] for k in args.kind.split(','))
+		except KeyError:
+			parser.error('unknown packet class in --kind=%s' % args.kind)
+	return args
+
+
+def main(argv=None):
+	args = parse_args(sys.argv[1:] if argv is None else argv)
 	try:
-		packet_header = np.fromstring(pcap_file.read(24), 'uint32')
-		if len(packet_header) < 1:
+		reader = open_capture(args.pcap)
+	except (OSError, ValueError) as e:
+		print('[Error] ' + str(e))
+		sys.exit(1)
+
+	selected = reader.select(args.kinds)
+	kinds = reader.classify()['kind'][selected]
+	packet_counter = len(selected)
+	if packet_counter == 0:
+		print('[Error] no packets of the requested kind in ' + args.pcap)
+		reader.close()
+		sys.exit(1)
+
+	timestamps = reader.timestamps[selected]
+	print('[Info] record header: ' + str(reader.record_header_len) + ' bytes')
+	print('[Info] data packets: ' + str(np.count_nonzero(kinds == KIND_DATA)) +
+		  ', position packets: ' + str(np.count_nonzero(kinds == KIND_POSITION)))
+	print('[Info] packet\'s #: ' + str(packet_counter))
+	print('[Info] duration: ' + format_duration(timestamps[-1] - timestamps[0]))
+
+	if args.time_from is not None or args.time_to is not None:
+		first_ts, last_ts = float(reader.timestamps[0]), float(reader.timestamps[-1])
+		try:
+			t_from = None if args.time_from is None else parse_time(args.time_from, first_ts, last_ts)
+			t_to = None if args.time_to is None else parse_time(args.time_to, first_ts, last_ts)
+		except ValueError as e:
+			print('[Error] ' + str(e))
+			reader.close()
+			sys.exit(1)
+		first, last = reader.locate(t_from, t_to)
+		window = np.searchsorted(selected, [first, last])
+		print('[Info] window: ' + format_duration(reader.timestamps[first] - first_ts if first < len(reader) else reader.duration) +
+			  ' to ' + format_duration(reader.timestamps[last - 1] - first_ts if last > first else 0.) +
+			  ' (' + str(window[1] - window[0]) + ' packets)')
+		selected = selected[window[0]:window[1]]
+	else:
+		window = (0, len(selected))
+	start = max(args.start, 1) - 1
+	selected = selected[start:args.end]
+	if len(selected) == 0:
+		print('[Error] no packets to replay in the requested window')
+		reader.close()
+		sys.exit(1)
+	start += int(window[0])
+	info = reader.classify()[selected]
+	timestamps = reader.timestamps[selected]
+	if args.port is None:
+		ports, dest = np.unique(info['dport'], return_inverse=True)
+		addresses = [(args.host, int(port)) for port in ports]
+	else:
+		dest = None
+		addresses = [(args.host, args.port)]
+
+	scheduler = ReplayScheduler(speed=args.speed, max_rate=args.max_rate)
+	print('[Replaying] started...')
+	if isinstance(reader, ContainerReader):
+		parts = ((part.buf, part.index[rows], part.classify()[rows]) for part, rows in reader.segments(selected))
+	else:
+		parts = iter([(reader.buf, reader.index[selected], info)])
+	# one schedule for the whole replay, followed part after part from the
+	# moment the first part is ready
+	deadlines = schedule(timestamps, args.speed, args.max_rate)
+	first_part = next(parts)
+	clock_start = time.monotonic()
+	results = []
+	sent = 0
+	for buf, index, part_info in itertools.chain([first_part], parts):
+		replayed = index['ts'][0] - timestamps[0]
+		progress = lambda count, duration, replayed=replayed: \
+			print('[Replaying] time replayed: ' + format_duration(replayed + duration))
+		part = slice(sent, sent + len(index))
+		stats = scheduler.run(buf, index['offset'] + part_info['payload'], index['caplen'] - part_info['payload'],
+							  index['ts'], addresses, dest=None if dest is None else dest[part], progress=progress,
+							  deadlines=deadlines[part], start=clock_start)
+		results.append(stats)
+		sent += stats.sent
+		if stats.interrupted:
 			break
-
-		timestamp = packet_header[0] + packet_header[1]/1e6
-		if packet_index == 0:
-			start_timestamp = timestamp
-
-		duration = timestamp - start_timestamp
-
-		size = packet_header[2]
-		if size != 114:
-			pcap_file.read(size)
-			continue
-
-		packet = pcap_file.read(114)
-		data = packet[42:]
-
-		packet_index += 1
-		if packet_index < START:
-			continue		
-		if packet_index > END:
-			break
-
-		cur_time = time.time()
-		if packet_index > 1:
-			sleep_time = (timestamp-last_timestamp) - (cur_time-last_time)
-			# sleep_time<0 ==> replay delayed ==> replay immediately
-			time.sleep(max(0, sleep_time))
-		else:
-			print('[Replaying] started...')
-
-		replay_socket.sendto(data, ADDR)
-
-		last_timestamp = timestamp
-		last_time = cur_time
-
-		if (duration-last_duration) > 12.88:
-			print('[Replaying] time replayed: ' + str(int(duration/60)) + ':' + "{:.2f}".format(duration%60))
-			last_duration = duration
-
-	except KeyboardInterrupt:
-		break
-
-pcap_file.close()
-print('')
-if packet_index < packet_counter:
-	print('[Stopped] # of packet replayed: ' + str(packet_index))
-	print('[Stopped] time replayed: ' + str(int(duration/60)) + ':' + "{:.2f}".format(duration%60))
-else:
-	print('[Finished] # of packet replayed: ' + str(packet_index))
-	print('[Finished] time replayed: ' + str(int(duration/60)) + ':' + "{:.2f}".format(duration%60))
\ No newline at end of file
+	if isinstance(reader, ContainerReader):
+		parts.close()		# stops the decompression ahead
+	stats = ReplayStats.merge(results)
+	reader.close()
+
+	duration = timestamps[stats.sent - 1] - timestamps[0] if stats.sent else 0.
+	print('')
+	status = '[Stopped]' if stats.interrupted else '[Finished]'
+	print(status + ' # of packet replayed: ' + str(start + stats.sent))
+	print(status + ' time replayed: ' + format_duration(duration))
+	for line in stats.summary().splitlines():
+		print('[Info] ' + line)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,471 @@
+#!/usr/bin/python
+"""
+Capture the Velodyne UDP streams into rotating pcap segments.
+
+Alternative to Velodyne_pcap.cpp that needs neither libpcap nor root: the
+data (2368) and position (8308) ports are read with recvfrom_into straight
+into a preallocated batch buffer, each datagram is framed as a standard pcap
+record (16-byte header, synthesized Ethernet/IPv4/UDP headers) in place, and
+full batches are handed to a writer thread that writes them with one call.
+
+The capture is cut into segments by size and/or duration, so a USB hiccup
+late in a flight only affects the open segment.  Each closed segment gets
+its packet index (`<segment>.idx.npz`, see pcap_reader.py) and a summary
+(`<segment>.json`) with the packets lost by the sensor stream, counted from
+gaps in the VLP-16 data packet timestamps.  With --compress, segments are
+written as chunk-compressed containers (lidar_container.py), which carry
+their own index, to spare the USB write bandwidth.
+
+Usage:
+------
+$ python3 pcap_capture.py --out /media/usb/pcap/flight [--segment_size=1G] [--segment_duration=600] [--compress=zlib]
+$ python3 pcap_capture.py --out /tmp/check/capture --replay=<capture.pcap> [--speed=N] [--max_rate=N]   # loopback test
+"""
+import argparse
+import json
+import os
+import queue
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from pcap_reader import DATA_PAYLOAD_LEN, INDEX_DTYPE, PCAP_MAGIC, VELODYNE_DATA_PORT, VELODYNE_POSITION_PORT, write_index
+from lidar_container import CONTAINER_SUFFIX, ContainerWriter, open_capture
+from pcap_tools import parse_size
+from vlp16_decoder import RETURN_MODE_DUAL, lost_packets
+
+RECORD_HEADER = struct.Struct('<IIII')
+RECORD_HEADER_LEN = RECORD_HEADER.size
+FRAME_HEADER_LEN = 42                    # Ethernet + IPv4 + UDP
+MAX_PAYLOAD = 1500
+SNAPLEN = 65535
+GLOBAL_HEADER = struct.pack('<IHHiIII', PCAP_MAGIC, 2, 4, 0, 0, SNAPLEN, 1)
+
+DATA_TIMESTAMP = 1200                    # us past the hour, then the return mode
+DATA_MODE = 1204
+
+
+def udp_frame_header(payload_len, sport, dport, src=(192, 168, 1, 201), dst=(255, 255, 255, 255)):
+	"""
+	Ethernet + IPv4 + UDP headers (42 bytes) of a sensor datagram.
+	"""
+	eth = b'\xff' * 6 + b'\x60\x76\x88\x00\x00\x00' + b'\x08\x00'
+	ip = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 28 + payload_len, 0, 0x4000, 64, 17, 0, bytes(src), bytes(dst))
+	checksum = sum(struct.unpack('>10H', ip))
+	checksum = (checksum & 0xFFFF) + (checksum >> 16)
+	ip = ip[:10] + struct.pack('>H', ~checksum & 0xFFFF) + ip[12:]
+	udp = struct.pack('>HHHH', sport, dport, 8 + payload_len, 0)
+	return eth + ip + udp
+
+
+class Batch:
+	"""
+	Preallocated buffer of consecutive pcap records and where they start.
+	"""
+
+	def __init__(self, size):
+		self.buf = bytearray(size)
+		self.view = memoryview(self.buf)
+		self.records = []        # (record offset, payload length, timestamp)
+		self.fill = 0
+		self.started = None
+
+	def reset(self):
+		self.records.clear()
+		self.fill = 0
+		self.started = None
+
+
+class SegmentWriter:
+	"""
+	Writer thread side: appends batches to the open segment, rotates it and
+	closes it with its index and summary.
+
+	Parameters:
+	-----------
+	prefix: str
+		Segments are written to `<prefix>_<UTC start>_<nnn>.pcap`.
+	segment_size: int
+		Bytes of capture after which a new segment is started (None: no limit).
+	segment_duration: float
+		Seconds after which a new segment is started (None: no limit).
+	fsync_interval: float
+		Seconds between two fsync of the open segment.
+	codec: str
+		Write chunk-compressed containers (`.lcap`, see lidar_container.py)
+		with this codec ('zlib' or 'lzma') instead of pcap files.
+	level: int
+		Compression level of `codec`.
+	"""
+
+	def __init__(self, prefix, segment_size=None, segment_duration=None, fsync_interval=5., codec=None, level=None):
+		self.prefix = prefix
+		self.codec = codec
+		self.level = level
+		self.segment_size = segment_size
+		self.segment_duration = segment_duration
+		self.fsync_interval = fsync_interval
+		self.segments = []
+		self.lost = 0
+		self.dropped = 0				# packets of the batches that could not be written
+		self._file = None
+		self._last_data_ts = None
+
+	def _open(self, first_ts):
+		stamp = time.strftime('%Y%m%d_%H%M%S', time.gmtime(first_ts))
+		self._size = len(GLOBAL_HEADER)
+		self._indexes = []
+		self._first_ts = first_ts
+		self._last_ts = first_ts
+		self._segment_lost = 0
+		self._segment_dropped = 0
+		self._synced = time.monotonic()
+		if self.codec is None:
+			self.path = '%s_%s_%03d.pcap' % (self.prefix, stamp, len(self.segments))
+			self._file = open(self.path, 'wb', buffering=0)
+			self._file.write(GLOBAL_HEADER)
+		else:
+			self.path = '%s_%s_%03d%s' % (self.prefix, stamp, len(self.segments), CONTAINER_SUFFIX)
+			self._file = ContainerWriter(self.path, GLOBAL_HEADER, RECORD_HEADER_LEN, self.codec, self.level)
+
+	def close_segment(self):
+		if self._file is None:
+			return
+		self._sync()
+		self._file.close()
+		self._file = None
+		index = np.concatenate(self._indexes) if self._indexes else np.empty(0, dtype=INDEX_DTYPE)
+		if self.codec is None:
+			write_index(self.path, index, RECORD_HEADER_LEN, self._size)
+		summary = {'path': self.path, 'packets': len(index), 'bytes': self._size, 'stored': os.path.getsize(self.path),
+				   'lost': self._segment_lost, 'dropped': self._segment_dropped, 'first_ts': self._first_ts,
+				   'last_ts': self._last_ts}
+		with open(self.path + '.json', 'w') as f:
+			json.dump(summary, f, indent=1)
+		self.segments.append(summary)
+		print('[Capture] ' + self.path + ': ' + str(summary['packets']) + ' packets, ' +
+			  str(summary['lost']) + ' lost, ' + str(summary['dropped']) + ' dropped')
+
+	def _abandon_segment(self):
+		"""
+		Close the open segment after a failed write, cut back to its last
+		complete batch so the file matches its index.  The next batch opens
+		a new segment.
+		"""
+		try:
+			if self.codec is None:
+				self._file.truncate(self._size)
+			self.close_segment()
+		except OSError as e:
+			print('[Capture] ' + self.path + ': segment not closed cleanly: ' + str(e))
+			if self._file is not None:
+				try:
+					self._file.close()
+				except OSError:
+					pass
+				self._file = None
+
+	def _rotate_due(self, batch_ts, batch_size):
+		if self._file is None:
+			return True
+		if self.segment_duration is not None and batch_ts - self._first_ts >= self.segment_duration:
+			return True
+		return self.segment_size is not None and self._size > len(GLOBAL_HEADER) and \
+			   self._size + batch_size > self.segment_size
+
+	def write(self, batch):
+		if not batch.records:
+			return
+		offsets, lengths, stamps = (np.array(column) for column in zip(*batch.records))
+		try:
+			if self._rotate_due(stamps[0], batch.fill):
+				self.close_segment()
+				self._open(stamps[0])
+			self._file.write(batch.view[:batch.fill])
+		except OSError:
+			self.dropped += len(offsets)
+			# the dropped packets are not sensor losses
+			self._last_data_ts = None
+			if self._file is not None:
+				self._segment_dropped += len(offsets)
+				self._abandon_segment()
+			raise
+
+		index = np.empty(len(offsets), dtype=INDEX_DTYPE)
+		index['offset'] = self._size + offsets + RECORD_HEADER_LEN
+		index['caplen'] = lengths + FRAME_HEADER_LEN
+		sec = np.floor(stamps)
+		index['ts'] = sec + ((stamps - sec) * 1e6).astype(np.int64) / 1e6      # as stored in the record headers
+		self._indexes.append(index)
+		self._size += batch.fill
+		self._last_ts = float(stamps[-1])
+
+		# sensor-side losses: gaps between consecutive data packet timestamps
+		data = offsets[lengths == DATA_PAYLOAD_LEN] + RECORD_HEADER_LEN + FRAME_HEADER_LEN
+		if len(data):
+			raw = np.frombuffer(batch.buf, dtype=np.uint8)
+			sensor_ts = raw[data[:, None] + DATA_TIMESTAMP + np.arange(4)].copy().view('<u4').ravel()
+			dual = raw[data[-1] + DATA_MODE] == RETURN_MODE_DUAL
+			lost = lost_packets(sensor_ts, self._last_data_ts, dual)
+			self._last_data_ts = int(sensor_ts[-1])
+			self.lost += lost
+			self._segment_lost += lost
+
+		if time.monotonic() - self._synced >= self.fsync_interval:
+			try:
+				self._sync()
+			except OSError:
+				self._abandon_segment()
+				raise
+			self._synced = time.monotonic()
+
+	def _sync(self):
+		if self.codec is None:
+			self._file.flush()
+			os.fsync(self._file.fileno())
+		else:
+			self._file.flush()		# compresses what is pending
+			self._file.sync()
+
+
+class UdpCapture:
+	"""
+	Receive Velodyne datagrams into pcap segments.
+
+	Parameters:
+	-----------
+	prefix: str
+		Output location prefix (see SegmentWriter).
+	ports: list
+		UDP ports to listen on (data and position ports by default).
+	host: str
+		Local address to bind ("" for all interfaces).
+	batch_size: int
+		Bytes per batch buffer (one write per batch).
+	batches: int
+		Preallocated batch buffers: the receiver keeps going while the writer
+		thread is writing up to `batches - 1` of them.
+	flush_interval: float
+		A partly filled batch is written after this many seconds.
+	rcvbuf: int
+		Kernel receive buffer requested per socket (bytes).
+	segment_size, segment_duration, fsync_interval, codec, level:
+		See SegmentWriter.
+
+	Example:
+	--------
+	>>> capture = UdpCapture('/media/usb/pcap/flight', segment_duration=600)
+	>>> capture.run()           # until stop() or Ctrl+C
+	>>> print(capture.summary())
+	"""
+
+	def __init__(self, prefix, ports=(VELODYNE_DATA_PORT, VELODYNE_POSITION_PORT), host='',
+				 batch_size=4 << 20, batches=4, flush_interval=1., rcvbuf=8 << 20,
+				 segment_size=None, segment_duration=None, fsync_interval=5., codec=None, level=None):
+		self.writer = SegmentWriter(prefix, segment_size, segment_duration, fsync_interval, codec, level)
+		self.flush_interval = flush_interval
+		self.received = 0
+		self.received_bytes = 0
+		self.stalls = 0
+		self.truncated = 0
+		self._free = queue.Queue()
+		for _ in range(batches):
+			self._free.put(Batch(batch_size))
+		self._full = queue.Queue()
+		self._stop = threading.Event()
+		self._headers = {}
+		self._sockets = []
+		for port in ports:
+			sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+			sock.bind((host, port))
+			sock.setblocking(False)
+			self._sockets.append(sock)
+		self._thread = None
+
+	def _frame_header(self, addr, dport, length):
+		key = (addr, dport, length)
+		header = self._headers.get(key)
+		if header is None:
+			src = socket.inet_aton(addr[0])
+			header = self._headers[key] = udp_frame_header(length, addr[1], dport, src)
+		return header
+
+	def _write_loop(self):
+		while True:
+			batch = self._full.get()
+			if batch is None:
+				break
+			try:
+				self.writer.write(batch)
+			except OSError as e:
+				print('[Capture] write failed: ' + str(e))
+			batch.reset()
+			self._free.put(batch)
+		self.writer.close_segment()
+
+	def _next_batch(self):
+		try:
+			return self._free.get_nowait()
+		except queue.Empty:
+			# the writer is behind: datagrams wait in the kernel buffer meanwhile
+			self.stalls += 1
+			return self._free.get()
+
+	def _submit(self, batch):
+		self._full.put(batch)
+		return self._next_batch()
+
+	def run(self, duration=None):
+		"""
+		Capture until stop(), Ctrl+C or `duration` seconds.
+		"""
+		self._thread = threading.Thread(target=self._write_loop, name='SegmentWriter', daemon=True)
+		self._thread.start()
+		selector = selectors.DefaultSelector()
+		for sock in self._sockets:
+			selector.register(sock, selectors.EVENT_READ, sock.getsockname()[1])
+		batch = self._next_batch()
+		reserve = RECORD_HEADER_LEN + FRAME_HEADER_LEN + MAX_PAYLOAD
+		clock = time.monotonic
+		now = time.time
+		pack_into = RECORD_HEADER.pack_into
+		end = None if duration is None else clock() + duration
+		try:
+			while not self._stop.is_set() and (end is None or clock() < end):
+				for key, _ in selector.select(0.1):
+					sock, dport = key.fileobj, key.data
+					recvfrom_into = sock.recvfrom_into
+					while True:
+						if len(batch.buf) - batch.fill < reserve:
+							batch = self._submit(batch)
+						pos = batch.fill
+						payload = pos + RECORD_HEADER_LEN + FRAME_HEADER_LEN
+						try:
+							length, addr = recvfrom_into(batch.view[payload:payload + MAX_PAYLOAD])
+						except BlockingIOError:
+							break
+						ts = now()
+						if length == MAX_PAYLOAD:
+							self.truncated += 1
+						sec = int(ts)
+						pack_into(batch.buf, pos, sec, int((ts - sec) * 1e6), length + FRAME_HEADER_LEN,
+								  length + FRAME_HEADER_LEN)
+						batch.buf[pos + RECORD_HEADER_LEN:payload] = self._frame_header(addr, dport, length)
+						batch.records.append((pos, length, ts))
+						batch.fill = payload + length
+						if batch.started is None:
+							batch.started = clock()
+						self.received += 1
+						self.received_bytes += length
+				if batch.started is not None and clock() - batch.started >= self.flush_interval:
+					batch = self._submit(batch)
+		except KeyboardInterrupt:
+			pass
+		finally:
+			selector.close()
+			self._full.put(batch)
+			self._full.put(None)
+			self._thread.join()
+			for sock in self._sockets:
+				sock.close()
+		return self.summary()
+
+	def stop(self):
+		self._stop.set()
+
+	def summary(self):
+		return ('received: {} packets ({:.1f} MB), lost by the sensor stream: {}, dropped (write errors): {}, '
+				'writer stalls: {}, segments: {}'.format(self.received, self.received_bytes / 1e6, self.writer.lost,
+														 self.writer.dropped, self.stalls, len(self.writer.segments)))
+
+
+def replay_check(capture, pcap, speed, max_rate=None):
+	"""
+	Replay a capture to the local ports while capturing it, then compare the
+	payloads captured with the payloads sent.
+	"""
+	from pcap_reader import KIND_DATA, KIND_POSITION, PcapReader
+	from replay_scheduler import ReplayScheduler
+
+	reader = PcapReader(pcap)
+	selected = reader.select((KIND_DATA, KIND_POSITION))
+	info = reader.classify()[selected]
+	index = reader.index[selected]
+	ports, dest = np.unique(info['dport'], return_inverse=True)
+	addresses = [('127.0.0.1', int(port)) for port in ports]
+
+	thread = threading.Thread(target=capture.run, name='UdpCapture')
+	thread.start()
+	time.sleep(0.2)
+	stats = ReplayScheduler(speed=speed, max_rate=max_rate).run(reader.buf, index['offset'] + info['payload'],
+											 index['caplen'] - info['payload'], index['ts'], addresses, dest=dest)
+	time.sleep(0.5)
+	capture.stop()
+	thread.join()
+	print('[Replay] ' + stats.summary().replace('\n', '\n[Replay] '))
+
+	sent = {}
+	for i, (offset, caplen) in enumerate(zip((index['offset'] + info['payload']).tolist(), index['caplen'].tolist())):
+		sent[hash(bytes(reader.buf[offset:offset + caplen - int(info['payload'][i])]))] = i
+	matched = 0
+	for segment in capture.writer.segments:
+		with open_capture(segment['path']) as out:
+			for packet in out.packets():
+				matched += hash(bytes(packet.payload)) in sent
+	# gaps already present in the replayed capture are counted as lost too
+	data = (index['offset'] + info['payload'])[info['kind'] == KIND_DATA]
+	raw = np.frombuffer(reader.buf, dtype=np.uint8)
+	expected = lost_packets(raw[data[:, None] + DATA_TIMESTAMP + np.arange(4)].copy().view('<u4').ravel())
+	del raw
+	reader.close()
+	print('[Check] sent {}, captured {}, identical payloads {}, lost {} (expected {})'.format(
+		stats.sent, capture.received, matched, capture.writer.lost, expected))
+	return matched == stats.sent and capture.writer.lost == expected
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Capture Velodyne UDP packets into rotating pcap segments')
+	parser.add_argument('--out', required=True, help='Segment path prefix (e.g. /media/usb/pcap/flight).')
+	parser.add_argument('--host', default='', help='Local address to bind (default: all interfaces).')
+	parser.add_argument('--ports', default='%d,%d' % (VELODYNE_DATA_PORT, VELODYNE_POSITION_PORT),
+						help='Comma separated UDP ports (data, position).')
+	parser.add_argument('--segment_size', default=None, help='Start a new segment after this size (e.g. 1G).')
+	parser.add_argument('--segment_duration', type=float, default=None, help='Start a new segment after N seconds.')
+	parser.add_argument('--batch_size', default='4M', help='Bytes written per write call.')
+	parser.add_argument('--compress', choices=('zlib', 'lzma'), default=None,
+						help='Write chunk-compressed .lcap segments (see lidar_container.py) instead of pcap.')
+	parser.add_argument('--level', type=int, default=1, help='Compression level of --compress.')
+	parser.add_argument('--duration', type=float, default=None, help='Stop after N seconds.')
+	parser.add_argument('--replay', help='Loopback test: replay this capture to the local ports while capturing.')
+	parser.add_argument('--speed', type=float, default=1., help='Replay speed of --replay.')
+	parser.add_argument('--max_rate', type=float, default=None, help='Packets per second cap of --replay.')
+	args = parser.parse_args()
+	if args.speed <= 0:
+		parser.error('--speed must be positive')
+
+	if os.path.dirname(args.out):
+		os.makedirs(os.path.dirname(args.out), exist_ok=True)
+	try:
+		capture = UdpCapture(args.out, ports=[int(p) for p in args.ports.split(',')], host=args.host,
+							 batch_size=parse_size(args.batch_size),
+							 segment_size=None if args.segment_size is None else parse_size(args.segment_size),
+							 segment_duration=args.segment_duration, codec=args.compress, level=args.level)
+	except (OSError, ValueError) as e:
+		print('[Error] ' + str(e))
+		sys.exit(1)
+	if args.replay:
+		ok = replay_check(capture, args.replay, args.speed, args.max_rate)
+		print('[Capture] ' + capture.summary())
+		sys.exit(0 if ok else 1)
+	t0 = time.monotonic()
+	capture.run(args.duration)
+	elapsed = time.monotonic() - t0
+	print('[Capture] ' + capture.summary())
+	print('[Capture] {:.0f} packets/s'.format(capture.received / max(elapsed, 1e-9)))
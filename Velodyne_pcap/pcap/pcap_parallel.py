@@ -0,0 +1,261 @@
+#!/usr/bin/python
+"""
+Process large pcap captures with a pool of worker processes.
+
+The capture is split into shards of roughly equal size on record boundaries
+(taken from the packet index).  Every worker maps the capture itself, receives
+only its slice of the index, and runs a per-shard task on it.  The per-shard
+results are put back in timestamp order and merged by the task.
+
+Tasks are (work, merge) pairs of picklable top-level functions:
+
+	work(reader, **options) -> result     run in a worker on one shard
+	merge(results, **options) -> result   run in the parent, results in shard order
+
+Usage:
+------
+	stats = run_parallel('flight.pcap', STATS, workers=16)
+	points = run_parallel('flight.pcap', DECODE, workers=16)
+"""
+import argparse
+import collections
+import concurrent.futures
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from pcap_reader import GLOBAL_HEADER_LEN, KIND_DATA, KIND_NAMES, KIND_POSITION, PcapReader
+from pcap_tools import record_spans
+from vlp16_decoder import POINT_DTYPE, decode_reader
+
+Task = collections.namedtuple('Task', ['work', 'merge'])
+Shard = collections.namedtuple('Shard', ['number', 'start', 'stop', 'begin', 'end'])
+
+
+def make_shards(index, count):
+	"""
+	Split an index into `count` shards of roughly equal byte size.
+
+	Returns:
+	--------
+	shards: list
+		Shard(number, start row, stop row, first byte, end byte) tuples.
+	"""
+	if len(index) == 0:
+		return []
+	offsets = index['offset']
+	first = int(offsets[0])
+	last = int(offsets[-1] + index['caplen'][-1])
+	cuts = np.searchsorted(offsets, np.linspace(first, last, count + 1)[1:-1])
+	bounds = np.unique(np.concatenate([[0], cuts, [len(index)]]))
+	shards = []
+	for number, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+		begin = int(offsets[start])
+		end = int(offsets[stop - 1] + index['caplen'][stop - 1])
+		shards.append(Shard(number, int(start), int(stop), begin, end))
+	return shards
+
+
+def _run_shard(path, record_header_len, shard_index, task, options):
+	reader = PcapReader(path, record_header_len=record_header_len, index=shard_index)
+	try:
+		return task.work(reader, **options)
+	finally:
+		reader.close()
+
+
+def run_parallel(path, task, workers=None, shards_per_worker=4, **options):
+	"""
+	Run a task over every shard of a capture and merge the results.
+
+	Parameters:
+	-----------
+	path: str
+		Capture location.
+	task: Task
+		Per-shard work and merge functions (e.g. STATS, DECODE, EXTRACT).
+	workers: int
+		Worker processes. Defaults to the number of CPUs.
+	shards_per_worker: int
+		More shards than workers keeps every worker busy until the end.
+	options:
+		Keyword arguments passed to task.work and task.merge.
+	"""
+	workers = workers or os.cpu_count() or 1
+	with PcapReader(path) as reader:
+		index = reader.index
+		record_header_len = reader.record_header_len
+	shards = make_shards(index, workers * shards_per_worker)
+
+	results = [None] * len(shards)
+	with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+		futures = {pool.submit(_run_shard, path, record_header_len, index[s.start:s.stop], task, options): s
+				   for s in shards}
+		for future in concurrent.futures.as_completed(futures):
+			results[futures[future].number] = future.result()
+
+	# shards are in file order; order them by their first timestamp in case the
+	# capture is not sorted (e.g. concatenated captures)
+	first_ts = [index['ts'][s.start] for s in shards]
+	order = np.argsort(first_ts, kind='stable')
+	return task.merge([results[i] for i in order], **options)
+
+
+# ----------------------------------------------------------------- statistics
+
+def packet_stats(reader, **options):
+	info = reader.classify()
+	ts = reader.timestamps
+	stats = {'packets': len(reader), 'bytes': int(reader.index['caplen'].sum()),
+			 'first_ts': float(ts[0]), 'last_ts': float(ts[-1]), 'max_data_gap': 0.}
+	for name, kind in KIND_NAMES.items():
+		stats[name] = int(np.count_nonzero(info['kind'] == kind))
+	data_ts = ts[info['kind'] == KIND_DATA]
+	if len(data_ts) > 1:
+		stats['max_data_gap'] = float(np.diff(data_ts).max())
+	stats['data_ts'] = (float(data_ts[0]), float(data_ts[-1])) if len(data_ts) else None
+	return stats
+
+
+def merge_stats(results, **options):
+	merged = {'packets': 0, 'bytes': 0, 'max_data_gap': 0.}
+	for name in KIND_NAMES:
+		merged[name] = 0
+	merged['first_ts'] = min(r['first_ts'] for r in results)
+	merged['last_ts'] = max(r['last_ts'] for r in results)
+	last_data_ts = None
+	for r in results:
+		for key in ['packets', 'bytes'] + list(KIND_NAMES):
+			merged[key] += r[key]
+		merged['max_data_gap'] = max(merged['max_data_gap'], r['max_data_gap'])
+		if r['data_ts'] is not None:
+			# gap across the shard boundary
+			if last_data_ts is not None:
+				merged['max_data_gap'] = max(merged['max_data_gap'], r['data_ts'][0] - last_data_ts)
+			last_data_ts = r['data_ts'][1]
+	merged['duration'] = merged['last_ts'] - merged['first_ts']
+	return merged
+
+
+# ------------------------------------------------------------------- decoding
+
+def _part_name(reader, out, suffix=''):
+	first = int(reader.index['offset'][0]) if len(reader) else 0
+	return '%s.part%012d%s' % (out, first, suffix)
+
+
+def decode_points(reader, out=None, **options):
+	"""
+	Decode the data packets of a shard.  With `out`, the points are saved to a
+	part file instead of being sent back to the parent process, which avoids
+	pickling hundreds of MB per shard.
+	"""
+	chunks = list(decode_reader(reader))
+	points = np.concatenate(chunks) if chunks else np.empty(0, dtype=POINT_DTYPE)
+	if out is None:
+		return points
+	part = _part_name(reader, out, '.npy')
+	np.save(part, points)
+	return part, len(points)
+
+
+def merge_points(results, out=None, **options):
+	if out is None:
+		points = np.concatenate(results) if results else np.empty(0, dtype=POINT_DTYPE)
+		ts = points['timestamp']
+		if len(ts) > 1 and np.any(ts[1:] < ts[:-1]):
+			points = points[np.argsort(ts, kind='stable')]
+		return points
+
+	total = sum(count for _, count in results)
+	points = np.lib.format.open_memmap(out, mode='w+', dtype=POINT_DTYPE, shape=(total,))
+	pos = 0
+	for part, count in results:
+		points[pos:pos + count] = np.load(part, mmap_mode='r')
+		os.remove(part)
+		pos += count
+	points.flush()
+	return total
+
+
+# ----------------------------------------------------------------- extraction
+
+def extract_records(reader, out=None, kinds=(KIND_DATA, KIND_POSITION), t_from=None, t_to=None, **options):
+	"""
+	Write the records of the selected packets to `<out>.part<first byte>` and
+	return the part name with its packet count.
+	"""
+	rows = reader.select(kinds)
+	ts = reader.timestamps[rows]
+	if t_from is not None:
+		rows = rows[ts >= t_from]
+		ts = reader.timestamps[rows]
+	if t_to is not None:
+		rows = rows[ts < t_to]
+	part = _part_name(reader, out)
+	view = memoryview(reader.buf)
+	with open(part, 'wb') as f:
+		# one write per run of adjacent records
+		for begin, end in zip(*(a.tolist() for a in record_spans(reader, rows))):
+			f.write(view[begin:end])
+	view.release()
+	return part, len(rows), bytes(reader.buf[:GLOBAL_HEADER_LEN])
+
+
+def merge_extracted(results, out=None, **options):
+	packets = 0
+	with open(out, 'wb') as f:
+		if results:
+			f.write(results[0][2])
+		for part, count, _ in results:
+			with open(part, 'rb') as p:
+				shutil.copyfileobj(p, f, 1 << 22)
+			os.remove(part)
+			packets += count
+	return packets
+
+
+STATS = Task(packet_stats, merge_stats)
+DECODE = Task(decode_points, merge_points)
+EXTRACT = Task(extract_records, merge_extracted)
+TASKS = {'stats': STATS, 'decode': DECODE, 'extract': EXTRACT}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Process a pcap capture with a pool of worker processes')
+	parser.add_argument('pcap', help='Capture to process.')
+	parser.add_argument('--task', choices=sorted(TASKS), default='stats')
+	parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count).')
+	parser.add_argument('--out', help='Output file (.npy points for decode, .pcap for extract).')
+	parser.add_argument('--kind', default='data,position', help='Packet classes to extract.')
+	args = parser.parse_args()
+
+	options = {}
+	if args.task == 'extract':
+		if not args.out:
+			parser.error('--out is required to extract')
+		options = {'out': args.out, 'kinds': tuple(KIND_NAMES[k] for k in args.kind.split(','))}
+	elif args.task == 'decode' and args.out:
+		options = {'out': args.out}
+
+	t0 = time.perf_counter()
+	try:
+		result = run_parallel(args.pcap, TASKS[args.task], workers=args.workers, **options)
+	except (OSError, ValueError) as e:
+		print('[Error] ' + str(e))
+		sys.exit(1)
+	elapsed = time.perf_counter() - t0
+
+	if args.task == 'stats':
+		for key in ['packets', 'bytes', 'data', 'position', 'other', 'duration', 'max_data_gap']:
+			print('[Info] ' + key + ': ' + str(result[key]))
+	elif args.task == 'decode' and args.out:
+		print('[Info] points: ' + str(result) + ' -> ' + args.out)
+	elif args.task == 'decode':
+		print('[Info] points: ' + str(len(result)))
+	else:
+		print('[Info] packets extracted: ' + str(result) + ' -> ' + args.out)
+	print('[Info] done in {:.2f} s'.format(elapsed))
@@ -0,0 +1,507 @@
+#!/usr/bin/python
+"""
+Memory-mapped pcap reader with a persistent packet index.
+
+The capture is never read with small file reads: the file is mapped once and
+every record header is located with strided NumPy views over the mapping, so
+indexing a multi-GB capture costs one sequential pass over the headers.  The
+resulting index (offset, caplen, timestamp of every record) is stored next to
+the capture as ``<capture>.idx.npz`` and reused on later runs.
+
+The pcap magic (micro/nanosecond timestamps, either byte order) and the record
+header layout written by the 32 or 64-bit builds of Velodyne_pcap.cpp are
+detected from the file itself.
+
+Usage:
+------
+	with PcapReader('flight.pcap') as reader:
+		print(len(reader), reader.duration)
+		for packet in reader.packets(kinds=(KIND_DATA,)):
+			handle(packet.ts, packet.payload)
+"""
+import collections
+import datetime
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+GLOBAL_HEADER_LEN = 24
+RECORD_HEADER_LENS = (16, 24)
+LINKTYPE_ETHERNET = 1
+INDEX_SUFFIX = '.idx.npz'
+INDEX_VERSION = 1
+
+# offset: position of the packet data (just after its record header)
+INDEX_DTYPE = np.dtype([('offset', '<i8'), ('caplen', '<u4'), ('ts', '<f8')])
+
+# number of records checked at once while scanning a run of equal-sized packets
+_MIN_WINDOW = 4096
+_MAX_WINDOW = 1 << 20
+
+# number of records walked to decide the record header layout
+_DETECT_RECORDS = 16
+
+# Velodyne packet classes (see PcapReader.classify)
+KIND_OTHER = 0
+KIND_DATA = 1
+KIND_POSITION = 2
+KIND_NAMES = {'other': KIND_OTHER, 'data': KIND_DATA, 'position': KIND_POSITION}
+
+VELODYNE_DATA_PORT = 2368
+VELODYNE_POSITION_PORT = 8308
+DATA_PAYLOAD_LEN = 1206
+POSITION_PAYLOAD_LEN = 512
+ETH_HEADER_LEN = 14
+UDP_HEADER_LEN = 8
+
+PACKET_INFO_DTYPE = np.dtype([('kind', 'u1'), ('sport', '<u2'), ('dport', '<u2'), ('payload', '<u4')])
+
+Packet = collections.namedtuple('Packet', ['ts', 'kind', 'sport', 'dport', 'payload'])
+
+
+def _record_layout(record_header_len):
+	"""
+	Field positions inside a record header.
+
+	Velodyne_pcap.cpp dumps the in-memory `struct pcap_pkthdr`, so the header is
+	16 bytes (32-bit timeval) on 32-bit builds and 24 bytes (64-bit timeval) on
+	64-bit builds.
+
+	Returns:
+	--------
+	(sec_dtype, frac_pos, frac_dtype, caplen_pos, len_pos)
+	"""
+	if record_header_len == 16:
+		return 'u4', 4, 'u4', 8, 12
+	elif record_header_len == 24:
+		return 'i8', 8, 'i8', 16, 20
+	raise ValueError('unsupported record header length: %d' % record_header_len)
+
+
+def index_path(path):
+	return path + INDEX_SUFFIX
+
+
+def write_index(path, index, record_header_len, size=None, end=None):
+	"""
+	Save the sidecar index of a capture, e.g. of a capture written by
+	pcap_tools.py whose index is known without scanning it.
+	"""
+	size = os.path.getsize(path) if size is None else size
+	end = size if end is None else end
+	meta = np.array([INDEX_VERSION, record_header_len, size, end], dtype=np.int64)
+	with open(index_path(path), 'wb') as f:
+		np.savez(f, meta=meta, index=index)
+
+
+_OFFSET = re.compile(r'^(-)?(?:(?:(\d+):)?(\d+):)?(\d+(?:\.\d*)?)$')
+_TIME_OF_DAY = re.compile(r'^(\d{1,2}):(\d{2}):(\d{2}(?:\.\d*)?)Z$')
+
+
+def parse_time(text, first, last):
+	"""
+	Capture time (epoch s) of a time given on the command line.
+
+	Parameters:
+	-----------
+	text: str
+		"[[H:]M:]S[.f]": offset from the start of the capture (e.g. "12:30"),
+		counted from its end if negative ("-5:00": the last five minutes).
+		"HH:MM:SS[.f]Z": UTC time of day, on the day the capture started.
+		"YYYY-MM-DDTHH:MM:SS[.f]" (or with a space): absolute UTC time.
+		"@<epoch s>": absolute time as a Unix timestamp.
+	first, last: float
+		Timestamps of the first and last packets of the capture.
+	"""
+	text = text.strip()
+	if text.startswith('@'):
+		return float(text[1:])
+	match = _OFFSET.match(text)
+	if match:
+		negative, hours, minutes, seconds = match.groups()
+		offset = int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(seconds)
+		return last - offset if negative else first + offset
+	match = _TIME_OF_DAY.match(text)
+	if match:
+		hours, minutes, seconds = match.groups()
+		day = datetime.datetime.utcfromtimestamp(first).replace(hour=0, minute=0, second=0, microsecond=0)
+		t = (day - datetime.datetime(1970, 1, 1)).total_seconds() + int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+		return t + 86400 if t < first - 1 else t   # capture running past midnight
+	try:
+		stamp = datetime.datetime.fromisoformat(text.rstrip('Z'))
+	except ValueError:
+		raise ValueError('cannot parse time %r (expected [[H:]M:]S, HH:MM:SSZ, an ISO date or @epoch)' % text)
+	if stamp.tzinfo is not None:
+		stamp = stamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+	return (stamp - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def search_timestamps(ts):
+	"""
+	Timestamps made non-decreasing for a binary search: a timestamp going back
+	(host clock step) is replaced by the running maximum.
+	"""
+	return ts if np.all(ts[1:] >= ts[:-1]) else np.maximum.accumulate(ts)
+
+
+def locate_rows(search_ts, start=None, stop=None):
+	"""
+	Rows [first, last) stamped in [start, stop) (None for an open end).
+	"""
+	first = 0 if start is None else int(np.searchsorted(search_ts, start, side='left'))
+	last = len(search_ts) if stop is None else int(np.searchsorted(search_ts, stop, side='left'))
+	return first, max(first, last)
+
+
+def detect_magic(raw):
+	"""
+	Byte order and timestamp resolution from the first 4 bytes of a capture.
+
+	Returns:
+	--------
+	(endian, ts_divisor)
+	"""
+	for endian in '<>':
+		magic, = struct.unpack(endian + 'I', raw[:4])
+		if magic == PCAP_MAGIC:
+			return endian, 1e6
+		if magic == PCAP_MAGIC_NS:
+			return endian, 1e9
+	raise ValueError('unknown pcap magic 0x%s' % bytes(raw[:4]).hex())
+
+
+def _plausible_records(mm, size, endian, ts_divisor, snaplen, record_header_len):
+	"""
+	Number of leading records that parse cleanly with the given header layout,
+	or -1 as soon as one header is inconsistent.
+	"""
+	sec_dt, frac_pos, frac_dt, cap_pos, len_pos = _record_layout(record_header_len)
+	sec_fmt = endian + ('I' if sec_dt == 'u4' else 'q')
+	frac_fmt = endian + ('I' if frac_dt == 'u4' else 'q')
+	len_fmt = endian + 'I'
+	limit = max(snaplen, 262144)
+	pos = GLOBAL_HEADER_LEN
+	count = 0
+	while count < _DETECT_RECORDS and pos + record_header_len <= size:
+		sec, = struct.unpack_from(sec_fmt, mm, pos)
+		frac, = struct.unpack_from(frac_fmt, mm, pos + frac_pos)
+		caplen, = struct.unpack_from(len_fmt, mm, pos + cap_pos)
+		wirelen, = struct.unpack_from(len_fmt, mm, pos + len_pos)
+		if sec < 0 or not 0 <= frac < ts_divisor or caplen == 0 or caplen > limit or caplen > wirelen:
+			return -1
+		pos += record_header_len + caplen
+		if pos > size:
+			break   # truncated last record, still consistent
+		count += 1
+	return count
+
+
+def detect_record_header_len(mm, size, endian, ts_divisor, snaplen):
+	"""
+	Record header layout of a capture: 16 bytes (standard pcap, 32-bit
+	Velodyne_pcap build) or 24 bytes (64-bit Velodyne_pcap build).
+	"""
+	scores = [(_plausible_records(mm, size, endian, ts_divisor, snaplen, n), n) for n in RECORD_HEADER_LENS]
+	best, header_len = max(scores, key=lambda s: (s[0], -s[1]))
+	if best < 0:
+		raise ValueError('unknown pcap record header layout')
+	return header_len
+
+
+class PcapReader:
+	"""
+	Random access to the records of a pcap file through a memory map.
+
+	Attributes:
+	-----------
+	path: str
+		Capture location.
+	record_header_len: int
+		Size of every record header (16 for standard pcap, 24 for captures made
+		by a 64-bit build of Velodyne_pcap). Detected when not given.
+	index: np.ndarray
+		Structured array with INDEX_DTYPE, one row per complete record. A
+		prebuilt index (e.g. one shard of it) can be given to skip the scan.
+	data: buffer
+		Whole capture already in memory (e.g. chunks decompressed from a
+		lidar_container.py file), read instead of mapping `path`. The index
+		of an in-memory capture is never loaded from or saved to disk.
+	"""
+
+	def __init__(self, path, record_header_len=None, use_index=True, save_index=True, index=None, data=None):
+		self.path = path
+		self._info = None
+		self._mm = None
+		self._file = None
+		if data is None:
+			self._file = open(path, 'rb')
+			self.size = os.fstat(self._file.fileno()).st_size
+		else:
+			self.size = len(data)
+			use_index = save_index = False
+		if self.size < GLOBAL_HEADER_LEN:
+			self.close()
+			raise ValueError('%s: file too small to be a pcap capture' % path)
+		if data is None:
+			self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+		else:
+			self._mm = data
+		self.buf = np.frombuffer(self._mm, dtype=np.uint8)
+
+		self._parse_global_header()
+		if record_header_len is None:
+			try:
+				record_header_len = detect_record_header_len(self._mm, self.size, self.endian,
+															 self.ts_divisor, self.snaplen)
+			except ValueError as e:
+				self.close()
+				raise ValueError('%s: %s' % (path, e))
+		self.record_header_len = record_header_len
+
+		self.index = index
+		self._end = None
+		self._search_ts = None
+		if self.index is None and use_index:
+			self.index = self._load_index()
+		if self.index is None:
+			self.index = self._build_index(GLOBAL_HEADER_LEN)
+			if save_index:
+				self.save_index()
+
+	def _parse_global_header(self):
+		try:
+			self.endian, self.ts_divisor = detect_magic(self._mm[:4])
+		except ValueError as e:
+			self.close()
+			raise ValueError('%s: %s' % (self.path, e))
+		_, major, minor, _, _, snaplen, linktype = struct.unpack_from(self.endian + 'IHHiIII', self._mm, 0)
+		self.version = (major, minor)
+		self.snaplen = snaplen
+		self.linktype = linktype
+
+	# ------------------------------------------------------------------ index
+
+	def _build_index(self, start, end=None):
+		"""
+		Locate every complete record between `start` and `end`.
+
+		Packets of a Velodyne capture come in long runs of equal size, so the
+		scan guesses the next `window` record positions from the current caplen
+		and validates all of them with one strided read.  The first position
+		whose caplen differs is, by construction, a true record start and the
+		scan restarts from it.
+		"""
+		end = self.size if end is None else end
+		hdr = self.record_header_len
+		sec_dt, frac_pos, frac_dt, cap_pos, _ = _record_layout(hdr)
+		sec_dt = np.dtype(self.endian + sec_dt)
+		frac_dt = np.dtype(self.endian + frac_dt)
+		cap_dt = np.dtype(self.endian + 'u4')
+		mm = self._mm
+
+		runs = []
+		pos = start
+		window = _MIN_WINDOW
+		while pos + hdr <= end:
+			caplen = int(np.ndarray((), cap_dt, mm, pos + cap_pos))
+			stride = hdr + caplen
+			if pos + stride > end:
+				break   # truncated last record
+			n = min((end - pos) // stride, window)
+			caps = np.ndarray((n,), cap_dt, mm, pos + cap_pos, (stride,))
+			bad = np.flatnonzero(caps != caplen)
+			run = n if bad.size == 0 else int(bad[0])
+			secs = np.ndarray((run,), sec_dt, mm, pos, (stride,))
+			fracs = np.ndarray((run,), frac_dt, mm, pos + frac_pos, (stride,))
+
+			chunk = np.empty(run, dtype=INDEX_DTYPE)
+			chunk['offset'] = pos + hdr + np.arange(run, dtype=np.int64) * stride
+			chunk['caplen'] = caplen
+			chunk['ts'] = secs + fracs / self.ts_divisor
+			runs.append(chunk)
+
+			pos += run * stride
+			window = min(window * 2, _MAX_WINDOW) if run == n else _MIN_WINDOW
+
+		self._end = pos
+		if not runs:
+			return np.empty(0, dtype=INDEX_DTYPE)
+		return np.concatenate(runs)
+
+	def _load_index(self):
+		"""
+		Reuse the sidecar index when it was built for this capture.  A capture
+		that grew since (e.g. still being recorded) is only scanned from where
+		the stored index stopped.
+		"""
+		try:
+			with np.load(index_path(self.path)) as sidecar:
+				meta = sidecar['meta']
+				index = sidecar['index']
+		except (OSError, KeyError, ValueError):
+			return None
+		version, header_len, size, end = (int(v) for v in meta)
+		if version != INDEX_VERSION or header_len != self.record_header_len or size > self.size:
+			return None
+		if os.path.getmtime(index_path(self.path)) < os.path.getmtime(self.path) and size == self.size:
+			return None   # rewritten in place
+		if size == self.size:
+			self._end = end
+			return index
+		tail = self._build_index(end)
+		if tail.size:
+			index = np.concatenate([index, tail])
+		self.save_index(index)
+		return index
+
+	def save_index(self, index=None):
+		index = self.index if index is None else index
+		try:
+			write_index(self.path, index, self.record_header_len, self.size, self._end)
+		except OSError:
+			# read-only media: the index is still used for this run
+			pass
+
+	# --------------------------------------------------------------- access
+
+	def __len__(self):
+		return len(self.index)
+
+	@property
+	def timestamps(self):
+		return self.index['ts']
+
+	@property
+	def duration(self):
+		if len(self.index) == 0:
+			return 0.
+		return float(self.index['ts'][-1] - self.index['ts'][0])
+
+	def locate(self, start=None, stop=None):
+		"""
+		Index rows [first, last) of the records stamped in [start, stop)
+		(epoch s, None for an open end), found by binary search over the
+		index: the window is reached without reading any earlier packet.
+
+		A timestamp going back (host clock step) is treated as its running
+		maximum, so the rows returned are always one contiguous slice.
+		"""
+		if self._search_ts is None:
+			self._search_ts = search_timestamps(self.index['ts'])
+		return locate_rows(self._search_ts, start, stop)
+
+	def packet(self, i):
+		"""
+		Zero-copy view of the i-th packet (link-layer frame).
+		"""
+		offset, caplen = int(self.index['offset'][i]), int(self.index['caplen'][i])
+		return memoryview(self._mm)[offset:offset + caplen]
+
+	def _gather(self, offsets, dtype):
+		"""
+		Read one big-endian field at every offset (bytes past the end read 0).
+		"""
+		dtype = np.dtype(dtype)
+		value = np.zeros(len(offsets), dtype=np.uint32)
+		for k in range(dtype.itemsize):
+			pos = offsets + k
+			inside = pos < self.size
+			byte = np.zeros(len(offsets), dtype=np.uint32)
+			byte[inside] = self.buf[pos[inside]]
+			value = (value << 8) | byte
+		return value.astype(dtype)
+
+	def classify(self):
+		"""
+		Per-packet UDP ports, payload offset and Velodyne class, computed once
+		for the whole index.
+
+		Data packets carry a 1206-byte payload and position packets a 512-byte
+		payload; the port (2368 / 8308) confirms the class when the frame is
+		UDP over IPv4.  Non-IPv4 frames are classified by payload size alone.
+
+		Returns:
+		--------
+		info: np.ndarray
+			Structured array with PACKET_INFO_DTYPE, aligned with self.index.
+			`payload` is the payload offset inside the frame.
+		"""
+		if self._info is not None:
+			return self._info
+		offsets = self.index['offset']
+		caplen = self.index['caplen'].astype(np.int64)
+		info = np.zeros(len(offsets), dtype=PACKET_INFO_DTYPE)
+
+		if self.linktype == LINKTYPE_ETHERNET:
+			ethertype = self._gather(offsets + 12, '>u2')
+			ver_ihl = self._gather(offsets + ETH_HEADER_LEN, 'u1')
+			proto = self._gather(offsets + ETH_HEADER_LEN + 9, 'u1')
+			udp = (ethertype == 0x0800) & ((ver_ihl >> 4) == 4) & (proto == 17)
+			udp_pos = offsets + ETH_HEADER_LEN + (ver_ihl & 0xf).astype(np.int64) * 4
+			info['sport'] = np.where(udp, self._gather(udp_pos, '>u2'), 0)
+			info['dport'] = np.where(udp, self._gather(udp_pos + 2, '>u2'), 0)
+			info['payload'] = np.where(udp, udp_pos + UDP_HEADER_LEN - offsets, ETH_HEADER_LEN + 20 + UDP_HEADER_LEN)
+		else:
+			udp = np.zeros(len(offsets), dtype=bool)
+			info['payload'] = ETH_HEADER_LEN + 20 + UDP_HEADER_LEN
+
+		payload_len = caplen - info['payload']
+		ports = np.stack([info['sport'], info['dport']])
+		on_data_port = (ports == VELODYNE_DATA_PORT).any(axis=0) | ~udp
+		on_position_port = (ports == VELODYNE_POSITION_PORT).any(axis=0) | ~udp
+		info['kind'][(payload_len == DATA_PAYLOAD_LEN) & on_data_port] = KIND_DATA
+		info['kind'][(payload_len == POSITION_PAYLOAD_LEN) & on_position_port] = KIND_POSITION
+		self._info = info
+		return info
+
+	def select(self, kinds=(KIND_DATA, KIND_POSITION)):
+		"""
+		Index positions of the packets of the given classes.
+		"""
+		return np.flatnonzero(np.isin(self.classify()['kind'], kinds))
+
+	def packets(self, kinds=(KIND_DATA, KIND_POSITION), start=0, stop=None):
+		"""
+		Generator over the packets of the given classes, in capture order.
+
+		Parameters:
+		-----------
+		kinds: tuple
+			Classes to yield (KIND_DATA, KIND_POSITION, KIND_OTHER).
+		start, stop: int
+			Slice of the selected packets to yield.
+
+		Returns:
+		--------
+		Packet namedtuples with a zero-copy memoryview of the UDP payload.
+		"""
+		info = self.classify()
+		view = memoryview(self._mm)
+		for i in self.select(kinds)[start:stop]:
+			offset, caplen, ts = self.index[i]
+			kind, sport, dport, payload = info[i]
+			yield Packet(float(ts), int(kind), int(sport), int(dport),
+						 view[offset + payload:offset + caplen])
+
+	def close(self):
+		self.buf = None
+		if self._mm is not None and self._file is not None:
+			try:
+				self._mm.close()
+			except BufferError:
+				# views handed out are still alive; the map goes with them
+				pass
+		self._mm = None
+		if self._file is not None:
+			self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
@@ -0,0 +1,363 @@
+#!/usr/bin/python
+"""
+Cut, split and merge pcap captures without a per-packet pass.
+
+The capture is memory-mapped and the selected records are located with the
+packet index (see pcap_reader.py).  Consecutive records are contiguous in the
+file, so every run of selected records is written with one slice of the
+mapping: extracting a time window is a single write, dropping the position
+packets of a VLP-16 capture about one write per second of data.  The index of
+every output capture is known without scanning it and is saved next to it.
+
+Usage:
+------
+$ python3 pcap_tools.py extract flight.pcap area1.pcap --from=12:30 --to=15:00 [--kind=data]
+$ python3 pcap_tools.py split flight.pcap segments/flight --duration=300      # or --size=1G
+$ python3 pcap_tools.py merge merged.pcap flight_a.pcap flight_b.pcap
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from pcap_reader import GLOBAL_HEADER_LEN, INDEX_DTYPE, KIND_NAMES, PcapReader, _record_layout, parse_time, write_index
+
+WRITE_BUFFER = 1 << 20
+
+
+def record_spans(reader, rows):
+	"""
+	Byte ranges of the records (header and frame) of the given index rows,
+	adjacent records merged into one range.
+
+	Returns:
+	--------
+	begins, ends: np.ndarray
+		File offsets [begin, end) of every range, in row order.
+	"""
+	if len(rows) == 0:
+		return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+	offsets = reader.index['offset'][rows]
+	begins = offsets - reader.record_header_len
+	ends = offsets + reader.index['caplen'][rows]
+	breaks = np.flatnonzero(begins[1:] != ends[:-1]) + 1
+	return begins[np.concatenate([[0], breaks])], ends[np.concatenate([breaks, [len(rows)]]) - 1]
+
+
+def same_format(a, b):
+	return (a.endian, a.ts_divisor, a.record_header_len, a.linktype) == \
+		   (b.endian, b.ts_divisor, b.record_header_len, b.linktype)
+
+
+def check_linktype(reader, template):
+	if reader.linktype != template.linktype:
+		raise ValueError('%s: link type %d, %s has link type %d (captures of different link types cannot be '
+						 'merged)' % (reader.path, reader.linktype, template.path, template.linktype))
+
+
+class CaptureWriter:
+	"""
+	Write records of open captures to a new capture, in the format (global
+	header and record header layout) of `template`.
+
+	Records of a capture in the same format are copied as contiguous slices of
+	its mapping; records of a capture in another format (e.g. a tcpdump
+	capture merged with a 64-bit Velodyne_pcap one) get a new record header,
+	with their timestamp rounded to the template resolution.  Captures of
+	another link type cannot share the global header and are rejected
+	(ValueError).
+	"""
+
+	def __init__(self, path, template):
+		self.path = path
+		self.template = template
+		self.record_header_len = template.record_header_len
+		self.packets = 0
+		self.bytes = GLOBAL_HEADER_LEN
+		self._indexes = []
+		self._file = open(path, 'wb', buffering=WRITE_BUFFER)
+		self._file.write(bytes(template.buf[:GLOBAL_HEADER_LEN]))
+		sec_dt, frac_pos, frac_dt, cap_pos, len_pos = _record_layout(self.record_header_len)
+		endian = template.endian
+		self._header_dtype = np.dtype({'names': ['sec', 'frac', 'caplen', 'len'],
+									   'formats': [endian + sec_dt, endian + frac_dt, endian + 'u4', endian + 'u4'],
+									   'offsets': [0, frac_pos, cap_pos, len_pos],
+									   'itemsize': self.record_header_len})
+
+	def write(self, reader, rows):
+		"""
+		Append the records of `rows` (index rows of `reader`) in that order.
+		"""
+		check_linktype(reader, self.template)
+		rows = np.asarray(rows, dtype=np.int64)
+		if len(rows) == 0:
+			return
+		index = reader.index[rows]
+		index['offset'] = self.bytes + self.record_header_len + np.concatenate(
+			[[0], np.cumsum(index['caplen'][:-1].astype(np.int64) + self.record_header_len)])
+		view = memoryview(reader.buf)
+		try:
+			if same_format(reader, self.template):
+				for begin, end in zip(*(a.tolist() for a in record_spans(reader, rows))):
+					self._file.write(view[begin:end])
+			else:
+				self._convert(reader, rows, view)
+		finally:
+			view.release()
+		self._indexes.append(index)
+		self.packets += len(rows)
+		self.bytes = int(index['offset'][-1]) + int(index['caplen'][-1])
+
+	def _convert(self, reader, rows, view):
+		ts = reader.index['ts'][rows]
+		caplen = reader.index['caplen'][rows]
+		headers = np.zeros(len(rows), dtype=self._header_dtype)
+		sec = np.floor(ts)
+		frac = np.round((ts - sec) * self.template.ts_divisor)
+		carry = frac >= self.template.ts_divisor
+		headers['sec'] = sec + carry
+		headers['frac'] = np.where(carry, 0, frac)
+		headers['caplen'] = caplen
+		headers['len'] = caplen
+		raw = headers.tobytes()
+		hdr = self.record_header_len
+		for i, (offset, length) in enumerate(zip(reader.index['offset'][rows].tolist(), caplen.tolist())):
+			self._file.write(raw[i * hdr:(i + 1) * hdr])
+			self._file.write(view[offset:offset + length])
+
+	def close(self):
+		"""
+		Close the capture and save its index.
+
+		Returns:
+		--------
+		packets: int
+		"""
+		if self._file is None:
+			return self.packets
+		self._file.close()
+		self._file = None
+		index = np.concatenate(self._indexes) if self._indexes else np.empty(0, dtype=INDEX_DTYPE)
+		try:
+			write_index(self.path, index, self.record_header_len)
+		except OSError:
+			pass
+		return self.packets
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+
+def select_rows(reader, kinds=None, t_from=None, t_to=None):
+	"""
+	Index rows of the packets of the given classes (all if None) stamped in
+	[t_from, t_to) (epoch s, None for an open end).
+	"""
+	first, last = reader.locate(t_from, t_to)
+	if kinds is None or set(kinds) == set(KIND_NAMES.values()):
+		return np.arange(first, last)
+	rows = reader.select(kinds)
+	return rows[np.searchsorted(rows, first):np.searchsorted(rows, last)]
+
+
+def extract(reader, out, kinds=None, t_from=None, t_to=None):
+	"""
+	Write the selected packets of a capture to `out`.
+
+	Returns:
+	--------
+	packets: int
+	"""
+	with CaptureWriter(out, reader) as writer:
+		writer.write(reader, select_rows(reader, kinds, t_from, t_to))
+	return writer.packets
+
+
+def split_points(reader, rows, duration=None, size=None):
+	"""
+	Positions in `rows` where a new segment starts: every `duration` seconds
+	from the first packet, or before a segment would exceed `size` bytes.
+	"""
+	if len(rows) == 0:
+		return np.empty(0, dtype=np.int64)
+	if duration is not None:
+		ts = np.maximum.accumulate(reader.index['ts'][rows])
+		bounds = ts[0] + duration * np.arange(1, int((ts[-1] - ts[0]) // duration) + 1)
+		cuts = np.searchsorted(ts, bounds)
+	else:
+		ends = np.cumsum(reader.index['caplen'][rows].astype(np.int64) + reader.record_header_len)
+		budget = size - GLOBAL_HEADER_LEN
+		cuts = []
+		start_bytes = 0
+		while start_bytes + budget < ends[-1]:
+			# at least one record per segment
+			cut = max(int(np.searchsorted(ends, start_bytes + budget, side='right')), (cuts[-1] if cuts else 0) + 1)
+			cuts.append(cut)
+			start_bytes = int(ends[cut - 1])
+		cuts = np.array(cuts, dtype=np.int64)
+	return np.unique(cuts[(cuts > 0) & (cuts < len(rows))])
+
+
+def split(reader, prefix, duration=None, size=None, kinds=None, t_from=None, t_to=None):
+	"""
+	Write the selected packets to `<prefix>_000.pcap`, `<prefix>_001.pcap`...
+
+	Returns:
+	--------
+	segments: list
+		(path, packets, first timestamp, last timestamp) of every segment written.
+	"""
+	if (duration is None) == (size is None):
+		raise ValueError('split by duration or by size')
+	rows = select_rows(reader, kinds, t_from, t_to)
+	bounds = np.concatenate([[0], split_points(reader, rows, duration, size), [len(rows)]])
+	segments = []
+	for start, stop in zip(bounds[:-1], bounds[1:]):
+		if stop <= start:
+			continue
+		path = '%s_%03d.pcap' % (prefix, len(segments))
+		with CaptureWriter(path, reader) as writer:
+			writer.write(reader, rows[start:stop])
+		ts = reader.index['ts']
+		segments.append((path, int(stop - start), float(ts[rows[start]]), float(ts[rows[stop - 1]])))
+	return segments
+
+
+def merge_order(readers, rows):
+	"""
+	Timestamp order of the packets of several captures.
+
+	Every input is in capture order, so the stable sort (timsort) only merges
+	k sorted runs; packets with the same timestamp keep the input order.
+
+	Returns:
+	--------
+	parts: list
+		(input number, rows) runs to write in that order.
+	"""
+	lengths = [len(r) for r in rows]
+	if sum(lengths) == 0:
+		return []
+	ts = np.concatenate([np.maximum.accumulate(reader.index['ts'][r]) if len(r) else reader.index['ts'][r]
+						 for reader, r in zip(readers, rows)])
+	source = np.repeat(np.arange(len(readers)), lengths)
+	row = np.concatenate(rows)
+	order = np.argsort(ts, kind='stable')
+	source, row = source[order], row[order]
+	breaks = np.flatnonzero((source[1:] != source[:-1]) | (row[1:] != row[:-1] + 1)) + 1
+	starts = np.concatenate([[0], breaks])
+	stops = np.concatenate([breaks, [len(row)]])
+	return [(int(source[a]), row[a:b]) for a, b in zip(starts, stops)]
+
+
+def merge(readers, out, kinds=None):
+	"""
+	k-way merge of several captures by timestamp into `out` (in the format of
+	the first one).  All of them must have the same link type.
+
+	Returns:
+	--------
+	packets: int
+	"""
+	for reader in readers[1:]:
+		check_linktype(reader, readers[0])
+	rows = [select_rows(reader, kinds) for reader in readers]
+	with CaptureWriter(out, readers[0]) as writer:
+		for source, part in merge_order(readers, rows):
+			writer.write(readers[source], part)
+	return writer.packets
+
+
+def parse_size(text):
+	"""
+	Bytes of a size such as "700M", "1.5G" or "4096".
+	"""
+	match = re.match(r'^(\d+(?:\.\d*)?)([KMG]?)B?$', text.strip().upper())
+	if not match:
+		raise ValueError('cannot parse size %r' % text)
+	return int(float(match.group(1)) * 1024 ** ' KMG'.index(match.group(2) or ' '))
+
+
+def parse_kinds(text):
+	if text == 'all':
+		return None
+	try:
+		return tuple(KIND_NAMES[k] for k in text.split(','))
+	except KeyError:
+		raise ValueError('unknown packet class in --kind=%s' % text)
+
+
+def _window(reader, args):
+	first, last = float(reader.timestamps[0]), float(reader.timestamps[-1])
+	t_from = None if args.time_from is None else parse_time(args.time_from, first, last)
+	t_to = None if args.time_to is None else parse_time(args.time_to, first, last)
+	return t_from, t_to
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Extract, split and merge pcap captures')
+	commands = parser.add_subparsers(dest='command', required=True)
+	window = argparse.ArgumentParser(add_help=False)
+	window.add_argument('--from', dest='time_from', default=None,
+						help='Start of the time window (formats of lidar_pcap_replay.py --from).')
+	window.add_argument('--to', dest='time_to', default=None, help='End of the time window.')
+	window.add_argument('--kind', default='all', help='Comma separated packet classes to keep: data, position, other or all.')
+
+	command = commands.add_parser('extract', parents=[window], help='Write a time window and/or packet classes.')
+	command.add_argument('pcap')
+	command.add_argument('out')
+	command = commands.add_parser('split', parents=[window], help='Cut into segments of a duration or size.')
+	command.add_argument('pcap')
+	command.add_argument('prefix', help='Segments are written to <prefix>_000.pcap, <prefix>_001.pcap...')
+	group = command.add_mutually_exclusive_group(required=True)
+	group.add_argument('--duration', type=float, help='Seconds per segment.')
+	group.add_argument('--size', help='Maximum segment size (e.g. 700M, 2G).')
+	command = commands.add_parser('merge', help='Merge captures by timestamp.')
+	command.add_argument('out')
+	command.add_argument('pcaps', nargs='+')
+	command.add_argument('--kind', default='all', help='Comma separated packet classes to keep.')
+	args = parser.parse_args(argv)
+
+	t0 = time.perf_counter()
+	readers = []
+	try:
+		kinds = parse_kinds(args.kind)
+		if args.command == 'merge':
+			readers = [PcapReader(path) for path in args.pcaps]
+			packets = merge(readers, args.out, kinds)
+			outputs = [args.out]
+		else:
+			readers = [PcapReader(args.pcap)]
+			t_from, t_to = _window(readers[0], args)
+			if args.command == 'extract':
+				packets = extract(readers[0], args.out, kinds, t_from, t_to)
+				outputs = [args.out]
+			else:
+				size = None if args.size is None else parse_size(args.size)
+				if os.path.dirname(args.prefix):
+					os.makedirs(os.path.dirname(args.prefix), exist_ok=True)
+				segments = split(readers[0], args.prefix, args.duration, size, kinds, t_from, t_to)
+				for path, count, first, last in segments:
+					print('[Info] ' + path + ': ' + str(count) + ' packets, ' + '{:.2f} s'.format(last - first))
+				packets = sum(count for _, count, _, _ in segments)
+				outputs = [path for path, _, _, _ in segments]
+	except (OSError, ValueError) as e:
+		print('[Error] ' + str(e))
+		sys.exit(1)
+	finally:
+		for reader in readers:
+			reader.close()
+	elapsed = time.perf_counter() - t0
+	written = sum(os.path.getsize(path) for path in outputs)
+	print('[Info] packets written: ' + str(packets) + ' (' + str(len(outputs)) + ' file(s))')
+	print('[Info] {:.1f} MB in {:.2f} s ({:.0f} MB/s)'.format(written / 1e6, elapsed, written / 1e6 / max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+"""
+Low-jitter UDP replay scheduler.
+
+Send times are computed for every packet up front on the monotonic clock
+(capture time divided by the speed multiplier, optionally capped to a maximum
+packet rate).  The send loop then sleeps once per batch instead of once per
+packet: every packet due within `batch_window` seconds is sent back to back,
+so timer granularity does not accumulate into drift.
+
+Usage:
+------
+	scheduler = ReplayScheduler(speed=10.)
+	stats = scheduler.run(reader.buf, offsets, lengths, timestamps, [('127.0.0.1', 2368)])
+	print(stats.summary())
+"""
+import socket
+import time
+
+import numpy as np
+
+# sleeping is left this long before a deadline, the rest is spent polling the clock
+SPIN_MARGIN = 0.0002
+
+
+def schedule(timestamps, speed=1., max_rate=None):
+	"""
+	Send time of every packet, in seconds from the start of the replay.
+
+	Parameters:
+	-----------
+	timestamps: np.ndarray
+		Capture timestamps (seconds), in replay order.
+	speed: float
+		Replay speed multiplier. `float('inf')` sends as fast as possible.
+	max_rate: float
+		Maximum packets per second, or None for no cap.
+
+	Returns:
+	--------
+	deadlines: np.ndarray
+	"""
+	n = len(timestamps)
+	if n == 0:
+		return np.empty(0)
+	if np.isinf(speed):
+		deadlines = np.zeros(n)
+	else:
+		deadlines = (timestamps - timestamps[0]) / speed
+	if max_rate:
+		# t[i] = max(deadline[i], t[i-1] + 1/rate), solved with a running maximum
+		step = np.arange(n) / float(max_rate)
+		deadlines = step + np.maximum.accumulate(deadlines - step)
+	return deadlines
+
+
+class ReplayStats:
+	"""
+	Throughput and timing achieved by a replay.
+
+	Attributes:
+	-----------
+	sent: int
+		Packets sent.
+	sent_bytes: int
+		Payload bytes sent.
+	elapsed: float
+		Wall time of the replay (s).
+	lateness: np.ndarray
+		Actual minus scheduled send time of the first packet of every batch
+		(s): the scheduling error.  The other packets of a batch leave up to
+		`batch_window` ahead of their send time by design, which is not
+		counted as jitter.
+	batches: int
+		Number of send batches.
+	interrupted: bool
+		True if the replay was stopped with Ctrl+C.
+	paced: bool
+		False when packets were sent as fast as possible (no send times to meet).
+	"""
+
+	def __init__(self, sent, sent_bytes, elapsed, lateness, batches, interrupted, paced=True):
+		self.paced = paced
+		self.sent = sent
+		self.sent_bytes = sent_bytes
+		self.elapsed = elapsed
+		self.lateness = lateness
+		self.batches = batches
+		self.interrupted = interrupted
+
+	@property
+	def rate(self):
+		return self.sent / self.elapsed if self.elapsed > 0 else 0.
+
+	@property
+	def bandwidth(self):
+		return self.sent_bytes / self.elapsed if self.elapsed > 0 else 0.
+
+	def jitter(self):
+		"""
+		(p50, p99, max) of the absolute send-time error of the batches, in seconds.
+		"""
+		if self.lateness.size == 0:
+			return 0., 0., 0.
+		error = np.abs(self.lateness)
+		p50, p99 = np.percentile(error, [50, 99])
+		return float(p50), float(p99), float(error.max())
+
+	@classmethod
+	def merge(cls, parts):
+		"""
+		Stats of a replay run piece by piece on one schedule (see ReplayScheduler.run).
+		"""
+		return cls(sum(p.sent for p in parts), sum(p.sent_bytes for p in parts), parts[-1].elapsed,
+				   np.concatenate([p.lateness for p in parts]), sum(p.batches for p in parts),
+				   any(p.interrupted for p in parts), parts[0].paced)
+
+	def summary(self):
+		text = 'throughput: {:.0f} packets/s, {:.2f} MB/s ({} packets in {:.2f} s, {} batches)'.format(
+			self.rate, self.bandwidth / 1e6, self.sent, self.elapsed, self.batches)
+		if self.paced:
+			p50, p99, worst = self.jitter()
+			text += '\nsend-time error (per batch): p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms'.format(
+				p50 * 1e3, p99 * 1e3, worst * 1e3)
+		return text
+
+
+class ReplayScheduler:
+	"""
+	Replay packets from a buffer over UDP at capture pace, faster, or as fast
+	as possible.
+
+	Parameters:
+	-----------
+	speed: float
+		Replay speed multiplier (1 = real time, `float('inf')` = as fast as possible).
+	max_rate: float
+		Maximum packets per second, or None.
+	batch_window: float
+		Packets due within this many seconds are sent in the same batch.
+	max_batch: int
+		Maximum packets per batch.
+	sock: socket.socket
+		UDP socket to send with. One is created (and closed) when not given.
+	"""
+
+	def __init__(self, speed=1., max_rate=None, batch_window=0.001, max_batch=256, sock=None):
+		if speed <= 0:
+			raise ValueError('speed must be positive')
+		self.speed = speed
+		self.max_rate = max_rate
+		self.batch_window = batch_window
+		self.max_batch = max_batch
+		self.sock = sock
+
+	def run(self, buf, offsets, lengths, timestamps, addresses, dest=None, progress=None, progress_interval=10.,
+			deadlines=None, start=None):
+		"""
+		Send buf[offsets[i]:offsets[i]+lengths[i]] for every packet.
+
+		Parameters:
+		-----------
+		buf: buffer
+			Memory holding the packets (e.g. PcapReader.buf).
+		offsets, lengths: np.ndarray
+			Payload position and size of every packet.
+		timestamps: np.ndarray
+			Capture time of every packet (s).
+		addresses: list
+			(host, port) destinations.
+		dest: np.ndarray
+			Index into `addresses` for every packet. All packets go to
+			addresses[0] when None.
+		progress: callable
+			Called with (packets sent, seconds of capture replayed) every
+			`progress_interval` seconds of capture.
+		deadlines: np.ndarray
+			Send time of every packet in seconds from `start` (default:
+			schedule() of the timestamps).
+		start: float
+			time.monotonic() value the deadlines count from (default: now).
+			Consecutive runs given slices of one schedule and the same start
+			replay a capture piece by piece without drifting.
+
+		Returns:
+		--------
+		stats: ReplayStats
+		"""
+		n = len(offsets)
+		if deadlines is None:
+			deadlines = schedule(timestamps, self.speed, self.max_rate)
+		lateness = np.zeros(n)			# one per batch
+		view = memoryview(buf)
+		offsets = offsets.tolist()
+		ends = (np.asarray(offsets, dtype=np.int64) + lengths).tolist()
+		if dest is None:
+			targets = [addresses[0]] * n
+		else:
+			targets = [addresses[d] for d in dest.tolist()]
+
+		sock = self.sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		sendto = sock.sendto
+		clock = time.monotonic
+		sleep = time.sleep
+		window = self.batch_window
+		max_batch = self.max_batch
+		next_progress = progress_interval
+
+		i = 0
+		sent_bytes = 0
+		batches = 0
+		interrupted = False
+		if start is None:
+			start = clock()
+		try:
+			while i < n:
+				now = clock() - start
+				wait = deadlines[i] - now
+				if wait > 0:
+					if wait > SPIN_MARGIN:
+						sleep(wait - SPIN_MARGIN)
+					while clock() - start < deadlines[i]:
+						pass
+					now = clock() - start
+
+				j = int(np.searchsorted(deadlines, now + window, side='right'))
+				j = min(max(j, i + 1), i + max_batch)
+				for k in range(i, j):
+					sent_bytes += sendto(view[offsets[k]:ends[k]], targets[k])
+				lateness[batches] = now - deadlines[i]
+				batches += 1
+				i = j
+
+				if progress is not None:
+					replayed = timestamps[i - 1] - timestamps[0]
+					if replayed >= next_progress:
+						progress(i, replayed)
+						next_progress += progress_interval
+		except KeyboardInterrupt:
+			interrupted = True
+		finally:
+			elapsed = clock() - start
+			view.release()
+			if self.sock is None:
+				sock.close()
+		paced = not (np.isinf(self.speed) and not self.max_rate)
+		return ReplayStats(i, sent_bytes, elapsed, lateness[:batches], batches, interrupted, paced)
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+"""
+Vectorized decoder for Velodyne VLP-16 data packets.
+
+A data packet carries a 1206-byte UDP payload: 12 firing blocks of 100 bytes
+(0xFFEE flag, azimuth in hundredths of degree, 32 channels of 2-byte distance
+and 1-byte reflectivity), a 4-byte timestamp (microseconds past the hour), the
+return mode and the product id.  Every block holds two firing sequences of the
+16 lasers; the azimuth of the second sequence and of every laser inside a
+sequence is interpolated from the azimuth of the next block.
+
+Whole batches of payloads are decoded with NumPy; no Python loop runs per
+point.
+
+Usage:
+------
+	with PcapReader('flight.pcap') as reader:
+		for points in decode_reader(reader):
+			print(points['x'], points['timestamp'])
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from pcap_reader import DATA_PAYLOAD_LEN, KIND_DATA, PcapReader
+
+BLOCKS = 12
+BLOCK_LEN = 100
+CHANNELS = 32
+LASERS = 16
+BLOCK_FLAG = 0xEEFF
+DISTANCE_RESOLUTION = 0.002     # m
+FIRING_INTERVAL = 2.304         # us between two lasers
+SEQUENCE_INTERVAL = 55.296      # us between two firing sequences
+BLOCK_INTERVAL = 2 * SEQUENCE_INTERVAL
+PACKET_INTERVAL = BLOCKS * BLOCK_INTERVAL     # us between two single return packets
+HOUR_US = 3600 * 1000000
+RETURN_MODE_DUAL = 0x39
+
+# vertical angle (deg) and vertical offset (mm) of every laser id (VLP-16 manual)
+VERTICAL_ANGLES = np.array([-15, 1, -13, 3, -11, 5, -9, 7, -7, 9, -5, 11, -3, 13, -1, 15], dtype=np.float64)
+VERTICAL_CORRECTIONS = np.array([11.2, -0.7, 9.7, -2.2, 8.1, -3.7, 6.6, -5.1,
+								 5.1, -6.6, 3.7, -8.1, 2.2, -9.7, 0.7, -11.2], dtype=np.float64)
+
+POINT_DTYPE = np.dtype([('x', 'f4'), ('y', 'f4'), ('z', 'f4'), ('intensity', 'u1'), ('laser_id', 'u1'),
+						('azimuth', 'f4'), ('timestamp', 'f8')])
+
+# lookup tables: azimuth in hundredths of degree, lasers by id
+_AZIMUTH_RAD = np.deg2rad(np.arange(36000) / 100.)
+SIN_AZIMUTH = np.sin(_AZIMUTH_RAD).astype(np.float32)
+COS_AZIMUTH = np.cos(_AZIMUTH_RAD).astype(np.float32)
+SIN_VERTICAL = np.sin(np.deg2rad(VERTICAL_ANGLES)).astype(np.float32)
+COS_VERTICAL = np.cos(np.deg2rad(VERTICAL_ANGLES)).astype(np.float32)
+Z_OFFSET = (VERTICAL_CORRECTIONS / 1000.).astype(np.float32)
+
+# per channel (32 per block): laser id, firing sequence and firing time inside the block
+_CHANNEL = np.arange(CHANNELS)
+CHANNEL_LASER = _CHANNEL % LASERS
+CHANNEL_SEQUENCE = _CHANNEL // LASERS
+CHANNEL_OFFSET = SEQUENCE_INTERVAL * CHANNEL_SEQUENCE + FIRING_INTERVAL * CHANNEL_LASER   # us
+# fraction of the azimuth gap to the next block covered at every channel firing
+CHANNEL_FRACTION = CHANNEL_OFFSET / BLOCK_INTERVAL
+
+
+def packet_gaps(timestamps, previous=None, dual=False):
+	"""
+	Data packets missing before every packet of a sequence, counted from the
+	gaps between packet timestamps (us past the hour) longer than 1.5 packet
+	intervals.
+
+	Parameters:
+	-----------
+	timestamps: np.ndarray
+		Sensor timestamps of consecutive data packets.
+	previous: int
+		Timestamp of the packet received before them (None: no gap is
+		counted before the first one).
+	dual: bool
+		Dual return mode (a packet every half interval).
+
+	Returns:
+	--------
+	missing: np.ndarray
+	"""
+	ts = np.asarray(timestamps, dtype=np.int64)
+	before = np.empty_like(ts)
+	before[1:] = ts[:-1]
+	if len(ts):
+		before[0] = ts[0] if previous is None else previous
+	interval = PACKET_INTERVAL / 2 if dual else PACKET_INTERVAL
+	gaps = (ts - before) % HOUR_US
+	return np.where(gaps > 1.5 * interval, np.rint(gaps / interval).astype(np.int64) - 1, 0)
+
+
+def lost_packets(timestamps, previous=None, dual=False):
+	"""
+	Data packets missing from a sequence of packet timestamps, see packet_gaps.
+
+	Returns:
+	--------
+	lost: int
+	"""
+	return int(packet_gaps(timestamps, previous, dual).sum())
+
+
+def read_payloads(reader, rows):
+	"""
+	Copy the UDP payloads of the given index rows into one (N, 1206) array.
+
+	Parameters:
+	-----------
+	reader: PcapReader
+		Opened capture.
+	rows: np.ndarray
+		Index positions of data packets (see PcapReader.select).
+
+	Returns:
+	--------
+	payloads: np.ndarray
+	"""
+	info = reader.classify()
+	starts = (reader.index['offset'][rows] + info['payload'][rows]).tolist()
+	payloads = np.empty((len(starts), DATA_PAYLOAD_LEN), dtype=np.uint8)
+	buf = reader.buf
+	for k, start in enumerate(starts):
+		payloads[k] = buf[start:start + DATA_PAYLOAD_LEN]
+	return payloads
+
+
+def _block_gaps(azimuth, step):
+	"""
+	Azimuth gap (hundredths of degree) from every block to the block fired after
+	it.  The last blocks of the packet reuse the previous gap.
+	"""
+	gaps = np.empty_like(azimuth)
+	gaps[:, :-step] = (azimuth[:, step:] - azimuth[:, :-step]) % 36000
+	gaps[:, -step:] = gaps[:, -2 * step:-step]
+	return gaps
+
+
+def decode_packets(payloads, packet_times=None, drop_empty=True, out=None):
+	"""
+	Decode VLP-16 data packets into points.
+
+	Parameters:
+	-----------
+	payloads: np.ndarray
+		(N, 1206) uint8 array of UDP payloads.
+	packet_times: np.ndarray
+		Time of every packet (s), e.g. the pcap timestamps. If None (Default)
+		the packet's own timestamp (seconds past the hour) is used.
+	drop_empty: bool
+		If True (Default) channels without a return (distance 0) are dropped.
+	out: np.ndarray
+		POINT_DTYPE array of at least N * 384 points the points are written
+		to (e.g. reused between calls), instead of a new array.
+
+	Returns:
+	--------
+	points: np.ndarray
+		Structured array with POINT_DTYPE. x, y, z in meters in the sensor
+		frame, azimuth in degrees, timestamp in seconds.
+	"""
+	payloads = np.ascontiguousarray(payloads, dtype=np.uint8).reshape(-1, DATA_PAYLOAD_LEN)
+	n = len(payloads)
+	blocks = payloads[:, :BLOCKS * BLOCK_LEN].reshape(n, BLOCKS, BLOCK_LEN)
+	header = blocks[:, :, :4].copy().view('<u2')            # (n, 12, 2): flag, azimuth
+	valid_block = header[:, :, 0] == BLOCK_FLAG
+	azimuth = header[:, :, 1].astype(np.int32)
+	channels = blocks[:, :, 4:].reshape(n, BLOCKS, CHANNELS, 3)
+	distance = channels[..., 0] | (channels[..., 1].astype(np.uint16) << 8)
+	intensity = channels[..., 2]
+
+	stamp = payloads[:, 1200:1204].copy().view('<u4').ravel()
+	dual = payloads[:, 1204] == RETURN_MODE_DUAL
+
+	# blocks of a dual return packet come in pairs fired at the same azimuth
+	gaps = np.where(dual[:, None], _block_gaps(azimuth, 2), _block_gaps(azimuth, 1))
+	firing_block = np.where(dual[:, None], np.arange(BLOCKS) // 2, np.arange(BLOCKS))
+
+	precise = azimuth[:, :, None] + gaps[:, :, None] * CHANNEL_FRACTION
+	precise = np.rint(precise).astype(np.int32) % 36000     # (n, 12, 32)
+
+	if packet_times is None:
+		base = stamp * 1e-6
+	else:
+		base = np.asarray(packet_times, dtype=np.float64)
+	offsets = (firing_block[:, :, None] * BLOCK_INTERVAL + CHANNEL_OFFSET) * 1e-6
+
+	keep = np.broadcast_to(valid_block[:, :, None], distance.shape)
+	if drop_empty:
+		keep = keep & (distance > 0)
+	keep = keep.ravel()
+
+	precise = precise.ravel()[keep]
+	laser = np.broadcast_to(CHANNEL_LASER, distance.shape).ravel()[keep]
+	dist = distance.ravel()[keep].astype(np.float32) * np.float32(DISTANCE_RESOLUTION)
+	horizontal = dist * COS_VERTICAL[laser]
+
+	points = np.empty(len(dist), dtype=POINT_DTYPE) if out is None else out[:len(dist)]
+	points['x'] = horizontal * SIN_AZIMUTH[precise]
+	points['y'] = horizontal * COS_AZIMUTH[precise]
+	points['z'] = dist * SIN_VERTICAL[laser] + Z_OFFSET[laser]
+	points['intensity'] = intensity.ravel()[keep]
+	points['laser_id'] = laser
+	points['azimuth'] = precise * np.float32(0.01)
+	points['timestamp'] = (base[:, None, None] + offsets).ravel()[keep]
+	return points
+
+
+def decode_reader(reader, start=0, stop=None, chunk_packets=16384, pcap_time=True):
+	"""
+	Generator decoding the data packets of a capture chunk by chunk.
+
+	Parameters:
+	-----------
+	reader: PcapReader
+		Opened capture.
+	start, stop: int
+		Slice of the data packets to decode.
+	chunk_packets: int
+		Packets decoded at once (~384 points each).
+	pcap_time: bool
+		If True (Default) points are stamped with the pcap (host) time of
+		their packet, else with the sensor's seconds past the hour.
+	"""
+	rows = reader.select((KIND_DATA,))[start:stop]
+	for first in range(0, len(rows), chunk_packets):
+		chunk = rows[first:first + chunk_packets]
+		times = reader.timestamps[chunk] if pcap_time else None
+		yield decode_packets(read_payloads(reader, chunk), packet_times=times)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Decode VLP-16 data packets of a pcap capture into points')
+	parser.add_argument('pcap', help='Capture with VLP-16 data packets.')
+	parser.add_argument('--out', help='Save the points as a .npy structured array.')
+	args = parser.parse_args()
+
+	try:
+		reader = PcapReader(args.pcap)
+	except (OSError, ValueError) as e:
+		print('[Error] ' + str(e))
+		sys.exit(1)
+
+	t0 = time.perf_counter()
+	chunks = list(decode_reader(reader))
+	elapsed = time.perf_counter() - t0
+	points = np.concatenate(chunks) if chunks else np.empty(0, dtype=POINT_DTYPE)
+	print('[Info] data packets: ' + str(len(reader.select((KIND_DATA,)))))
+	print('[Info] points: ' + str(len(points)))
+	print('[Info] decoded in {:.2f} s ({:.1f} M points/s)'.format(elapsed, len(points) / max(elapsed, 1e-9) / 1e6))
+	if args.out:
+		np.save(args.out, points)
+		print('[Info] points saved to ' + args.out)
+	reader.close()
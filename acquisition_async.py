@@ -0,0 +1,341 @@
+"""
+Single event loop acquisition runtime.
+
+Runs the work of send2velodyne.py as coroutines on one asyncio loop instead
+of one thread per job:
+
+- telemetry intake: dronekit reports attributes from its own thread, the
+  listener only appends them (with their arrival time) to a deque that the
+  loop drains every `intake_interval` seconds and before every sentence;
+- PPS: pulses on the top of every UTC second (asyncio sleep, then a short
+  spin for the last fraction of a millisecond), NMEA a fixed offset later;
+- NMEA transmission: one datagram endpoint, one datagram per sentence and
+  destination;
+- log flushing: AsyncTelemetryWriter coroutines writing in the executor.
+
+Blocking work (GPIO setup/cleanup, file writes) goes to a small thread pool.
+
+Usage:
+------
+$ python3 acquisition_async.py --connect /dev/ttyACM0 --lidar_port 192.168.1.201 --filepath <filepath>
+$ python3 acquisition_async.py --simulate --filepath /tmp/flight --duration 10
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import math
+import signal
+import socket
+import time
+
+from fast_connect import StartupTimer, add_connect_arguments, connect_vehicle
+from metrics import MetricsReporter, MetricsRegistry
+from nmea_transmitter import DestinationStats
+from pps_scheduler import PPSStats, RPiGPIO, SimulatedGPIO
+from rpi_gps_datagen import DataGenerator
+from telemetry_state import HANDLERS
+from telemetry_writer import AsyncTelemetryWriter
+
+# the selector rounds timeouts to milliseconds: the last 2 ms before a
+# deadline are spent polling the clock
+SPIN_MARGIN = 0.002
+
+
+class DatagramTransmitter(asyncio.DatagramProtocol):
+    """
+    NmeaTransmitter (send(), stats()) over an asyncio datagram endpoint.
+    Create it with DatagramTransmitter.open(destinations).
+    """
+
+    def __init__(self, destinations=()):
+        self.transport = None
+        self.destinations = []
+        self._stats = {}
+        for ip, port in destinations:
+            self.add_destination(ip, port)
+
+    @classmethod
+    async def open(cls, destinations):
+        loop = asyncio.get_running_loop()
+        _, protocol = await loop.create_datagram_endpoint(lambda: cls(destinations), family=socket.AF_INET)
+        return protocol
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        # ICMP errors (e.g. port unreachable) are not tied to a destination here
+        for stats in self._stats.values():
+            stats.last_error = str(exc)
+
+    def add_destination(self, ip, port):
+        destination = (ip, int(port))
+        if destination not in self._stats:
+            self.destinations.append(destination)
+            self._stats[destination] = DestinationStats()
+
+    def send(self, sentences):
+        if isinstance(sentences, (str, bytes)):
+            sentences = [sentences]
+        payloads = [s.encode("ascii") if isinstance(s, str) else s for s in sentences]
+        sent = 0
+        for destination in self.destinations:
+            stats = self._stats[destination]
+            for payload in payloads:
+                try:
+                    self.transport.sendto(payload, destination)
+                    stats.bytes += len(payload)
+                    stats.sent += 1
+                    sent += 1
+                except OSError as e:
+                    stats.errors += 1
+                    stats.last_error = str(e)
+        return sent
+
+    def stats(self):
+        return {f"{ip}:{port}": self._stats[(ip, port)].as_dict() for ip, port in self.destinations}
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class AcquisitionRuntime:
+    """
+    Telemetry intake, PPS, NMEA and logs of one acquisition on one event loop.
+
+    Parameters:
+    -----------
+    vehicle:
+        dronekit Vehicle (or sim_vehicle.SimulatedVehicle).
+    datagen: DataGenerator
+        Created with writer=AsyncTelemetryWriter so its logs are flushed by the loop.
+        The PPS timing also feeds its metrics registry, if any (see metrics.py).
+    destinations: list
+        (ip, port) NMEA destinations.
+    gpio: RPiGPIO or SimulatedGPIO
+        Created in the executor if a class is given (GPIO setup is blocking).
+    sentences: list
+        NMEA sentence types sent after every pulse.
+    pulse_duration, nmea_offset: float
+        As in pps_scheduler.PPSScheduler.
+    workers: int
+        Executor threads for blocking work.
+    startup: StartupTimer
+        Gets the first (valid) NMEA milestones if given (see fast_connect.py).
+    intake_interval: float
+        Seconds between two passes over the received attributes. Updates keep
+        their arrival time, so batching them does not blur the telemetry history.
+    """
+
+    def __init__(self, vehicle, datagen, destinations, gpio=SimulatedGPIO, sentences=("GPRMC",),
+                 pulse_duration=0.01, nmea_offset=0.05, workers=2, pin=12, intake_interval=0.02,
+                 startup=None):
+        self.vehicle = vehicle
+        self.datagen = datagen
+        self.destinations = list(destinations)
+        self.gpio = gpio
+        self.pin = pin
+        self.sentences = list(sentences)
+        self.pulse_duration = pulse_duration
+        self.nmea_offset = nmea_offset
+        self.intake_interval = intake_interval
+        self.startup = startup
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="acquisition")
+        self.stats = PPSStats(metrics=datagen.metrics)
+        self.updates = 0
+        self.transmitter = None
+        self._updates = collections.deque()
+        self._loop = None
+        self._stop = None
+
+    # telemetry intake
+    def _listener(self, vehicle, attr_name, value):
+        """
+        dronekit thread: only queue the update (deque appends are thread-safe).
+        """
+        self._updates.append((time.monotonic(), attr_name, value))
+
+    def _drain(self):
+        update = self.datagen.update_attr
+        updates = self._updates
+        while updates:
+            mono, attr_name, value = updates.popleft()
+            update(attr_name, value, mono)
+            self.updates += 1
+
+    async def _intake(self):
+        while True:
+            await asyncio.sleep(self.intake_interval)
+            self._drain()
+
+    # PPS and NMEA
+    async def _sleep_until(self, deadline):
+        wait = deadline - time.monotonic()
+        if wait > SPIN_MARGIN:
+            await asyncio.sleep(wait - SPIN_MARGIN)
+        while time.monotonic() < deadline:
+            pass
+
+    async def _pps(self):
+        last_second = None
+        while True:
+            utc = time.time()
+            mono = time.monotonic()
+            second = math.floor(utc) + 1
+            deadline = mono + (second - utc)
+            if last_second is not None and second > last_second + 1:
+                self.stats.record_missed(second - last_second - 1)
+            await self._sleep_until(deadline)
+            # a pin write takes microseconds: done on the loop to keep the edge on time
+            self.gpio.high()
+            edge = time.monotonic()
+            self.stats.record_edge(edge - deadline)
+            for offset, action in sorted([(self.pulse_duration, "low"), (self.nmea_offset, "nmea")]):
+                await self._sleep_until(edge + offset)
+                if action == "low":
+                    self.gpio.low()
+                else:
+                    self._send_nmea(edge, second)
+            last_second = second
+
+    def _send_nmea(self, edge, second):
+        self._drain()
+        failed = False
+        try:
+            sentences = self.datagen.send_sentences(self.transmitter, self.sentences, save=True, at=edge, utc=second)
+            if self.startup is not None:
+                self.startup.nmea_sent(sentences)
+        except Exception as e:
+            failed = True
+            print(f"[PPS] NMEA failed: {e}")
+        self.stats.record_nmea(time.monotonic() - edge, failed)
+
+    # lifecycle
+    def stop(self):
+        """
+        Request shutdown (thread-safe).
+        """
+        if self._loop is not None and self._stop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stop.set)
+            except RuntimeError:
+                pass        # loop already closed
+
+    async def run(self, duration=None):
+        """
+        Run until stop(), SIGINT/SIGTERM or `duration` seconds.
+        """
+        loop = self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if isinstance(self.gpio, type):
+            self.gpio = await loop.run_in_executor(self.executor, self.gpio, self.pin)
+        self.transmitter = await DatagramTransmitter.open(self.destinations)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass        # not the main thread
+
+        writers = [w for w in (self.datagen.nmea_writer, self.datagen.custom_writer)
+                   if isinstance(w, AsyncTelemetryWriter)]
+        tasks = [loop.create_task(self._intake(), name="intake"),
+                 loop.create_task(self._pps(), name="pps")]
+        tasks += [loop.create_task(w.run(self.executor), name=f"log {w.filepath}") for w in writers]
+        for attr_name in HANDLERS:
+            self.vehicle.add_attribute_listener(attr_name, self._listener)
+        try:
+            if duration is None:
+                await self._stop.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), duration)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await self._shutdown(tasks)
+        return self.stats
+
+    async def _shutdown(self, tasks):
+        loop = asyncio.get_running_loop()
+        for attr_name in HANDLERS:
+            self.vehicle.remove_attribute_listener(attr_name, self._listener)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # updates received after the last intake pass
+        self._drain()
+        self.transmitter.close()
+        if not isinstance(self.gpio, type):
+            await loop.run_in_executor(self.executor, self.gpio.close)
+        # in-flight log writes finish before the final flush in datagen.close()
+        self.executor.shutdown(wait=True)
+        self.datagen.close()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.remove_signal_handler(sig)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+
+if __name__ == "__main__":
+    startup = StartupTimer()
+    parser = argparse.ArgumentParser(description='Send NMEA Sentence and PPS to Velodyne LiDAR from one event loop')
+    parser.add_argument('--connect', help="Vehicle connection target string.")
+    parser.add_argument('--simulate', action='store_true',
+                        help="Use a simulated vehicle and GPIO instead of --connect.")
+    parser.add_argument('--sim_log',
+                        help="Flight log (.custom, .tlog or NMEA) replayed by the simulated vehicle. A circle if not given.")
+    parser.add_argument('--sim_speed', type=float, default=1.,
+                        help="Speed multiplier of the simulated vehicle.")
+    parser.add_argument('--lidar_port', default="127.0.0.1", help="IP of the LiDAR.")
+    parser.add_argument('--filepath', help="Filepath string to save nmea sentences and imu data.")
+    parser.add_argument('--log_format', choices=["text", "binary"], default="text")
+    parser.add_argument('--sentences', default="GPRMC")
+    parser.add_argument('--pps_pin', type=int, default=12)
+    parser.add_argument('--nmea_offset', type=float, default=0.05)
+    parser.add_argument('--duration', type=float, help="Stop after this many seconds.")
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--metrics',
+                        help="File the runtime metrics are written to every --metrics_interval s (.csv: appended, else JSON).")
+    parser.add_argument('--metrics_socket', help="UNIX socket answering metrics queries (see metrics.py).")
+    parser.add_argument('--metrics_interval', type=float, default=10.)
+    add_connect_arguments(parser)
+    args = parser.parse_args()
+
+    if args.simulate:
+        from sim_vehicle import CircleTrajectory, LogTrajectory, SimulatedVehicle
+        vehicle = SimulatedVehicle(LogTrajectory.from_file(args.sim_log) if args.sim_log else CircleTrajectory())
+        gpio = SimulatedGPIO
+    else:
+        print("Connecting to vehicle on {}".format(args.connect))
+        vehicle, _ = connect_vehicle(args, startup)
+        gpio = RPiGPIO
+
+    metrics = reporter = None
+    if args.metrics or args.metrics_socket:
+        metrics = MetricsRegistry()
+        startup.register(metrics)
+        reporter = MetricsReporter(metrics, args.metrics, args.metrics_interval, args.metrics_socket).start()
+
+    datagen = DataGenerator(vehicle.location.global_frame, vehicle.location.local_frame,
+                            vehicle.attitude, vehicle.groundspeed, vehicle.ekf_ok, args.filepath,
+                            verbose=args.verbose, log_format=args.log_format, writer=AsyncTelemetryWriter,
+                            metrics=metrics)
+    runtime = AcquisitionRuntime(vehicle, datagen, [(args.lidar_port, 10110)], gpio=gpio,
+                                 sentences=args.sentences.split(","), nmea_offset=args.nmea_offset,
+                                 pin=args.pps_pin, startup=startup)
+    if args.simulate:
+        vehicle.start(speed=args.sim_speed)
+        # stop at the end of a replayed log
+        vehicle.on_finished(runtime.stop)
+    try:
+        asyncio.run(runtime.run(args.duration))
+    finally:
+        vehicle.close()
+        if reporter is not None:
+            reporter.close()
+    print(startup.summary())
+    print(runtime.stats.summary())
+    print(runtime.transmitter.stats())
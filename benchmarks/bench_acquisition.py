@@ -0,0 +1,92 @@
+"""
+Acquisition runtime benchmark: thread per job (send2velodyne.py) against one
+asyncio event loop (acquisition_async.py), both fed by the same simulated
+vehicle and a simulated GPIO.
+
+Reports process CPU time per second of acquisition, listener calls made by
+the vehicle, PPS edge error and NMEA delay after the edge.
+
+Usage:
+------
+$ python3 benchmarks/bench_acquisition.py [--duration 10] [--attitude_rate 200] [--extra_rate 200]
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from acquisition_async import AcquisitionRuntime
+from nmea_transmitter import NmeaTransmitter
+from pps_scheduler import PPSScheduler, SimulatedGPIO
+from rpi_gps_datagen import DataGenerator
+from sim_vehicle import SimulatedVehicle
+from telemetry_writer import AsyncTelemetryWriter, TelemetryWriter
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def make_datagen(vehicle, filepath, writer):
+    return DataGenerator(vehicle.location.global_frame, vehicle.location.local_frame, vehicle.attitude,
+                         vehicle.groundspeed, vehicle.ekf_ok, filepath, writer=writer)
+
+
+def run_threaded(vehicle, filepath, duration, destination):
+    """
+    send2velodyne.py: dronekit thread -> listeners, PPS thread, writer threads.
+    """
+    datagen = make_datagen(vehicle, filepath, TelemetryWriter)
+    transmitter = NmeaTransmitter([destination])
+    datagen.attach(vehicle)
+    scheduler = PPSScheduler(SimulatedGPIO(), on_edge=lambda edge, second: datagen.send_sentences(
+        transmitter, ["GPRMC"], save=True, at=edge, utc=second))
+    scheduler.start()
+    time.sleep(duration)
+    scheduler.close()
+    datagen.close()
+    transmitter.close()
+    return scheduler.stats
+
+
+def run_async(vehicle, filepath, duration, destination):
+    datagen = make_datagen(vehicle, filepath, AsyncTelemetryWriter)
+    runtime = AcquisitionRuntime(vehicle, datagen, [destination], gpio=SimulatedGPIO)
+    asyncio.run(runtime.run(duration))
+    return runtime.stats
+
+
+def measure(name, run, args):
+    rates = {'attitude': args.attitude_rate, 'location.global_frame': args.position_rate,
+             'location.local_frame': args.position_rate, 'groundspeed': 4., 'ekf_ok': 1., 'gps_0': 1.}
+    vehicle = SimulatedVehicle(rates=rates, extra_rate=args.extra_rate).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        cpu, wall = cpu_time(), time.monotonic()
+        stats = run(vehicle, os.path.join(tmp, name), args.duration, ("127.0.0.1", args.port))
+        cpu, wall = cpu_time() - cpu, time.monotonic() - wall
+    vehicle.close()
+    print(f"[{name}] cpu {cpu / wall * 100:.1f}% ({cpu:.2f} s in {wall:.1f} s), "
+          f"{vehicle.notifications} listener calls")
+    print(stats.summary())
+    return {"cpu": cpu / wall, "edge_error_max": max(map(abs, stats.edge_error), default=0.)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the threaded and asyncio acquisition runtimes')
+    parser.add_argument('--duration', type=float, default=10., help="Seconds per runtime.")
+    parser.add_argument('--attitude_rate', type=float, default=200.)
+    parser.add_argument('--position_rate', type=float, default=50.)
+    parser.add_argument('--extra_rate', type=float, default=0.,
+                        help="Updates/s of attributes no listener uses (only matter with '*' listeners).")
+    parser.add_argument('--port', type=int, default=10110, help="Local UDP port the NMEA is sent to.")
+    args = parser.parse_args()
+
+    threaded = measure("threads", run_threaded, args)
+    event_loop = measure("asyncio", run_async, args)
+    print(f"cpu asyncio/threads: {event_loop['cpu'] / threaded['cpu']:.2f}")
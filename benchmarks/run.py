@@ -0,0 +1,536 @@
+"""
+Benchmark suite: telemetry encoding, logging, pcap parsing and replay.
+
+Every benchmark runs in its own process (so its peak RSS is its own) on
+synthetic inputs generated from fixed seeds (see synthetic.py) and reports
+operations per second, p50/p99 latency of one operation and peak RSS. Results
+can be written as JSON and compared with an earlier run.
+
+Micro benchmarks time single calls (decdeg2dms, make_nmea_checksum,
+gen_sentence, update_attr, ...); macro benchmarks time whole jobs over a
+capture or a flight log (indexing, classification, decoding, replay, log
+loading) and report their throughput in packets, points or records.
+
+Usage:
+------
+$ python3 benchmarks/run.py                           # everything, table on stdout
+$ python3 benchmarks/run.py --filter pcap --quick     # subset, smaller inputs
+$ python3 benchmarks/run.py --out new.json --compare old.json
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "Velodyne_pcap", "pcap"))
+
+import synthetic
+
+BENCHMARKS = {}
+
+
+def benchmark(name, kind, unit="op"):
+    """
+    Register a benchmark. The function gets the input directory and the size
+    scale and returns a `run()` callable doing one timed call and the number
+    of `unit`s that call handles.
+    """
+    def register(setup):
+        BENCHMARKS[name] = (kind, unit, setup)
+        return setup
+    return register
+
+
+def measure(run, ops_per_call, min_time, min_calls):
+    """
+    Call `run` until `min_time` seconds and `min_calls` calls have passed.
+
+    Returns:
+    --------
+    ops, seconds, latencies (s per op of every call)
+    """
+    run()                               # warm up (caches, lazy imports)
+    clock = time.perf_counter
+    latencies = []
+    start = clock()
+    elapsed = 0.
+    while elapsed < min_time or len(latencies) < min_calls:
+        t0 = clock()
+        run()
+        latencies.append(clock() - t0)
+        elapsed = clock() - start
+    latencies = np.array(latencies) / ops_per_call
+    return ops_per_call * len(latencies), float(latencies.sum() * ops_per_call), latencies
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _child(name, workdir, scale, min_time, conn):
+    kind, unit, setup = BENCHMARKS[name]
+    try:
+        run, ops_per_call = setup(workdir, scale)
+        min_calls = 200 if kind == "micro" else 3
+        ops, seconds, latencies = measure(run, ops_per_call, min_time, min_calls)
+        p50, p99 = np.percentile(latencies, [50, 99])
+        conn.send({"name": name, "kind": kind, "unit": unit, "ops": int(ops), "seconds": seconds,
+                   "ops_per_s": ops / seconds, "p50_us": p50 * 1e6, "p99_us": p99 * 1e6,
+                   "peak_rss_kb": peak_rss_kb()})
+    except Exception as e:
+        conn.send({"name": name, "kind": kind, "unit": unit, "error": repr(e)})
+    conn.close()
+
+
+def run_benchmark(name, workdir, scale, min_time):
+    """
+    Run one benchmark in a fresh process.
+    """
+    context = multiprocessing.get_context("fork")
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_child, args=(name, workdir, scale, min_time, child))
+    process.start()
+    child.close()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+# micro: telemetry encoding
+def _datagen(filepath=None, **options):
+    from rpi_gps_datagen import DataGenerator
+    from sim_vehicle import Attitude, LocationGlobal
+    return DataGenerator(LocationGlobal(-12.0696, -77.0796, 60.), None, Attitude(0.01, 1.2, -0.02), 5., True,
+                         filepath, **options)
+
+
+@benchmark("decdeg2dms", "micro")
+def bench_decdeg2dms(workdir, scale):
+    from rpi_gps_datagen import decdeg2dms
+    return (lambda: decdeg2dms(-77.0796123, "lon")), 1
+
+
+@benchmark("make_nmea_checksum", "micro")
+def bench_checksum(workdir, scale):
+    from rpi_gps_datagen import make_nmea_checksum
+    body = "GPRMC,122640,A,1204.18,S,07704.78,W,009.72,090.00,130920,000.00,E"
+    return (lambda: make_nmea_checksum(body)), 1
+
+
+@benchmark("gen_sentence", "micro")
+def bench_gen_sentence(workdir, scale):
+    datagen = _datagen()
+    return datagen.gen_sentence, 1
+
+
+@benchmark("gen_sentences_at_pps", "micro")
+def bench_gen_sentences_at(workdir, scale):
+    datagen = _datagen()
+    for name, value in synthetic.attribute_stream(2000):
+        datagen.update_attr(name, value)
+    at = datagen.history.span()[1] - 0.0001
+    return (lambda: datagen.gen_sentences(("GPRMC", "GPGGA", "GPZDA"), at=at, utc=1600000000)), 1
+
+
+@benchmark("update_attr", "micro")
+def bench_update_attr(workdir, scale):
+    datagen = _datagen()
+    stream = synthetic.attribute_stream(1000)
+    update = datagen.update_attr
+
+    def run():
+        for name, value in stream:
+            update(name, value)
+    return run, len(stream)
+
+
+@benchmark("update_attr_metrics", "micro")
+def bench_update_attr_metrics(workdir, scale):
+    from metrics import MetricsRegistry
+    datagen = _datagen(metrics=MetricsRegistry())
+    stream = synthetic.attribute_stream(1000)
+    update = datagen.update_attr
+
+    def run():
+        for name, value in stream:
+            update(name, value)
+    return run, len(stream)
+
+
+@benchmark("update_attr_logged", "micro")
+def bench_update_attr_logged(workdir, scale):
+    datagen = _datagen(os.path.join(workdir, "update_attr"))
+    stream = synthetic.attribute_stream(1000)
+    update = datagen.update_attr
+
+    def run():
+        for name, value in stream:
+            update(name, value)
+        # let the writer thread keep up so lines are written, not dropped
+        while datagen.custom_writer._queue.qsize() > 1000:
+            time.sleep(0.001)
+    return run, len(stream)
+
+
+@benchmark("telemetry_ring_at", "micro")
+def bench_ring_at(workdir, scale):
+    from telemetry_ring import TelemetryRing
+    ring = TelemetryRing(4096)
+    for i in range(10000):
+        ring.append(i * 0.02, 1.6e9 + i * 0.02, lat=-12., lon=-77., yaw=i * 0.001)
+    times = (np.random.default_rng(0).uniform(150., 200., 1000)).tolist()
+    at = ring.at
+
+    def run():
+        for t in times:
+            at(t)
+    return run, len(times)
+
+
+@benchmark("pack_record", "micro")
+def bench_pack_record(workdir, scale):
+    from telemetry_log import pack_record
+    args = (12.5, 1600000000.25, -12.0696, -77.0796, 60., 1.2, 0.01, -0.02, 5., True)
+    return (lambda: pack_record(*args)), 1
+
+
+@benchmark("encode_gprmc_batch", "macro", "sentence")
+def bench_encode_gprmc(workdir, scale):
+    from nmea_batch import encode_gprmc
+    records = synthetic.telemetry_samples(max(1, int(3600 * scale)), rate=100.)
+    args = (records["utc"], records["lat"], records["lon"], records["groundspeed"], np.degrees(records["yaw"]))
+    return (lambda: encode_gprmc(*args)), len(records)
+
+
+# macro: logging
+@benchmark("telemetry_writer", "macro", "line")
+def bench_telemetry_writer(workdir, scale):
+    from telemetry_writer import TelemetryWriter
+    lines = [f"2020-09-13 12:26:40.{i:06d}, 122640, 130920, -12.0696, -77.0796, 60.0, 1.5, 0.01, -0.02"
+             for i in range(20000)]
+    path = os.path.join(workdir, "writer.log")
+
+    def run():
+        with TelemetryWriter(path, max_queue=len(lines) + 1, mode='w') as writer:
+            for line in lines:
+                writer.write(line)
+    return run, len(lines)
+
+
+@benchmark("load_custom_log", "macro", "record")
+def bench_load_custom(workdir, scale):
+    from telemetry_log import load_custom_log
+    path = os.path.join(workdir, "flight.custom")
+    count = synthetic.write_custom(path, 3600 * scale)
+    return (lambda: load_custom_log(path)), count
+
+
+@benchmark("load_binary_log", "macro", "record")
+def bench_load_binary(workdir, scale):
+    from telemetry_log import load_binary_log
+    path = os.path.join(workdir, "flight.tlog")
+    count = synthetic.write_tlog(path, 3600 * scale)
+
+    def run():
+        telemetry = load_binary_log(path)
+        return float(telemetry["lat"].sum())       # touch the pages
+    return run, count
+
+
+@benchmark("replay_flight_datagen", "macro", "update")
+def bench_replay_flight(workdir, scale):
+    from sim_vehicle import SimulatedVehicle
+    from rpi_gps_datagen import DataGenerator
+    duration = 600 * scale
+
+    def run():
+        vehicle = SimulatedVehicle()
+        datagen = DataGenerator(vehicle.location.global_frame, vehicle.location.local_frame, vehicle.attitude,
+                                vehicle.groundspeed, vehicle.ekf_ok, None)
+        datagen.attach(vehicle)
+        vehicle.run(duration)
+        datagen.close()
+        return vehicle.notifications
+    return run, run()
+
+
+# macro: pcap parsing and replay
+def _pcap(workdir, scale, record_header_len):
+    """
+    Synthetic capture of the benchmark scale (written by prepare_inputs).
+    """
+    path = os.path.join(workdir, f"capture{record_header_len}.pcap")
+    return path, max(1000, int(200000 * scale))
+
+
+def _write_pcaps(workdir, scale):
+    for record_header_len in (16, 24):
+        path, packets = _pcap(workdir, scale, record_header_len)
+        if not os.path.exists(path):
+            synthetic.write_pcap(path, packets, record_header_len)
+
+
+def prepare_inputs(workdir, scale):
+    """
+    Write the synthetic captures in a separate process, so generating them
+    counts neither in the benchmarks' time nor in their peak RSS.
+    """
+    process = multiprocessing.get_context("fork").Process(target=_write_pcaps, args=(workdir, scale))
+    process.start()
+    process.join()
+
+
+def _bench_index(record_header_len):
+    def setup(workdir, scale):
+        from pcap_reader import PcapReader
+        path, packets = _pcap(workdir, scale, record_header_len)
+
+        def run():
+            PcapReader(path, use_index=False, save_index=False).close()
+        return run, packets
+    return setup
+
+
+benchmark("pcap_index_16", "macro", "packet")(_bench_index(16))
+benchmark("pcap_index_24", "macro", "packet")(_bench_index(24))
+
+
+@benchmark("pcap_index_cached", "macro", "packet")
+def bench_index_cached(workdir, scale):
+    from pcap_reader import PcapReader
+    path, packets = _pcap(workdir, scale, 16)
+    shutil.copy(path, path + ".cached.pcap")
+    PcapReader(path + ".cached.pcap").close()      # writes the sidecar index
+
+    def run():
+        PcapReader(path + ".cached.pcap").close()
+    return run, packets
+
+
+@benchmark("pcap_classify", "macro", "packet")
+def bench_classify(workdir, scale):
+    from pcap_reader import PcapReader
+    path, packets = _pcap(workdir, scale, 16)
+    reader = PcapReader(path, use_index=False, save_index=False)
+
+    def run():
+        reader._info = None
+        reader.classify()
+    run()
+    return run, packets
+
+
+@benchmark("pcap_packets_iter", "macro", "packet")
+def bench_packets_iter(workdir, scale):
+    from pcap_reader import PcapReader
+    path, packets = _pcap(workdir, scale, 24)
+    reader = PcapReader(path, use_index=False, save_index=False)
+
+    def run():
+        for packet in reader.packets():
+            pass
+    return run, packets
+
+
+@benchmark("vlp16_decode", "macro", "point")
+def bench_decode(workdir, scale):
+    from pcap_reader import PcapReader
+    from vlp16_decoder import decode_reader
+    path, packets = _pcap(workdir, scale, 16)
+    reader = PcapReader(path, use_index=False, save_index=False)
+    points = sum(len(p) for p in decode_reader(reader))
+
+    def run():
+        for chunk in decode_reader(reader):
+            pass
+    return run, points
+
+
+@benchmark("replay_udp_fast", "macro", "packet")
+def bench_replay(workdir, scale):
+    import socket
+    from pcap_reader import KIND_DATA, KIND_POSITION, PcapReader
+    from replay_scheduler import ReplayScheduler
+    path, packets = _pcap(workdir, scale, 16)
+    reader = PcapReader(path, use_index=False, save_index=False)
+    selected = reader.select([KIND_DATA, KIND_POSITION])
+    info = reader.classify()[selected]
+    index = reader.index[selected]
+    # local sink that drops everything: bounded socket buffer, nothing reads it
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    address = sink.getsockname()
+    scheduler = ReplayScheduler(speed=float("inf"))
+
+    def run():
+        scheduler.run(reader.buf, index["offset"] + info["payload"], index["caplen"] - info["payload"],
+                      index["ts"], [address])
+    return run, len(selected)
+
+
+@benchmark("frame_assembly", "macro", "packet")
+def bench_frame_assembly(workdir, scale):
+    from frame_assembler import FrameAssembler
+    from pcap_reader import KIND_DATA, PcapReader
+    path, _ = _pcap(workdir, scale, 16)
+    reader = PcapReader(path, use_index=False, save_index=False)
+    rows = reader.select((KIND_DATA,))
+    payloads = np.ascontiguousarray([reader.packet(i)[42:] for i in rows[:2000]], dtype=np.uint8)
+    assembler = FrameAssembler()
+    push = assembler.push
+
+    def run():
+        for payload in payloads:
+            push(payload, 0.)
+    return run, len(payloads)
+
+
+@benchmark("container_pack", "macro", "packet")
+def bench_container_pack(workdir, scale):
+    from lidar_container import pack
+    from pcap_reader import PcapReader
+    path, packets = _pcap(workdir, scale, 16)
+    reader = PcapReader(path, use_index=False, save_index=False)
+
+    def run():
+        pack(reader, os.path.join(workdir, "pack.lcap"), "zlib", 1)
+    return run, packets
+
+
+@benchmark("container_window", "macro", "packet")
+def bench_container_window(workdir, scale):
+    from lidar_container import ContainerReader, pack
+    from pcap_reader import PcapReader
+    path, _ = _pcap(workdir, scale, 16)
+    with PcapReader(path, use_index=False, save_index=False) as reader:
+        pack(reader, os.path.join(workdir, "window.lcap"), "zlib", 1)
+    container = ContainerReader(os.path.join(workdir, "window.lcap"))
+    start = float(container.timestamps[0]) + container.duration / 2
+    rows = np.arange(*container.locate(start, start + 10.))
+
+    def run():
+        for part, local in container.segments(rows):
+            part.classify()
+    return run, len(rows)
+
+
+@benchmark("flight_index_query", "micro", "query")
+def bench_flight_index_query(workdir, scale):
+    from flight_index import FlightIndex
+    flights = max(20, int(200 * scale))
+    rng = np.random.default_rng(0)
+    logs = []
+    for k in range(flights):
+        records = synthetic.telemetry_samples(600, start=1600000000. + k * 86400., seed=k)
+        # flights spread over a few km around the same area
+        records["lat"] += rng.uniform(-0.02, 0.02)
+        records["lon"] += rng.uniform(-0.02, 0.02)
+        path = os.path.join(workdir, f"flight{k:04d}.tlog")
+        with open(path, "wb") as f:
+            f.write(synthetic.binary_header())
+            f.write(records.tobytes())
+        logs.append(path)
+    index = FlightIndex(os.path.join(workdir, "flights.db"))
+    index.update(logs)
+    boxes = [(lat, lon, lat + 0.002, lon + 0.002)
+             for lat, lon in zip(rng.uniform(-12.09, -12.05, 64), rng.uniform(-77.10, -77.06, 64))]
+    queries = itertools.cycle(boxes)
+
+    def run():
+        index.query(*next(queries))
+    return run, 1
+
+
+@benchmark("survey_plan", "micro", "plan")
+def bench_survey_plan(workdir, scale):
+    from survey_planner import SurveyPlan
+    # irregular ~1 km2 block, every line direction tried
+    angles = np.linspace(0., 2 * np.pi, 24, endpoint=False)
+    radius = 600. * (1. + 0.3 * np.random.default_rng(0).uniform(-1, 1, len(angles)))
+    lat = -12.0696 + np.degrees(radius * np.sin(angles) / 6378137.)
+    lon = -77.0796 + np.degrees(radius * np.cos(angles) / (6378137. * np.cos(np.radians(12.07))))
+    return (lambda: SurveyPlan(lat, lon, swath=60., overlap=0.2, home=(-12.0696, -77.0896))), 1
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, baseline=None):
+    base = {r["name"]: r for r in (baseline or {}).get("results", []) if "error" not in r}
+    print(f"{'benchmark':24s} {'ops/s':>14s} {'p50':>11s} {'p99':>11s} {'peak RSS':>10s}" +
+          ("  vs baseline" if base else ""))
+    for r in results:
+        if "error" in r:
+            print(f"{r['name']:24s} error: {r['error']}")
+            continue
+        line = (f"{r['name']:24s} {r['ops_per_s']:>10.4g} {r['unit'] + '/s':<4s}"
+                f"{r['p50_us']:>9.3f}us {r['p99_us']:>9.3f}us {r['peak_rss_kb'] / 1024:>8.1f}MB")
+        if r["name"] in base:
+            line += f"  {r['ops_per_s'] / base[r['name']]['ops_per_s']:.2f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument("--filter", help="Only run benchmarks whose name matches this regular expression.")
+    parser.add_argument("--quick", action="store_true", help="Smaller inputs and shorter runs.")
+    parser.add_argument("--min_time", type=float, default=None, help="Seconds spent timing every benchmark.")
+    parser.add_argument("--workdir", help="Directory for the synthetic inputs (kept). A temporary one if not given.")
+    parser.add_argument("--out", help="Write the results as JSON.")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with.")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks.")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if not args.filter or re.search(args.filter, name)]
+    if args.list:
+        for name in names:
+            print(f"{name:24s} {BENCHMARKS[name][0]}")
+        sys.exit(0)
+    scale = 0.1 if args.quick else 1.
+    min_time = args.min_time if args.min_time is not None else (0.2 if args.quick else 1.)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench-")
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    try:
+        if any(name.startswith(("pcap", "vlp16", "replay_udp", "frame_assembly", "container")) for name in names):
+            prepare_inputs(workdir, scale)
+        for name in names:
+            results.append(run_benchmark(name, workdir, scale, min_time))
+            print(f"{name}: done", file=sys.stderr)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"meta": {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": platform.python_version(), "numpy": np.__version__,
+                       "machine": platform.machine(), "platform": platform.platform(),
+                       "scale": scale, "min_time": min_time},
+              "results": results}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=1)
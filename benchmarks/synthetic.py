@@ -0,0 +1,210 @@
+"""
+Synthetic inputs for the benchmarks: VLP-16 captures and telemetry.
+
+Everything is generated from fixed seeds, so the same arguments always give
+the same bytes and benchmark runs can be compared.
+
+Usage:
+------
+$ python3 benchmarks/synthetic.py pcap out.pcap --packets 100000 [--record_header 24]
+$ python3 benchmarks/synthetic.py tlog out.tlog --seconds 3600
+"""
+import argparse
+import os
+import struct
+import sys
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "Velodyne_pcap", "pcap"))
+
+from nmea_batch import encode_gprmc
+from pcap_capture import udp_frame_header
+from telemetry_log import BINARY_DTYPE, binary_header
+
+PCAP_GLOBAL_HEADER = struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+DATA_RATE = 754             # VLP-16 data packets per second (single return)
+BLOCK_DTYPE = np.dtype([("flag", "<u2"), ("azimuth", "<u2"),
+                        ("channels", [("distance", "<u2"), ("reflectivity", "u1")], 32)])
+DATA_DTYPE = np.dtype([("blocks", BLOCK_DTYPE, 12), ("timestamp", "<u4"), ("mode", "u1"), ("product", "u1")])
+POSITION_TIMESTAMP = 198    # position packet: us past the hour, PPS status, then the NMEA sentence
+POSITION_PPS = 202
+POSITION_NMEA = 206
+VLP16_PRODUCT = 0x22
+RETURN_STRONGEST = 0x37
+RETURN_DUAL = 0x39
+
+assert DATA_DTYPE.itemsize == 1206
+
+
+def vlp16_data_payloads(n, start_us=0, rpm=600, seed=0, first_packet=0, dual=False):
+    """
+    n VLP-16 data payloads as a (n, 1206) uint8 array: a sensor spinning at
+    `rpm` with random distances (1-100 m, 10% no return) and reflectivities.
+    `first_packet` is the number of packets already generated, so the azimuth
+    continues across calls. In dual return mode the blocks come in pairs fired
+    at the same azimuth (twice as many packets per rotation).
+    """
+    rng = np.random.default_rng(seed)
+    packets = np.zeros(n, dtype=DATA_DTYPE)
+    blocks = packets["blocks"]
+    step = rpm / 60 * 36000 * 110.592e-6            # hundredths of degree per firing
+    firing = np.arange(first_packet * 12, (first_packet + n) * 12).reshape(n, 12)
+    if dual:
+        firing //= 2
+    blocks["flag"] = 0xEEFF
+    blocks["azimuth"] = np.round(firing * step).astype(np.int64) % 36000
+    distance = rng.integers(500, 50000, size=(n, 12, 32))
+    distance[rng.random((n, 12, 32)) < 0.1] = 0
+    blocks["channels"]["distance"] = distance
+    blocks["channels"]["reflectivity"] = rng.integers(0, 256, size=(n, 12, 32))
+    rate = 2 * DATA_RATE if dual else DATA_RATE
+    packets["timestamp"] = (start_us + np.round(np.arange(n) * 1e6 / rate).astype(np.int64)) % 3600000000
+    packets["mode"] = RETURN_DUAL if dual else RETURN_STRONGEST
+    packets["product"] = VLP16_PRODUCT
+    return packets.view(np.uint8).reshape(n, 1206)
+
+
+def vlp16_position_payload(utc, lat=-12.0696, lon=-77.0796):
+    """
+    VLP-16 position payload (512 bytes) carrying a GPRMC sentence for `utc`.
+    """
+    payload = bytearray(512)
+    struct.pack_into("<I", payload, POSITION_TIMESTAMP, int(utc * 1e6) % 3600000000)
+    payload[POSITION_PPS] = 2       # PPS locked
+    sentence = encode_gprmc([utc], [lat], [lon], [5.], [90.])
+    payload[POSITION_NMEA:POSITION_NMEA + len(sentence)] = sentence
+    return bytes(payload)
+
+
+def write_pcap(path, packets=100000, record_header_len=16, start=1600000000., position_every=DATA_RATE,
+               seed=0, chunk=8192):
+    """
+    Write a VLP-16 capture: data packets at 754/s and one position packet every
+    `position_every` data packets, with 16-byte (32-bit Velodyne_pcap build) or
+    24-byte (64-bit build) record headers.
+
+    Returns:
+    --------
+    size: int
+        File size (bytes).
+    """
+    record = struct.Struct("<IIII" if record_header_len == 16 else "<qqII")
+    data_header = udp_frame_header(1206, 2368, 2368)
+    position_header = udp_frame_header(512, 8308, 8308)
+    with open(path, "wb") as f:
+        f.write(PCAP_GLOBAL_HEADER)
+        written = 0
+        t = start
+        for first in range(0, packets, chunk):
+            count = min(chunk, packets - first)
+            payloads = vlp16_data_payloads(count, start_us=int(t * 1e6), seed=seed + first, first_packet=first)
+            parts = []
+            for i in range(count):
+                if position_every and (first + i) % position_every == position_every - 1:
+                    frame = position_header + vlp16_position_payload(t)
+                else:
+                    frame = data_header + payloads[i].tobytes()
+                sec = int(t)
+                usec = int(round((t - sec) * 1e6))
+                if usec == 1000000:
+                    sec, usec = sec + 1, 0
+                parts.append(record.pack(sec, usec, len(frame), len(frame)))
+                parts.append(frame)
+                t += 1. / DATA_RATE
+            f.write(b"".join(parts))
+            written += count
+    return os.path.getsize(path)
+
+
+def telemetry_samples(seconds, rate=10., start=1600000000., seed=0):
+    """
+    Telemetry samples (BINARY_DTYPE) of a flight following a lawnmower pattern
+    at `rate` samples per second with noisy attitude.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * rate)
+    t = np.arange(n) / rate
+    records = np.zeros(n, dtype=BINARY_DTYPE)
+    records["mono"] = t
+    records["utc"] = start + t
+    leg = 60.                                        # s per survey line
+    line = t // leg
+    along = (t % leg) / leg * 300. * np.where(line % 2, -1, 1) + np.where(line % 2, 300., 0.)
+    records["lat"] = -12.0696 + np.degrees(line * 20. / 6378137.)
+    records["lon"] = -77.0796 + np.degrees(along / (6378137. * np.cos(np.radians(12.07))))
+    records["alt"] = 60. + rng.normal(0, 0.2, n)
+    records["yaw"] = np.where(line % 2, -np.pi / 2, np.pi / 2) + rng.normal(0, 0.01, n)
+    records["roll"] = rng.normal(0, 0.02, n)
+    records["pitch"] = rng.normal(0, 0.02, n)
+    records["groundspeed"] = 5.
+    records["ekf_ok"] = 1
+    return records
+
+
+def write_tlog(path, seconds=3600, rate=10.):
+    records = telemetry_samples(seconds, rate)
+    with open(path, "wb") as f:
+        f.write(binary_header())
+        f.write(records.tobytes())
+    return len(records)
+
+
+def write_custom(path, seconds=3600, rate=10.):
+    """
+    Same flight as write_tlog as a ".custom" text log (DataGenerator format).
+    """
+    records = telemetry_samples(seconds, rate)
+    stamps = (records["utc"] * 1e6).astype("datetime64[us]")
+    with open(path, "w") as f:
+        for stamp, r in zip(stamps.tolist(), records.tolist()):
+            f.write(f"{stamp}, {stamp:%H%M%S}, {stamp:%d%m%y}, {r[2]}, {r[3]}, {r[4]}, {r[5]}, {r[6]}, {r[7]}\n")
+    return len(records)
+
+
+def attribute_stream(n, seed=0):
+    """
+    n (attr_name, value) telemetry updates as dronekit reports them: attitude
+    at 10 Hz, global and local frames at 4 Hz, groundspeed and ekf_ok at 1 Hz.
+    """
+    from sim_vehicle import Attitude, LocationGlobal, LocationLocal
+    rng = np.random.default_rng(seed)
+    pattern = (["attitude"] * 10 + ["location.global_frame"] * 4 + ["location.local_frame"] * 4
+               + ["groundspeed", "ekf_ok"])
+    names = [pattern[i] for i in rng.integers(0, len(pattern), n)]
+    values = rng.normal(size=(n, 3)).tolist()
+    stream = []
+    for name, (a, b, c) in zip(names, values):
+        if name == "attitude":
+            value = Attitude(a * 0.02, b, c * 0.02)
+        elif name == "location.global_frame":
+            value = LocationGlobal(-12.07 + a * 1e-4, -77.08 + b * 1e-4, 60. + c)
+        elif name == "location.local_frame":
+            value = LocationLocal(a * 10, b * 10, -60. + c)
+        elif name == "groundspeed":
+            value = 5. + a
+        else:
+            value = True
+        stream.append((name, value))
+    return stream
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic benchmark inputs")
+    parser.add_argument("kind", choices=["pcap", "tlog", "custom"])
+    parser.add_argument("out")
+    parser.add_argument("--packets", type=int, default=100000, help="pcap: number of packets.")
+    parser.add_argument("--record_header", type=int, choices=[16, 24], default=16,
+                        help="pcap: record header layout (32 or 64-bit Velodyne_pcap build).")
+    parser.add_argument("--seconds", type=float, default=3600, help="telemetry: flight duration.")
+    args = parser.parse_args()
+
+    if args.kind == "pcap":
+        size = write_pcap(args.out, args.packets, args.record_header)
+        print(f"{args.packets} packets, {size} bytes")
+    elif args.kind == "tlog":
+        print(f"{write_tlog(args.out, args.seconds)} records")
+    else:
+        print(f"{write_custom(args.out, args.seconds)} records")
@@ -0,0 +1,339 @@
+"""
+Fast vehicle connection for the acquisition.
+
+`connect(..., wait_ready=True)` blocks until dronekit has downloaded every
+parameter of the autopilot, tens of seconds after boot, and no PPS or NMEA is
+sent meanwhile although the LiDAR is already recording. fast_connect()
+connects with wait_ready=False and only waits for the attributes needed to
+build a sentence (attitude and position by default); the parameters keep
+downloading in the background and are saved to an on-disk cache keyed by
+firmware version, which answers parameter reads until the download ends.
+
+StartupTimer measures the startup milestones, up to the first NMEA sentence
+with a valid fix (status A), so the time-to-first-valid-NMEA can be compared.
+
+Usage:
+------
+$ python3 fast_connect.py --connect /dev/ttyACM0 [--baud 57600] [--ready attitude,location.global_frame,gps_fix,ekf_ok]
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "actino", "parameters")
+
+# attribute listened to -> readiness check on the vehicle
+READY_CHECKS = {
+    'attitude': ('attitude', lambda vehicle: vehicle.attitude is not None and vehicle.attitude.yaw is not None),
+    'location.global_frame': ('location.global_frame',
+                              lambda vehicle: vehicle.location.global_frame is not None
+                              and vehicle.location.global_frame.lat is not None),
+    'gps_fix': ('gps_0', lambda vehicle: vehicle.gps_0 is not None and (vehicle.gps_0.fix_type or 0) >= 3),
+    'ekf_ok': ('ekf_ok', lambda vehicle: bool(vehicle.ekf_ok)),
+}
+
+# enough to build a sentence: NMEA starts with status V until the EKF is OK
+DEFAULT_READY = ('attitude', 'location.global_frame')
+
+
+def sentence_valid(sentence):
+    """
+    True if a GPRMC (status A) or GPGGA (fix quality > 0) sentence reports a valid fix.
+    """
+    fields = sentence.split("*", 1)[0].split(",")
+    if fields[0].endswith("RMC"):
+        return len(fields) > 2 and fields[2] == "A"
+    if fields[0].endswith("GGA"):
+        return len(fields) > 6 and fields[6] not in ("", "0")
+    return False
+
+
+class StartupTimer:
+    """
+    Seconds from `start` (monotonic, now if None) to the first occurrence of
+    every startup milestone ("connected", "ready", "first_nmea",
+    "first_valid_nmea", "parameters"...).
+
+    Example:
+    --------
+    >>> startup = StartupTimer()
+    >>> vehicle = fast_connect("/dev/ttyACM0", timer=startup)
+    >>> startup.nmea_sent(datagen.send_sentences(transmitter))
+    >>> print(startup.summary())
+    """
+
+    def __init__(self, start=None, verbose=True):
+        self.start = time.monotonic() if start is None else start
+        self.verbose = verbose
+        self.marks = {}
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        """
+        Record the milestone if not already recorded.
+
+        Returns:
+        --------
+        first: bool
+        """
+        with self._lock:
+            if name in self.marks:
+                return False
+            self.marks[name] = time.monotonic() - self.start
+        if self.verbose:
+            print(f"[Startup] {name} after {self.marks[name]:.2f} s")
+        return True
+
+    def elapsed(self, name):
+        return self.marks.get(name)
+
+    def nmea_sent(self, sentences):
+        """
+        Record the first sentence sent and the first one with a valid fix.
+        """
+        if not sentences:
+            return
+        self.mark("first_nmea")
+        if "first_valid_nmea" not in self.marks and any(sentence_valid(s) for s in sentences):
+            self.mark("first_valid_nmea")
+
+    def register(self, metrics):
+        """
+        Expose the milestones as "startup.<name>" gauges (see metrics.py).
+        """
+        for name in ("connected", "ready", "first_nmea", "first_valid_nmea", "parameters"):
+            metrics.gauge(f"startup.{name}", lambda name=name: self.marks.get(name))
+
+    def summary(self):
+        return "startup: " + ", ".join(f"{name} {t:.2f} s" for name, t in sorted(self.marks.items(), key=lambda m: m[1]))
+
+
+def firmware_key(vehicle):
+    """
+    Cache key of the vehicle firmware (e.g. "APM_Copter-4.0.3"), None while
+    the autopilot version is unknown.
+    """
+    version = getattr(vehicle, "version", None)
+    if version is None or getattr(version, "major", None) is None:
+        return None
+    return re.sub(r"[^A-Za-z0-9.\-]+", "_", str(version))
+
+
+class ParameterCache:
+    """
+    Autopilot parameters saved on disk per firmware version.
+
+    get() answers from the live vehicle parameters when dronekit has them and
+    from the cache of the same firmware otherwise. The cache is rewritten when
+    dronekit finishes the (background) parameter download.
+
+    Parameters:
+    -----------
+    directory: str
+        Folder of the cache files (one JSON file per firmware).
+    timer: StartupTimer
+        Gets the "parameters" milestone when the download ends.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, timer=None):
+        self.directory = directory
+        self.timer = timer
+        self.key = None
+        self.cached = {}
+        self._vehicle = None
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def load(self, key):
+        """
+        Cached parameters of a firmware ({} if none).
+        """
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)["parameters"]
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def save(self, key, parameters):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path(key) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"firmware": key, "saved": time.time(), "parameters": parameters}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path(key))
+
+    def _load_cached(self):
+        if self.key is None and self._vehicle is not None:
+            self.key = firmware_key(self._vehicle)
+            if self.key is not None:
+                self.cached = self.load(self.key)
+
+    def attach(self, vehicle):
+        """
+        Load the cache of the vehicle firmware (once its version is known) and
+        refresh it when the parameter download ends.
+        """
+        self._vehicle = vehicle
+        self._load_cached()
+        vehicle.add_attribute_listener('parameters', self._on_parameters)
+
+    def _on_parameters(self, vehicle, attr_name, parameters):
+        if self.timer is not None:
+            self.timer.mark("parameters")
+        self._load_cached()
+        key = firmware_key(vehicle)
+        if key is None:
+            return
+        values = {name: value for name, value in parameters.items() if value is not None}
+        try:
+            self.save(key, values)
+        except OSError as e:
+            print(f"[Parameters] could not save the cache: {e}")
+        self.key, self.cached = key, values
+
+    def get(self, name, default=None):
+        self._load_cached()
+        if self._vehicle is not None:
+            # dronekit waits for the whole download by default, the cache is for that time
+            value = self._vehicle.parameters.get(name, wait_ready=False)
+            if value is not None:
+                return value
+        return self.cached.get(name.upper(), default)
+
+    def detach(self):
+        if self._vehicle is not None:
+            self._vehicle.remove_attribute_listener('parameters', self._on_parameters)
+            self._vehicle = None
+
+
+def wait_for_attributes(vehicle, ready=DEFAULT_READY, timeout=30., timer=None):
+    """
+    Wait until every check of READY_CHECKS named in `ready` passes (woken up
+    by the attribute listeners, polled every 0.1 s in case an update is missed).
+
+    Returns:
+    --------
+    missing: list
+        Checks still failing after `timeout` seconds.
+    """
+    wakeup = threading.Event()
+
+    def listener(vehicle, attr_name, value):
+        wakeup.set()
+
+    attributes = {READY_CHECKS[name][0] for name in ready}
+    for attr_name in attributes:
+        vehicle.add_attribute_listener(attr_name, listener)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            missing = [name for name in ready if not READY_CHECKS[name][1](vehicle)]
+            for name in set(ready) - set(missing):
+                if timer is not None:
+                    timer.mark(f"ready.{name}")
+            remaining = deadline - time.monotonic()
+            if not missing or remaining <= 0:
+                return missing
+            wakeup.wait(min(0.1, remaining))
+            wakeup.clear()
+    finally:
+        for attr_name in attributes:
+            vehicle.remove_attribute_listener(attr_name, listener)
+
+
+def fast_connect(connection_string, ready=DEFAULT_READY, timeout=30., cache=None, timer=None, **connect_kwargs):
+    """
+    Connect to a vehicle without waiting for the parameter download.
+
+    Parameters:
+    -----------
+    connection_string: str
+        dronekit connection string (e.g. "/dev/ttyACM0").
+    ready: tuple
+        Names of READY_CHECKS to wait for.
+    timeout: float
+        Seconds waited for them (the vehicle is returned anyway, with a warning).
+    cache: ParameterCache
+        Attached to the vehicle if given.
+    timer: StartupTimer
+        Gets the "connected" and "ready" milestones.
+    connect_kwargs:
+        Passed to dronekit.connect (baud, heartbeat_timeout...).
+
+    Returns:
+    --------
+    vehicle: dronekit.Vehicle
+    """
+    from dronekit import connect
+    timer = timer or StartupTimer(verbose=False)
+    vehicle = connect(connection_string, wait_ready=False, **connect_kwargs)
+    timer.mark("connected")
+    if cache is not None:
+        cache.attach(vehicle)
+    missing = wait_for_attributes(vehicle, ready, timeout, timer)
+    if missing:
+        print(f"[Connect] still waiting for {', '.join(missing)} after {timeout:.0f} s, starting anyway")
+    timer.mark("ready")
+    return vehicle
+
+
+def add_connect_arguments(parser):
+    """
+    Connection options shared by the acquisition scripts.
+    """
+    parser.add_argument('--wait_ready', action='store_true',
+                        help="Wait for the full parameter download before starting (dronekit wait_ready=True).")
+    parser.add_argument('--ready', default=",".join(DEFAULT_READY),
+                        help="Comma separated attributes waited for before starting: " + ", ".join(READY_CHECKS) + ".")
+    parser.add_argument('--ready_timeout', type=float, default=30.,
+                        help="Seconds waited for --ready before starting anyway.")
+    parser.add_argument('--param_cache', default=DEFAULT_CACHE_DIR,
+                        help="Folder of the parameter cache (one file per firmware version).")
+
+
+def connect_vehicle(args, timer=None):
+    """
+    Connect with the options of add_connect_arguments.
+
+    Returns:
+    --------
+    vehicle, cache (None with --wait_ready)
+    """
+    if args.wait_ready:
+        from dronekit import connect
+        vehicle = connect(args.connect, wait_ready=True)
+        if timer is not None:
+            timer.mark("ready")
+        return vehicle, None
+    cache = ParameterCache(args.param_cache, timer)
+    ready = [name for name in args.ready.split(",") if name]
+    unknown = set(ready) - set(READY_CHECKS)
+    if unknown:
+        raise ValueError(f"unknown --ready attributes: {', '.join(sorted(unknown))}")
+    vehicle = fast_connect(args.connect, ready, args.ready_timeout, cache, timer)
+    return vehicle, cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure how long the vehicle takes to be ready for the acquisition')
+    parser.add_argument('--connect', required=True, help="Vehicle connection target string.")
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--ready', default=",".join(READY_CHECKS),
+                        help="Comma separated attributes to wait for: " + ", ".join(READY_CHECKS) + ".")
+    parser.add_argument('--timeout', type=float, default=120.)
+    parser.add_argument('--param_cache', default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    startup = StartupTimer()
+    cache = ParameterCache(args.param_cache, startup)
+    vehicle = fast_connect(args.connect, args.ready.split(","), args.timeout, cache, startup, baud=args.baud)
+    print(f"firmware {firmware_key(vehicle)}: {len(cache.cached)} cached parameters")
+    # the full download, as wait_ready=True would wait for it
+    while "parameters" not in startup.marks and time.monotonic() - startup.start < args.timeout:
+        time.sleep(0.1)
+    print(startup.summary())
+    cache.detach()
+    vehicle.close()
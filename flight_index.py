@@ -0,0 +1,548 @@
+"""
+Spatial index of many flights: which flights, and which minutes of them,
+covered an area, and where those minutes are in the LiDAR captures.
+
+Every telemetry log (".custom" from DataGenerator.save2file, or ".tlog") is
+read once and its track cut into tile visits: the time spent inside one Web
+Mercator tile (zoom 18 tiles are about 150 m wide).  Visits are stored in a
+SQLite database with a B-tree index on the tile coordinates.  Captures (the
+pcap files named by getFileName in Velodyne_pcap.cpp, pcap_capture.py
+segments or LiDAR containers) are matched to the visits by their packet
+timestamps -- the capture name is local time without a zone, the records are
+UTC -- and the index rows and byte range of the packets of every visit are
+stored next to it.  An area query is a range scan of the tile index, and the
+packets it returns are cut out of the captures without reading anything else.
+
+Logs and captures already indexed are skipped unless their size or
+modification time changed, so `update` can run after every flight.
+
+Usage:
+------
+$ python3 flight_index.py update flights.db --logs logs/ --captures /media/usb/pcap/
+$ python3 flight_index.py query flights.db --bbox=-12.071,-77.082,-12.068,-77.078 [--from=2020-09-13T15:00:00]
+$ python3 flight_index.py extract flights.db --bbox=-12.071,-77.082,-12.068,-77.078 --out area1/ [--kind=data]
+"""
+import argparse
+import collections
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Velodyne_pcap", "pcap"))
+
+from lidar_container import open_capture, write_rows
+from pcap_reader import parse_time, search_timestamps
+from pcap_tools import parse_kinds
+from telemetry_log import load_telemetry
+
+DEFAULT_ZOOM = 18
+# visits of one tile closer than this (s) are merged: hovering on a tile edge
+MERGE_GAP = 10.
+# jumps longer than this (tiles) between two samples are not interpolated (GPS glitch, 0/0 before the fix)
+MAX_STEP_TILES = 64
+METERS_PER_DEGREE = 111320.
+
+LOG_EXTENSIONS = (".custom", ".tlog")
+CAPTURE_EXTENSIONS = (".pcap", ".lcap")
+
+VISIT_DTYPE = np.dtype([('tx', 'i8'), ('ty', 'i8'), ('t_start', 'f8'), ('t_end', 'f8')])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS flights (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime REAL,
+                                    t_start REAL, t_end REAL, samples INTEGER);
+CREATE TABLE IF NOT EXISTS captures (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime REAL,
+                                     t_start REAL, t_end REAL, packets INTEGER);
+CREATE TABLE IF NOT EXISTS visits (id INTEGER PRIMARY KEY, flight INTEGER, tx INTEGER, ty INTEGER,
+                                   t_start REAL, t_end REAL);
+CREATE TABLE IF NOT EXISTS ranges (visit INTEGER, capture INTEGER, first_row INTEGER, last_row INTEGER,
+                                   byte_start INTEGER, byte_end INTEGER);
+CREATE INDEX IF NOT EXISTS visits_tile ON visits (tx, ty);
+CREATE INDEX IF NOT EXISTS visits_flight ON visits (flight);
+CREATE INDEX IF NOT EXISTS visits_time ON visits (t_start);
+CREATE INDEX IF NOT EXISTS ranges_visit ON ranges (visit);
+CREATE INDEX IF NOT EXISTS ranges_capture ON ranges (capture);
+"""
+
+Coverage = collections.namedtuple('Coverage', ['flight', 'capture', 't_start', 't_end',
+                                               'first_row', 'last_row', 'byte_start', 'byte_end'])
+
+
+def tile_coordinates(lat, lon, zoom=DEFAULT_ZOOM):
+    """
+    Fractional Web Mercator tile coordinates (x east, y south) of positions in
+    decimal degrees: the tile is (floor(x), floor(y)).
+    """
+    n = float(1 << zoom)
+    x = (np.asarray(lon, dtype=np.float64) + 180.) / 360. * n
+    y = (1. - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2. * n
+    return x, y
+
+
+def track_visits(telemetry, zoom=DEFAULT_ZOOM, merge_gap=MERGE_GAP):
+    """
+    Cut a flight track into tile visits.
+
+    The vehicle is assumed to fly straight between two samples, so a tile
+    crossed between two sparse samples still gets a visit.  A visit lasts
+    until the vehicle is first seen in the next tile.
+
+    Parameters:
+    -----------
+    telemetry: np.ndarray
+        telemetry_log array (utc, lat, lon fields).
+    merge_gap: float
+        Visits of the same tile less than this (s) apart are merged.
+
+    Returns:
+    --------
+    visits: np.ndarray
+        Structured array with VISIT_DTYPE, ordered by start time.
+    """
+    valid = ~(np.isnan(telemetry['utc']) | np.isnan(telemetry['lat']) | np.isnan(telemetry['lon']))
+    telemetry = telemetry[valid]
+    if len(telemetry) == 0:
+        return np.empty(0, dtype=VISIT_DTYPE)
+    order = np.argsort(telemetry['utc'], kind='stable')
+    t = telemetry['utc'][order].astype(np.float64)
+    x, y = tile_coordinates(telemetry['lat'][order], telemetry['lon'][order], zoom)
+
+    # at least two points per tile between consecutive samples
+    jump = np.maximum(np.abs(np.diff(x)), np.abs(np.diff(y)))
+    steps = np.where(jump > MAX_STEP_TILES, 1, np.maximum(np.ceil(jump * 2), 1)).astype(np.int64)
+    segment = np.repeat(np.arange(len(steps)), steps)
+    fraction = (np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+    t = np.append(t[segment] + fraction * (t[segment + 1] - t[segment]), t[-1]) if len(steps) else t
+    x = np.append(x[segment] + fraction * (x[segment + 1] - x[segment]), x[-1]) if len(steps) else x
+    y = np.append(y[segment] + fraction * (y[segment + 1] - y[segment]), y[-1]) if len(steps) else y
+
+    tx, ty = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], (tx[1:] != tx[:-1]) | (ty[1:] != ty[:-1])]))
+    ends = np.append(starts[1:], len(t) - 1)
+    runs = np.empty(len(starts), dtype=VISIT_DTYPE)
+    runs['tx'], runs['ty'] = tx[starts], ty[starts]
+    runs['t_start'], runs['t_end'] = t[starts], t[ends]
+
+    # merge the visits of a tile closer than merge_gap
+    runs = runs[np.lexsort((runs['t_start'], runs['ty'], runs['tx']))]
+    new = np.ones(len(runs), dtype=bool)
+    new[1:] = (runs['tx'][1:] != runs['tx'][:-1]) | (runs['ty'][1:] != runs['ty'][:-1]) | \
+              (runs['t_start'][1:] > runs['t_end'][:-1] + merge_gap)
+    first = np.flatnonzero(new)
+    visits = runs[first]
+    visits['t_end'] = np.maximum.reduceat(runs['t_end'], first)
+    return visits[np.argsort(visits['t_start'], kind='stable')]
+
+
+def merge_coverage(rows):
+    """
+    Merge query rows (ordered by flight, capture and time) that overlap in
+    time into Coverage tuples: consecutive visits of a flight over the area
+    become one range of packets.
+    """
+    coverage = []
+    for row in rows:
+        current = Coverage(*row)
+        if coverage:
+            last = coverage[-1]
+            if (last.flight, last.capture) == (current.flight, current.capture) and current.t_start <= last.t_end:
+                if current.capture is None:
+                    coverage[-1] = last._replace(t_end=max(last.t_end, current.t_end))
+                else:
+                    coverage[-1] = last._replace(t_end=max(last.t_end, current.t_end),
+                                                 last_row=max(last.last_row, current.last_row),
+                                                 byte_end=max(last.byte_end, current.byte_end))
+                continue
+        coverage.append(current)
+    return coverage
+
+
+def packet_ranges(capture, starts, ends, search_ts=None):
+    """
+    Index rows [first, last) and byte range [byte_start, byte_end) of the
+    packets of `capture` stamped in every [starts[i], ends[i]] (byte fields
+    are meaningless where last == first).
+    """
+    if search_ts is None:
+        search_ts = search_timestamps(capture.index['ts'])
+    first = np.searchsorted(search_ts, starts, side='left')
+    last = np.searchsorted(search_ts, ends, side='right')
+    offsets = capture.index['offset'].astype(np.int64)
+    caplen = capture.index['caplen'].astype(np.int64)
+    byte_start = offsets[np.minimum(first, len(offsets) - 1)] - capture.record_header_len
+    byte_end = offsets[np.maximum(last - 1, 0)] + caplen[np.maximum(last - 1, 0)]
+    return first, last, byte_start, byte_end
+
+
+def clip_coverage(coverage, t_from=None, t_to=None):
+    """
+    Trim Coverage tuples to [t_from, t_to] (epoch s, None for an open end):
+    their times, and the rows and bytes of the packets stamped inside, looked
+    up again in the captures of the ranges that are cut.  A range left without
+    packets loses its capture fields.
+    """
+    clipped = []
+    searches = {}
+    for c in coverage:
+        t_start = c.t_start if t_from is None else max(c.t_start, t_from)
+        t_end = c.t_end if t_to is None else min(c.t_end, t_to)
+        if (t_start, t_end) == (c.t_start, c.t_end):
+            clipped.append(c)
+            continue
+        if c.capture is None:
+            clipped.append(c._replace(t_start=t_start, t_end=t_end))
+            continue
+        with open_capture(c.capture) as capture:
+            if c.capture not in searches:
+                searches[c.capture] = search_timestamps(capture.index['ts'])
+            first, last, byte_start, byte_end = (int(v[0]) for v in packet_ranges(
+                capture, [t_start], [t_end], searches[c.capture]))
+        first, last = max(first, c.first_row), min(last, c.last_row)
+        if last > first:
+            clipped.append(Coverage(c.flight, c.capture, t_start, t_end, first, last,
+                                    max(byte_start, c.byte_start), min(byte_end, c.byte_end)))
+        else:
+            clipped.append(Coverage(c.flight, None, t_start, t_end, None, None, None, None))
+    return clipped
+
+
+def _file_state(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+class FlightIndex:
+    """
+    Tile index of flights and captures, persistent in a SQLite database.
+
+    Parameters:
+    -----------
+    path: str
+        Database file, created if needed.
+    zoom: int
+        Tile zoom level of a new database (the zoom of an existing one is kept).
+    """
+
+    def __init__(self, path, zoom=None):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        stored = self.db.execute("SELECT value FROM meta WHERE key = 'zoom'").fetchone()
+        if stored is None:
+            self.zoom = DEFAULT_ZOOM if zoom is None else zoom
+            with self.db:
+                self.db.execute("INSERT INTO meta VALUES ('zoom', ?)", (str(self.zoom),))
+        else:
+            self.zoom = int(stored[0])
+            if zoom is not None and zoom != self.zoom:
+                self.db.close()
+                raise ValueError(f"{path}: indexed at zoom {self.zoom}, not {zoom}")
+
+    def update(self, logs=(), captures=(), prune=True):
+        """
+        Index new or changed telemetry logs and captures.
+
+        Captures are indexed first, so a flight and its capture added in the
+        same update are matched once.  Files that cannot be read are reported
+        and skipped.
+
+        Parameters:
+        -----------
+        logs, captures: iterable
+            File paths.
+        prune: bool
+            Forget indexed files that no longer exist.
+
+        Returns:
+        --------
+        counts: collections.Counter
+            'flights', 'captures' (indexed), 'unchanged', 'failed' and 'removed' files.
+        """
+        counts = collections.Counter()
+        if prune:
+            counts['removed'] = self._prune()
+        for kind, paths, add in (('captures', captures, self._add_capture), ('flights', logs, self._add_flight)):
+            for path in paths:
+                try:
+                    with self.db:
+                        changed = add(os.path.abspath(path))
+                except (OSError, ValueError) as e:
+                    print(f"{path}: skipped ({e})")
+                    counts['failed'] += 1
+                    continue
+                counts[kind if changed else 'unchanged'] += 1
+        return counts
+
+    def _prune(self):
+        removed = 0
+        with self.db:
+            for flight, path in self.db.execute("SELECT id, path FROM flights").fetchall():
+                if not os.path.exists(path):
+                    self._delete_flight(flight)
+                    self.db.execute("DELETE FROM flights WHERE id = ?", (flight,))
+                    removed += 1
+            for capture, path in self.db.execute("SELECT id, path FROM captures").fetchall():
+                if not os.path.exists(path):
+                    self.db.execute("DELETE FROM ranges WHERE capture = ?", (capture,))
+                    self.db.execute("DELETE FROM captures WHERE id = ?", (capture,))
+                    removed += 1
+        return removed
+
+    def _delete_flight(self, flight):
+        self.db.execute("DELETE FROM ranges WHERE visit IN (SELECT id FROM visits WHERE flight = ?)", (flight,))
+        self.db.execute("DELETE FROM visits WHERE flight = ?", (flight,))
+
+    def _add_capture(self, path):
+        size, mtime = _file_state(path)
+        row = self.db.execute("SELECT id, size, mtime FROM captures WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[1:] == (size, mtime):
+            return False
+        with open_capture(path) as capture:
+            ts = capture.index['ts']
+            t_start, t_end = (float(ts.min()), float(ts.max())) if len(ts) else (None, None)
+            if row is None:
+                capture_id = self.db.execute("INSERT INTO captures (path, size, mtime, t_start, t_end, packets) "
+                                             "VALUES (?, ?, ?, ?, ?, ?)",
+                                             (path, size, mtime, t_start, t_end, len(ts))).lastrowid
+            else:
+                capture_id = row[0]
+                self.db.execute("UPDATE captures SET size = ?, mtime = ?, t_start = ?, t_end = ?, packets = ? "
+                                "WHERE id = ?", (size, mtime, t_start, t_end, len(ts), capture_id))
+                self.db.execute("DELETE FROM ranges WHERE capture = ?", (capture_id,))
+            if len(ts):
+                visits = self.db.execute("SELECT id, t_start, t_end FROM visits WHERE t_start <= ? AND t_end >= ?",
+                                         (t_end, t_start)).fetchall()
+                self._insert_ranges(capture_id, capture, visits)
+        return True
+
+    def _add_flight(self, path):
+        size, mtime = _file_state(path)
+        row = self.db.execute("SELECT id, size, mtime FROM flights WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[1:] == (size, mtime):
+            return False
+        telemetry = load_telemetry(path)
+        visits = track_visits(telemetry, self.zoom)
+        t_start, t_end = (float(visits['t_start'][0]), float(visits['t_end'].max())) if len(visits) else (None, None)
+        if row is None:
+            flight = self.db.execute("INSERT INTO flights (path, size, mtime, t_start, t_end, samples) "
+                                     "VALUES (?, ?, ?, ?, ?, ?)",
+                                     (path, size, mtime, t_start, t_end, len(telemetry))).lastrowid
+        else:
+            flight = row[0]
+            self._delete_flight(flight)
+            self.db.execute("UPDATE flights SET size = ?, mtime = ?, t_start = ?, t_end = ?, samples = ? "
+                            "WHERE id = ?", (size, mtime, t_start, t_end, len(telemetry), flight))
+        if len(visits) == 0:
+            return True
+        self.db.executemany("INSERT INTO visits (flight, tx, ty, t_start, t_end) VALUES (?, ?, ?, ?, ?)",
+                            ((flight,) + visit for visit in visits.tolist()))
+        visits = self.db.execute("SELECT id, t_start, t_end FROM visits WHERE flight = ? ORDER BY t_start",
+                                 (flight,)).fetchall()
+        captures = self.db.execute("SELECT id, path FROM captures WHERE t_start <= ? AND t_end >= ?",
+                                   (t_end, t_start)).fetchall()
+        for capture_id, capture_path in captures:
+            with open_capture(capture_path) as capture:
+                self._insert_ranges(capture_id, capture, visits)
+        return True
+
+    def _insert_ranges(self, capture_id, capture, visits):
+        """
+        Store the packets of `capture` stamped during every (id, t_start,
+        t_end) visit: index rows and byte range of the records.
+        """
+        if not visits:
+            return
+        ids, starts, ends = (np.array(column) for column in zip(*visits))
+        first, last, byte_start, byte_end = packet_ranges(capture, starts, ends)
+        keep = last > first
+        ids, first, last, byte_start, byte_end = ids[keep], first[keep], last[keep], byte_start[keep], byte_end[keep]
+        self.db.executemany("INSERT INTO ranges VALUES (?, ?, ?, ?, ?, ?)",
+                            zip(ids.tolist(), [capture_id] * len(ids), first.tolist(), last.tolist(),
+                                byte_start.tolist(), byte_end.tolist()))
+
+    def query(self, lat_min, lon_min, lat_max, lon_max, t_from=None, t_to=None, margin=0.):
+        """
+        Flights, minutes and capture packets covering an area.
+
+        Parameters:
+        -----------
+        lat_min, lon_min, lat_max, lon_max: float
+            Bounding box in decimal degrees.
+        t_from, t_to: float
+            Keep the visits overlapping [t_from, t_to] (epoch s, None for an
+            open end), trimmed to it (see clip_coverage).
+        margin: float
+            Meters added around the box: the vehicle does not need to fly over
+            an area to scan it (e.g. the useful range of the LiDAR).
+
+        Returns:
+        --------
+        coverage: list
+            Coverage tuples ordered by flight, capture and time.  Rows
+            [first_row, last_row) are index rows of the capture, bytes
+            [byte_start, byte_end) its file offsets (offsets in the equivalent
+            pcap capture for a container).  capture and the row and byte fields
+            are None for the visits without packets in any indexed capture.
+        """
+        if margin:
+            dlat = margin / METERS_PER_DEGREE
+            dlon = margin / (METERS_PER_DEGREE * np.cos(np.radians(max(abs(lat_min), abs(lat_max)))))
+            lat_min, lat_max, lon_min, lon_max = lat_min - dlat, lat_max + dlat, lon_min - dlon, lon_max + dlon
+        x0, y0 = tile_coordinates(lat_max, lon_min, self.zoom)
+        x1, y1 = tile_coordinates(lat_min, lon_max, self.zoom)
+        sql = ("SELECT f.path, c.path, v.t_start, v.t_end, r.first_row, r.last_row, r.byte_start, r.byte_end "
+               "FROM visits v JOIN flights f ON f.id = v.flight "
+               "LEFT JOIN ranges r ON r.visit = v.id LEFT JOIN captures c ON c.id = r.capture "
+               "WHERE v.tx BETWEEN ? AND ? AND v.ty BETWEEN ? AND ?")
+        parameters = [int(np.floor(x0)), int(np.floor(x1)), int(np.floor(y0)), int(np.floor(y1))]
+        if t_from is not None:
+            sql += " AND v.t_end >= ?"
+            parameters.append(t_from)
+        if t_to is not None:
+            sql += " AND v.t_start <= ?"
+            parameters.append(t_to)
+        sql += " ORDER BY f.path, c.path IS NULL, c.path, v.t_start"
+        coverage = merge_coverage(self.db.execute(sql, parameters))
+        if t_from is None and t_to is None:
+            return coverage
+        return clip_coverage(coverage, t_from, t_to)
+
+    def span(self):
+        """
+        (first, last) time (epoch s) of the indexed flights.
+        """
+        return self.db.execute("SELECT MIN(t_start), MAX(t_end) FROM flights").fetchone()
+
+    def info(self):
+        counts = {table: self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ('flights', 'captures', 'visits', 'ranges')}
+        counts['zoom'] = self.zoom
+        return counts
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def extract(coverage, out_dir, kinds=None):
+    """
+    Write the packets of a query result, one pcap capture per source capture
+    (named after it) in `out_dir`.
+
+    Returns:
+    --------
+    outputs: list
+        (path, packets) of every capture written.
+    """
+    parts = collections.defaultdict(list)
+    for c in coverage:
+        if c.capture is not None:
+            parts[c.capture].append(np.arange(c.first_row, c.last_row))
+    os.makedirs(out_dir, exist_ok=True)
+    outputs = []
+    for path in sorted(parts):
+        with open_capture(path) as capture:
+            rows = np.unique(np.concatenate(parts[path]))
+            if kinds is not None:
+                rows = rows[np.isin(capture.classify()['kind'][rows], kinds)]
+            out = os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + ".pcap")
+            outputs.append((out, write_rows(capture, out, rows)))
+    return outputs
+
+
+def find_files(paths, extensions):
+    """
+    Files with the given extensions among `paths` (files, or directories searched recursively).
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.endswith(extensions):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def parse_bbox(text):
+    try:
+        lat_min, lon_min, lat_max, lon_max = (float(v) for v in text.split(','))
+    except ValueError:
+        raise ValueError(f"--bbox={text}: expected lat_min,lon_min,lat_max,lon_max")
+    return min(lat_min, lat_max), min(lon_min, lon_max), max(lat_min, lat_max), max(lon_min, lon_max)
+
+
+def format_utc(t):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t)) + f"{t % 1:.1f}"[1:] + "Z"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Spatial tile index of flights, telemetry logs and captures')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('update', help="Index new or changed logs and captures.")
+    command.add_argument('db')
+    command.add_argument('--logs', nargs='*', default=[],
+                         help="Telemetry logs (.custom, .tlog) or directories holding them.")
+    command.add_argument('--captures', nargs='*', default=[],
+                         help="Captures (.pcap, .lcap) or directories holding them.")
+    command.add_argument('--zoom', type=int, default=None,
+                         help=f"Tile zoom level of a new index (default {DEFAULT_ZOOM}, about 150 m tiles).")
+    area = argparse.ArgumentParser(add_help=False)
+    area.add_argument('db')
+    area.add_argument('--bbox', required=True, help="lat_min,lon_min,lat_max,lon_max in decimal degrees.")
+    area.add_argument('--margin', type=float, default=0., help="Meters added around the box.")
+    area.add_argument('--from', dest='time_from', default=None,
+                      help="Start of the time window (formats of lidar_pcap_replay.py --from, offsets count "
+                           "from the first indexed flight).")
+    area.add_argument('--to', dest='time_to', default=None, help="End of the time window.")
+    commands.add_parser('query', parents=[area], help="List the flights and packets covering an area.")
+    command = commands.add_parser('extract', parents=[area], help="Write the packets covering an area.")
+    command.add_argument('--out', required=True, help="Directory of the extracted captures.")
+    command.add_argument('--kind', default='all', help="Comma separated packet classes to keep.")
+    command = commands.add_parser('info', help="Index statistics.")
+    command.add_argument('db')
+    args = parser.parse_args()
+
+    try:
+        with FlightIndex(args.db, getattr(args, 'zoom', None)) as index:
+            if args.command == 'update':
+                t0 = time.perf_counter()
+                counts = index.update(find_files(args.logs, LOG_EXTENSIONS),
+                                      find_files(args.captures, CAPTURE_EXTENSIONS))
+                print(f"{counts['flights']} flights and {counts['captures']} captures indexed, "
+                      f"{counts['unchanged']} unchanged, {counts['failed']} failed, {counts['removed']} removed "
+                      f"in {time.perf_counter() - t0:.2f} s")
+            elif args.command == 'info':
+                print(index.info())
+            else:
+                first, last = index.span()
+                if first is None:
+                    raise ValueError(f"{args.db}: no flights indexed")
+                t_from = None if args.time_from is None else parse_time(args.time_from, first, last)
+                t_to = None if args.time_to is None else parse_time(args.time_to, first, last)
+                t0 = time.perf_counter()
+                coverage = index.query(*parse_bbox(args.bbox), t_from, t_to, args.margin)
+                elapsed = time.perf_counter() - t0
+                if args.command == 'query':
+                    for c in coverage:
+                        line = f"{c.flight}  {format_utc(c.t_start)} - {format_utc(c.t_end)} ({c.t_end - c.t_start:.0f} s)"
+                        if c.capture is not None:
+                            line += f"  {c.capture} rows [{c.first_row}, {c.last_row}) " \
+                                    f"bytes [{c.byte_start}, {c.byte_end})"
+                        print(line)
+                    print(f"{len(coverage)} ranges in {elapsed * 1e3:.1f} ms")
+                else:
+                    kinds = parse_kinds(args.kind)
+                    for path, packets in extract(coverage, args.out, kinds):
+                        print(f"{path}: {packets} packets")
+    except (OSError, ValueError) as e:
+        print(f"error: {e}")
+        raise SystemExit(1)
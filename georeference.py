@@ -0,0 +1,242 @@
+"""
+Georeference LiDAR points with the telemetry recorded by DataGenerator.
+
+The pcap capture is decoded a chunk of packets at a time.  For every point the
+vehicle position is linearly interpolated and its attitude spherically
+interpolated (slerp) from the telemetry log (".custom" or ".tlog") at the point timestamp,
+and the point is rotated and translated into a local East-North-Up frame whose
+origin is the first valid fix of the flight.  Only one chunk of points is in
+memory at a time, so a whole flight is processed in bounded memory.
+
+Usage:
+------
+$ python3 georeference.py --pcap <capture.pcap> --log <filepath>.custom --out <directory>
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Velodyne_pcap", "pcap"))
+
+from pcap_reader import PcapReader
+from telemetry_log import load_telemetry
+from vlp16_decoder import decode_reader
+
+# WGS84
+EARTH_A = 6378137.0
+EARTH_E2 = 6.69437999014e-3
+
+# VLP-16 frame (x right, y forward, z up) to vehicle body frame (x forward,
+# y right, z down) for a sensor mounted level and facing forward.
+DEFAULT_MOUNT = np.array([[0., 1., 0.],
+                          [1., 0., 0.],
+                          [0., 0., -1.]])
+
+GEOREF_DTYPE = np.dtype([('east', 'f8'), ('north', 'f8'), ('up', 'f8'), ('intensity', 'u1'),
+                         ('laser_id', 'u1'), ('timestamp', 'f8')])
+
+
+def euler2quat(yaw, pitch, roll):
+    """
+    Quaternions (w, x, y, z) of ZYX (yaw, pitch, roll) rotations from body to NED.
+    """
+    cy, sy = np.cos(yaw / 2), np.sin(yaw / 2)
+    cp, sp = np.cos(pitch / 2), np.sin(pitch / 2)
+    cr, sr = np.cos(roll / 2), np.sin(roll / 2)
+    return np.stack([cr * cp * cy + sr * sp * sy,
+                     sr * cp * cy - cr * sp * sy,
+                     cr * sp * cy + sr * cp * sy,
+                     cr * cp * sy - sr * sp * cy], axis=-1)
+
+
+def slerp(q0, q1, fraction):
+    """
+    Vectorized spherical linear interpolation between quaternion arrays.
+    """
+    dot = np.einsum("ij,ij->i", q0, q1)
+    # take the short way around
+    q1 = np.where(dot[:, None] < 0, -q1, q1)
+    dot = np.abs(dot)
+    theta = np.arccos(np.clip(dot, -1., 1.))
+    sin_theta = np.sin(theta)
+    close = sin_theta < 1e-6
+    safe = np.where(close, 1., sin_theta)
+    w0 = np.where(close, 1. - fraction, np.sin((1. - fraction) * theta) / safe)
+    w1 = np.where(close, fraction, np.sin(fraction * theta) / safe)
+    q = w0[:, None] * q0 + w1[:, None] * q1
+    return q / np.linalg.norm(q, axis=1)[:, None]
+
+
+def rotate(q, v):
+    """
+    Rotate vectors v (N, 3) by unit quaternions q (N, 4).
+    """
+    w = q[:, :1]
+    u = q[:, 1:]
+    t = 2. * np.cross(u, v)
+    return v + w * t + np.cross(u, t)
+
+
+class Trajectory:
+    """
+    Vehicle position and attitude over time, from a telemetry log.
+
+    Attributes:
+    -----------
+    utc: np.ndarray
+        Sample times (UTC epoch seconds), strictly increasing.
+    enu: np.ndarray
+        (N, 3) vehicle position in the local East-North-Up frame (m).
+    quat: np.ndarray
+        (N, 4) attitude quaternions, body to NED.
+    origin: tuple
+        (lat, lon, alt) of the local frame origin.
+    """
+
+    def __init__(self, telemetry, origin=None):
+        valid = np.ones(len(telemetry), dtype=bool)
+        for name in ['lat', 'lon', 'alt', 'yaw', 'roll', 'pitch']:
+            valid &= ~np.isnan(telemetry[name])
+        telemetry = telemetry[valid]
+        # save2file logs every location and attitude update with the time of the
+        # last attitude update: keep the last sample of every timestamp
+        _, last = np.unique(telemetry['utc'][::-1], return_index=True)
+        telemetry = telemetry[len(telemetry) - 1 - last]
+        if len(telemetry) < 2:
+            raise ValueError("at least two valid telemetry samples are needed")
+        alt = telemetry['alt']
+
+        if origin is None:
+            origin = (float(telemetry['lat'][0]), float(telemetry['lon'][0]), float(alt[0]))
+        self.origin = origin
+        self.utc = telemetry['utc']
+        self.enu = self.geodetic2enu(telemetry['lat'], telemetry['lon'], alt)
+        self.quat = euler2quat(telemetry['yaw'], telemetry['pitch'], telemetry['roll'])
+
+    def geodetic2enu(self, lat, lon, alt):
+        """
+        Local tangent plane coordinates around the origin (equirectangular
+        approximation with the WGS84 radii of curvature at the origin, accurate
+        to centimeters over a survey area of a few kilometers).
+        """
+        lat0, lon0, alt0 = self.origin
+        phi = np.radians(lat0)
+        denom = 1. - EARTH_E2 * np.sin(phi) ** 2
+        meridian = EARTH_A * (1. - EARTH_E2) / denom ** 1.5
+        normal = EARTH_A / np.sqrt(denom)
+        north = np.radians(lat - lat0) * meridian
+        east = np.radians(lon - lon0) * normal * np.cos(phi)
+        return np.stack([east, north, alt - alt0], axis=-1)
+
+    def covers(self, t):
+        return (t >= self.utc[0]) & (t <= self.utc[-1])
+
+    def interpolate(self, t):
+        """
+        Position (linear) and attitude (slerp) at times t inside the trajectory.
+
+        Returns:
+        --------
+        (enu, quat): (N, 3) and (N, 4) arrays.
+        """
+        upper = np.clip(np.searchsorted(self.utc, t, side="right"), 1, len(self.utc) - 1)
+        lower = upper - 1
+        fraction = (t - self.utc[lower]) / (self.utc[upper] - self.utc[lower])
+        enu = self.enu[lower] + fraction[:, None] * (self.enu[upper] - self.enu[lower])
+        quat = slerp(self.quat[lower], self.quat[upper], fraction)
+        return enu, quat
+
+
+def georeference_points(points, trajectory, mount=DEFAULT_MOUNT, time_offset=0.):
+    """
+    Transform decoded points (see vlp16_decoder.POINT_DTYPE, pcap timestamps)
+    into the trajectory's local ENU frame. Points outside the time span of the
+    trajectory are dropped.
+
+    Parameters:
+    -----------
+    points: np.ndarray
+        Decoded points stamped with pcap (UTC epoch) time.
+    trajectory: Trajectory
+        Vehicle trajectory.
+    mount: np.ndarray
+        3x3 rotation from the sensor frame to the vehicle body frame.
+    time_offset: float
+        Seconds added to the point timestamps to match the telemetry clock.
+
+    Returns:
+    --------
+    georeferenced: np.ndarray
+        Structured array with GEOREF_DTYPE.
+    """
+    t = points['timestamp'] + time_offset
+    keep = trajectory.covers(t)
+    points, t = points[keep], t[keep]
+    enu, quat = trajectory.interpolate(t)
+
+    sensor = np.stack([points['x'], points['y'], points['z']], axis=-1).astype(np.float64)
+    ned = rotate(quat, sensor @ mount.T)
+
+    georeferenced = np.empty(len(points), dtype=GEOREF_DTYPE)
+    georeferenced['east'] = enu[:, 0] + ned[:, 1]
+    georeferenced['north'] = enu[:, 1] + ned[:, 0]
+    georeferenced['up'] = enu[:, 2] - ned[:, 2]
+    georeferenced['intensity'] = points['intensity']
+    georeferenced['laser_id'] = points['laser_id']
+    georeferenced['timestamp'] = t
+    return georeferenced
+
+
+def georeference_capture(pcap_path, log_path, out_dir, chunk_packets=4096, time_offset=0.):
+    """
+    Georeference a whole capture chunk by chunk, writing "chunk_NNNNNN.npy"
+    files (GEOREF_DTYPE) and "georef.json" (origin and chunk list) to out_dir.
+
+    Returns:
+    --------
+    total: int
+        Number of georeferenced points written.
+    """
+    trajectory = Trajectory(load_telemetry(log_path))
+    os.makedirs(out_dir, exist_ok=True)
+    chunks = []
+    total = 0
+    with PcapReader(pcap_path) as reader:
+        for points in decode_reader(reader, chunk_packets=chunk_packets):
+            georeferenced = georeference_points(points, trajectory, time_offset=time_offset)
+            if len(georeferenced) == 0:
+                continue
+            name = "chunk_%06d.npy" % len(chunks)
+            np.save(os.path.join(out_dir, name), georeferenced)
+            chunks.append({'file': name, 'points': len(georeferenced),
+                           'start': float(georeferenced['timestamp'][0]),
+                           'end': float(georeferenced['timestamp'][-1])})
+            total += len(georeferenced)
+
+    with open(os.path.join(out_dir, "georef.json"), 'w') as f:
+        json.dump({'origin': {'lat': trajectory.origin[0], 'lon': trajectory.origin[1],
+                              'alt': trajectory.origin[2]},
+                   'frame': "ENU", 'pcap': pcap_path, 'log': log_path,
+                   'time_offset': time_offset, 'points': total, 'chunks': chunks}, f, indent=2)
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Georeference VLP-16 points with DataGenerator telemetry')
+    parser.add_argument('--pcap', required=True,
+                        help="LiDAR capture recorded by Velodyne_pcap.")
+    parser.add_argument('--log', required=True,
+                        help="Telemetry log (.custom or .tlog) written by send2velodyne.py.")
+    parser.add_argument('--out', required=True,
+                        help="Directory where the georeferenced point chunks are written.")
+    parser.add_argument('--chunk_packets', type=int, default=4096,
+                        help="Packets decoded per chunk (bounds memory use).")
+    parser.add_argument('--time_offset', type=float, default=0.,
+                        help="Seconds added to the LiDAR timestamps to match the telemetry clock.")
+    args = parser.parse_args()
+
+    total = georeference_capture(args.pcap, args.log, args.out, args.chunk_packets, args.time_offset)
+    print(f"{total} points georeferenced to {args.out}")
@@ -1,10 +1,15 @@
 import dronekit_sitl
-from dronekit import connect, VehicleMode
+from dronekit import VehicleMode
+from fast_connect import ParameterCache, StartupTimer, fast_connect
+
+# waits for attitude and position only, parameters come from the cache
+startup = StartupTimer()
+parameters = ParameterCache(timer=startup)
 
 # Connection
 try:
     print("Connecting to vehicle on '/dev/ttyACM0'")
-    vehicle = connect ('/dev/ttyACM0', wait_ready = True, baud = 57600)
+    vehicle = fast_connect('/dev/ttyACM0', cache=parameters, timer=startup, baud=57600)
     sitl = False
 except:
     print("Can't connect to physical vehicle.")
@@ -14,11 +19,12 @@ except:
     connection_string = sitl.connection_string()
 
     print("Connecting to vehicle on {}".format(connection_string))
-    vehicle = connect(connection_string, wait_ready=True)
+    vehicle = fast_connect(connection_string, cache=parameters, timer=startup)
 
 print("Get some vehicle attributes (state):")
 print("Autopilot Firmware version: %s" % vehicle.version)
-print("Autopilot capabilities (supports ftp): %s" % vehicle.capabilities.ftp)
+print("Autopilot capabilities (supports ftp): %s" % (vehicle.capabilities.ftp if vehicle.capabilities else None))
+print("GPS type (parameter, live or cached): %s" % parameters.get("GPS_TYPE"))
 print("Global Location: %s" % vehicle.location.global_frame)
 print("Global Location (relative altitude): %s" % vehicle.location.global_relative_frame)
 print("Local Location: %s" % vehicle.location.local_frame)
@@ -40,6 +46,8 @@ print("System status: %s" % vehicle.system_status.state)
 print("Mode: %s" % vehicle.mode.name)
 print("Armed: %s" % vehicle.armed)
 
+print(startup.summary())
+parameters.detach()
 vehicle.close()
 
 if sitl:
@@ -1,15 +1,43 @@
-import dronekit_sitl
+import math
+import time
+
 from dronekit import connect, VehicleMode, LocationGlobalRelative
 
+def distance_to(vehicle, point):
+    """
+    Meters from the vehicle to a LocationGlobal(Relative) point, ignoring altitude
+    (equirectangular approximation, fine over a few kilometers).
+    """
+    location = vehicle.location.global_frame
+    north = math.radians(point.lat - location.lat) * 6378137.0
+    east = math.radians(point.lon - location.lon) * 6378137.0 * math.cos(math.radians(location.lat))
+    return math.hypot(north, east)
+
+def wait_for_arrival(vehicle, point, tolerance=2., timeout=300., poll=0.5):
+    """
+    Wait until the vehicle is within tolerance meters of point (or timeout seconds).
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        distance = distance_to(vehicle, point)
+        if distance <= tolerance:
+            return True
+        print(f" Distance to target: {distance:.1f} m")
+        time.sleep(poll)
+    print("Target not reached, moving on")
+    return False
+
 def simple_mission(vehicle, takeoff_alt, airspeed, points, groundspeed, rtl):
     arm_and_takeoff(vehicle, takeoff_alt)
 
     vehicle.airspeed = airspeed
 
     for n, point in enumerate(points):
-        print("Going to the {n} point...")
-        vehicle.simple_goto(point)
-        time.sleep(30) # See change in map
+        print(f"Going to the {n} point...")
+        # groundspeed: one value for every point or a list with one per point
+        speed = groundspeed[n] if isinstance(groundspeed, (list, tuple)) else groundspeed
+        vehicle.simple_goto(point, groundspeed=speed)
+        wait_for_arrival(vehicle, point)
 
     if rtl:
         print("Returning to initial point and land...")
@@ -53,6 +81,8 @@ def arm_and_takeoff(vehicle, aTargetAltitude):
         time.sleep(1)
 
 if __name__ == "__main__":
+    import dronekit_sitl
+
     sitl = dronekit_sitl.start_default() # basic ArduCopter simulator
     connection_string = sitl.connection_string()
 
@@ -63,5 +93,5 @@ if __name__ == "__main__":
     point1 = LocationGlobalRelative(-35.361354, 149.165218, 20)
     point2 = LocationGlobalRelative(-35.363244, 149.168801, 20)
 
-    mission(20,5,[point1, point2],[7, 10],True)
+    simple_mission(vehicle, 20, 5, [point1, point2], [7, 10], True)
     sitl.stop() # Stop simulation
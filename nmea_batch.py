@@ -0,0 +1,306 @@
+"""
+Batch NMEA GPRMC encoder.
+
+Encodes whole tracks (NumPy arrays of time, lat, lon, speed and course) at
+once.  Every field has a fixed width, so all sentences are laid out in one
+byte array with one character position per row (transposed to one sentence
+per row at the end): digits are written a contiguous row at a time with
+vectorized integer arithmetic and the checksums are one XOR reduction.
+The sentences are identical to the ones built by DataGenerator.gen_sentence.
+
+Usage:
+------
+$ python3 nmea_batch.py --check      # round trip against parse_gprmc and throughput
+$ python3 nmea_batch.py --log <filepath>.tlog [--out <file>]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from rpi_gps_datagen import mps2knots
+
+HEX_DIGITS = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+ZERO = ord("0")
+
+# (name, width) of every field between "$GPRMC," and "*", as in gen_sentence
+GPRMC_FIELDS = [("time", 6), ("status", 1), ("lat", 7), ("lat_sign", 1), ("lon", 8), ("lon_sign", 1),
+                ("speed", 6), ("course", 6), ("date", 6), ("magvar", 6), ("magvar_sign", 1)]
+
+
+def _layout(talker, fields):
+    """
+    Column of every field, position of the "*" and total sentence length.
+    """
+    columns = {}
+    pos = len(talker) + 2       # "$" + talker + ","
+    for name, width in fields:
+        columns[name] = pos
+        pos += width + 1
+    star = pos - 1
+    return columns, star, star + 3
+
+
+GPRMC_COLUMNS, GPRMC_STAR, GPRMC_LEN = _layout("GPRMC", GPRMC_FIELDS)
+
+
+def _put_digits(cols, column, values, width):
+    """
+    Write non-negative integers as zero-padded decimal digits.
+    """
+    values = values.astype(np.int64)
+    for k in range(width - 1, -1, -1):
+        values, digit = np.divmod(values, 10)
+        cols[column + k] = digit
+        cols[column + k] += ZERO
+
+
+def _put_fixed(cols, column, values, width):
+    """
+    Write non-negative values as zero-padded "%0{width}.2f".
+    """
+    hundredths = np.rint(np.asarray(values, dtype=np.float64) * 100).astype(np.int64)
+    hundredths = np.clip(hundredths, 0, 10 ** (width - 1) - 1)
+    # digits written one column right, then the integer part shifted left over the "."
+    _put_digits(cols, column + 1, hundredths, width - 1)
+    cols[column:column + width - 3] = cols[column + 1:column + width - 2].copy()
+    cols[column + width - 3] = ord(".")
+
+
+def _put_coordinate(cols, column, sign_column, values, degree_width, positive, negative):
+    """
+    Write decimal degrees as NMEA "d..dmm.mm" plus the hemisphere letter.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    hundredths = np.rint(np.abs(values) * 6000).astype(np.int64)
+    degrees, hundredths = np.divmod(hundredths, 6000)
+    # "dd" + "mmmm" written as one number, then the "." inserted
+    _put_digits(cols, column, degrees * 10000 + hundredths, degree_width + 4)
+    point = column + degree_width + 2
+    cols[point + 1:point + 3] = cols[point:point + 2].copy()
+    cols[point] = ord(".")
+    cols[sign_column] = np.where(values < 0, ord(negative), ord(positive))
+
+
+def checksum_rows(rows, star):
+    """
+    NMEA checksums of fixed-width sentences: XOR of the bytes between "$" and "*".
+    """
+    return np.bitwise_xor.reduce(rows[:, 1:star], axis=1)
+
+
+def _checksum_cols(cols, star):
+    return np.bitwise_xor.reduce(cols[1:star], axis=0)
+
+
+def encode_gprmc_rows(utc, lat, lon, speed, course, status=None, magvar=None):
+    """
+    Encode GPRMC sentences into a (N, GPRMC_LEN) uint8 array.
+
+    Parameters:
+    -----------
+    utc: np.ndarray
+        UTC epoch (s).
+    lat, lon: np.ndarray
+        Decimal degrees.
+    speed: np.ndarray
+        Speed over ground (m/s).
+    course: np.ndarray
+        Course made good (deg).
+    status: np.ndarray
+        True where the fix is valid ("A"), False for warning ("V"). All valid if None.
+    magvar: np.ndarray
+        Magnetic variation (deg, east positive). 0 if None.
+
+    Returns:
+    --------
+    rows: np.ndarray
+    """
+    utc = np.asarray(utc, dtype=np.float64)
+    n = len(utc)
+    cols = np.full((GPRMC_LEN, n), ord(","), dtype=np.uint8)
+    cols[:7] = np.frombuffer(b"$GPRMC,", dtype=np.uint8)[:, None]
+    c = GPRMC_COLUMNS
+
+    seconds = np.floor(utc).astype(np.int64)
+    days = seconds // 86400
+    of_day = seconds % 86400
+    _put_digits(cols, c["time"], of_day // 3600 * 10000 + of_day % 3600 // 60 * 100 + of_day % 60, 6)
+
+    date = days.astype("datetime64[D]")
+    month_start = date.astype("datetime64[M]")
+    day = (date - month_start).astype(np.int64) + 1
+    month = month_start.astype(np.int64) % 12 + 1
+    year = date.astype("datetime64[Y]").astype(np.int64) + 1970
+    _put_digits(cols, c["date"], day * 10000 + month * 100 + year % 100, 6)
+
+    valid = np.ones(n, dtype=bool) if status is None else np.asarray(status, dtype=bool)
+    cols[c["status"]] = np.where(valid, ord("A"), ord("V"))
+    _put_coordinate(cols, c["lat"], c["lat_sign"], lat, 2, "N", "S")
+    _put_coordinate(cols, c["lon"], c["lon_sign"], lon, 3, "E", "W")
+    _put_fixed(cols, c["speed"], np.maximum(mps2knots(np.asarray(speed, dtype=np.float64)), 0), 6)
+    _put_fixed(cols, c["course"], np.mod(course, 360.), 6)
+    magvar = np.zeros(n) if magvar is None else np.asarray(magvar, dtype=np.float64)
+    _put_fixed(cols, c["magvar"], np.abs(magvar), 6)
+    cols[c["magvar_sign"]] = np.where(magvar < 0, ord("W"), ord("E"))
+
+    cols[GPRMC_STAR] = ord("*")
+    checksum = _checksum_cols(cols, GPRMC_STAR)
+    cols[GPRMC_STAR + 1] = HEX_DIGITS[checksum >> 4]
+    cols[GPRMC_STAR + 2] = HEX_DIGITS[checksum & 0xF]
+    return np.ascontiguousarray(cols.T)
+
+
+def encode_gprmc(utc, lat, lon, speed, course, status=None, magvar=None, newline=b"\r\n"):
+    """
+    Encode GPRMC sentences (see encode_gprmc_rows) as one bytes buffer, one
+    sentence per line.
+    """
+    rows = encode_gprmc_rows(utc, lat, lon, speed, course, status, magvar)
+    if newline:
+        ending = np.frombuffer(newline, dtype=np.uint8)
+        lines = np.empty((len(rows), rows.shape[1] + len(ending)), dtype=np.uint8)
+        lines[:, :rows.shape[1]] = rows
+        lines[:, rows.shape[1]:] = ending
+        rows = lines
+    return rows.tobytes()
+
+
+def encode_telemetry(telemetry, newline=b"\r\n"):
+    """
+    Regenerate the GPRMC timeline of a recorded flight from its telemetry log
+    (see telemetry_log.load_telemetry). Rows without a position are skipped.
+    Course is taken from consecutive positions, speed from the log's
+    groundspeed when recorded (binary logs) or from the positions otherwise.
+    """
+    valid = np.isfinite(telemetry['lat']) & np.isfinite(telemetry['lon'])
+    telemetry = telemetry[valid]
+    utc = np.asarray(telemetry['utc'], dtype=np.float64)
+    lat = np.asarray(telemetry['lat'], dtype=np.float64)
+    lon = np.asarray(telemetry['lon'], dtype=np.float64)
+
+    # local east/north displacement between samples (equirectangular)
+    north = np.radians(np.diff(lat)) * 6378137.0
+    east = np.radians(np.diff(lon)) * 6378137.0 * np.cos(np.radians(lat[:-1]))
+    dt = np.diff(utc)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        step_speed = np.where(dt > 0, np.hypot(east, north) / dt, 0.)
+    step_course = np.degrees(np.arctan2(east, north)) % 360.
+    # every sample takes the course/speed of the step that ends at it
+    course = np.concatenate([step_course[:1], step_course]) if len(utc) > 1 else np.zeros(len(utc))
+    speed = np.concatenate([step_speed[:1], step_speed]) if len(utc) > 1 else np.zeros(len(utc))
+
+    status = None
+    if 'groundspeed' in telemetry.dtype.names:
+        groundspeed = np.asarray(telemetry['groundspeed'], dtype=np.float64)
+        speed = np.where(np.isfinite(groundspeed), groundspeed, speed)
+        status = telemetry['ekf_ok'] != 0      # unknown (255) counts as valid
+    return encode_gprmc(utc, lat, lon, speed, course, status, newline=newline)
+
+
+def parse_gprmc(sentence):
+    """
+    Parse one GPRMC sentence, checking its checksum.
+
+    Returns:
+    --------
+    fields: dict
+        utc (epoch s, whole seconds), valid, lat, lon (decimal degrees),
+        speed (knots), course (deg), magvar (deg, east positive).
+    """
+    if isinstance(sentence, bytes):
+        sentence = sentence.decode("ascii")
+    sentence = sentence.strip()
+    if not sentence.startswith("$") or sentence[-3] != "*":
+        raise ValueError(f"not an NMEA sentence: {sentence!r}")
+    body = sentence[1:-3]
+    checksum = 0
+    for char in body.encode("ascii"):
+        checksum ^= char
+    if checksum != int(sentence[-2:], 16):
+        raise ValueError(f"bad checksum: {sentence!r}")
+    f = body.split(",")
+    if f[0] != "GPRMC":
+        raise ValueError(f"not a GPRMC sentence: {sentence!r}")
+
+    def coordinate(value, degree_width, sign):
+        degrees = int(value[:degree_width]) + float(value[degree_width:]) / 60
+        return -degrees if sign in "SW" else degrees
+
+    stamp = np.datetime64(f"20{f[9][4:6]}-{f[9][2:4]}-{f[9][0:2]}T{f[1][0:2]}:{f[1][2:4]}:{f[1][4:6]}", "s")
+    magvar = float(f[10]) if f[10] else 0.
+    return {"utc": float(stamp.astype(np.int64)), "valid": f[2] == "A",
+            "lat": coordinate(f[3], 2, f[4]), "lon": coordinate(f[5], 3, f[6]),
+            "speed": float(f[7]), "course": float(f[8]),
+            "magvar": -magvar if f[11] == "W" else magvar}
+
+
+def roundtrip_check(n=100000, seed=0):
+    """
+    Encode a random track, parse a sample of it back and compare, then check
+    that encode_gprmc matches DataGenerator.gen_sentence.
+    """
+    import datetime
+    import types
+    from rpi_gps_datagen import DataGenerator
+
+    rng = np.random.default_rng(seed)
+    utc = rng.uniform(946684800, 4102444799, n)         # 2000-2099
+    lat = rng.uniform(-89.9, 89.9, n)
+    lon = rng.uniform(-179.9, 179.9, n)
+    speed = rng.uniform(0, 60, n)
+    course = rng.uniform(0, 360, n)
+    status = rng.random(n) < 0.9
+    lines = encode_gprmc(utc, lat, lon, speed, course, status).split(b"\r\n")[:-1]
+    assert len(lines) == n
+
+    for i in rng.choice(n, min(n, 2000), replace=False):
+        fields = parse_gprmc(lines[i])
+        assert fields["utc"] == np.floor(utc[i]), (lines[i], utc[i])
+        assert fields["valid"] == status[i]
+        assert abs(fields["lat"] - lat[i]) <= 0.005 / 60 + 1e-9, (lines[i], lat[i])
+        assert abs(fields["lon"] - lon[i]) <= 0.005 / 60 + 1e-9, (lines[i], lon[i])
+        assert abs(fields["speed"] - mps2knots(speed[i])) <= 0.005 + 1e-9
+        assert abs(fields["course"] - course[i]) <= 0.005 + 1e-9
+
+    for i in range(200):
+        utc_dt = datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=int(utc[i]))
+        datagen = DataGenerator(types.SimpleNamespace(lat=lat[i], lon=lon[i], alt=0.), None, None,
+                                speed[i], status[i], None)
+        datagen.state.set(utc=utc_dt)
+        datagen.course_made_good = course[i]
+        expected = datagen.gen_sentence().encode("ascii")
+        assert lines[i] == expected, (lines[i], expected)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Batch GPRMC encoder')
+    parser.add_argument('--check', action='store_true',
+                        help="Round trip a random track through parse_gprmc and compare with gen_sentence.")
+    parser.add_argument('--count', type=int, default=1000000,
+                        help="Sentences encoded for the throughput measurement.")
+    parser.add_argument('--log', help="Telemetry log (.custom or .tlog) to regenerate the GPRMC timeline from.")
+    parser.add_argument('--out', help="NMEA file written from --log.")
+    args = parser.parse_args()
+
+    if args.log:
+        from telemetry_log import load_telemetry
+        blob = encode_telemetry(load_telemetry(args.log))
+        with open(args.out or args.log + ".nmea", 'wb') as f:
+            f.write(blob)
+        print(f"{blob.count(b'$')} sentences written to {args.out or args.log + '.nmea'}")
+        raise SystemExit
+
+    if args.check:
+        roundtrip_check()
+        print("round trip OK")
+
+    n = args.count
+    utc = 1600000000 + np.arange(n, dtype=np.float64)
+    lat = np.linspace(-12.05, -12.06, n)
+    lon = np.linspace(-77.03, -77.04, n)
+    t0 = time.perf_counter()
+    blob = encode_gprmc(utc, lat, lon, np.full(n, 5.), np.full(n, 90.))
+    elapsed = time.perf_counter() - t0
+    print(f"{n} sentences ({len(blob)} bytes) in {elapsed:.3f} s: {n / elapsed / 1e6:.2f} M sentences/s")
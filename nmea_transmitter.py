@@ -0,0 +1,94 @@
+import socket
+
+
+class DestinationStats:
+    """
+    Send counters of one NMEA destination.
+    """
+    __slots__ = ("sent", "bytes", "errors", "last_error")
+
+    def __init__(self):
+        self.sent = 0
+        self.bytes = 0
+        self.errors = 0
+        self.last_error = None
+
+    def as_dict(self):
+        return {"sent": self.sent, "bytes": self.bytes, "errors": self.errors,
+                "last_error": self.last_error}
+
+
+class NmeaTransmitter:
+    """
+    Send NMEA sentences over UDP to one or more destinations through a single
+    long-lived socket.
+
+    Every sentence is sent as its own datagram to every destination (the
+    VLP-16 expects one sentence per datagram). A failing destination is
+    counted and skipped, it never stops the others.
+
+    Parameters:
+    -----------
+    destinations: list
+        (ip, port) tuples.
+
+    Example:
+    --------
+    >>> tx = NmeaTransmitter([("192.168.1.201", 10110), ("192.168.1.10", 10110)])
+    >>> tx.send(["$GPRMC,...*68", "$GPZDA,...*4A"])
+    >>> tx.stats()
+    """
+
+    def __init__(self, destinations=()):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.destinations = []
+        self._stats = {}
+        for ip, port in destinations:
+            self.add_destination(ip, port)
+
+    def add_destination(self, ip, port):
+        destination = (ip, int(port))
+        if destination not in self._stats:
+            self.destinations.append(destination)
+            self._stats[destination] = DestinationStats()
+
+    def send(self, sentences):
+        """
+        Send sentences (str or bytes) to every destination.
+
+        Returns:
+        --------
+        sent: int
+            Number of datagrams sent successfully.
+        """
+        if isinstance(sentences, (str, bytes)):
+            sentences = [sentences]
+        payloads = [s.encode("ascii") if isinstance(s, str) else s for s in sentences]
+        sendto = self.sock.sendto
+        sent = 0
+        for destination in self.destinations:
+            stats = self._stats[destination]
+            for payload in payloads:
+                try:
+                    stats.bytes += sendto(payload, destination)
+                    stats.sent += 1
+                    sent += 1
+                except OSError as e:
+                    stats.errors += 1
+                    stats.last_error = str(e)
+        return sent
+
+    def stats(self):
+        """
+        Send counters by destination: {"ip:port": {"sent", "bytes", "errors", "last_error"}}.
+        """
+        return {f"{ip}:{port}": self._stats[(ip, port)].as_dict() for ip, port in self.destinations}
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,299 @@
+"""
+Second-aligned PPS and NMEA scheduler.
+
+The pulse is fired on the top of every UTC second: each deadline is the next
+UTC second mapped onto the monotonic clock (re-anchored every cycle, so the
+pulses follow the system clock without accumulating sleep drift). The falling
+edge and the NMEA sentence are timed from the same rising edge, so the
+sentence always follows its pulse by a fixed offset.
+
+Usage:
+------
+$ python3 pps_scheduler.py --simulate --count 10     # timing test on any Linux box
+"""
+import argparse
+import collections
+import math
+import threading
+import time
+
+import numpy as np
+
+# sleeping is left this long before a deadline, the rest is spent polling the clock
+SPIN_MARGIN = 0.0005
+
+
+class RPiGPIO:
+    """
+    PPS output on a Raspberry Pi pin (RPi.GPIO). The pin is set up once and
+    released by close().
+    """
+
+    def __init__(self, pin=12):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.pin = pin
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(pin, GPIO.OUT, initial=GPIO.LOW)
+
+    def high(self):
+        self.GPIO.output(self.pin, 1)
+
+    def low(self):
+        self.GPIO.output(self.pin, 0)
+
+    def close(self):
+        self.low()
+        self.GPIO.cleanup(self.pin)
+
+
+class SimulatedGPIO:
+    """
+    GPIO backend recording the (monotonic time, level) of the last `history`
+    transitions instead of driving a pin.
+    """
+
+    def __init__(self, pin=12, history=3600):
+        self.pin = pin
+        self.transitions = collections.deque(maxlen=2 * history)
+
+    def high(self):
+        self.transitions.append((time.monotonic(), 1))
+
+    def low(self):
+        self.transitions.append((time.monotonic(), 0))
+
+    def rising_edges(self):
+        return np.array([t for t, level in self.transitions if level])
+
+    def close(self):
+        pass
+
+
+class PPSStats:
+    """
+    Timing of the pulses fired (the last `history` seconds are kept).
+
+    Attributes:
+    -----------
+    edges: int
+        Pulses fired.
+    missed: int
+        UTC seconds that went by without an edge (the scheduler fell behind
+        by a whole second or more).
+    edge_error: deque
+        Rising edge minus its deadline (s).
+    nmea_delay: deque
+        NMEA send time minus the rising edge (s).
+    nmea_errors: int
+        NMEA callbacks that raised an exception.
+
+    With a MetricsRegistry (see metrics.py) the same events also feed the
+    "pps.*" counters and histograms.
+    """
+
+    def __init__(self, history=3600, metrics=None):
+        self.edges = 0
+        self.missed = 0
+        self.nmea_errors = 0
+        self.edge_error = collections.deque(maxlen=history)
+        self.nmea_delay = collections.deque(maxlen=history)
+        self.metrics = metrics
+        if metrics is not None:
+            self._m_edges = metrics.counter("pps.edges")
+            self._m_missed = metrics.counter("pps.missed")
+            self._m_nmea_errors = metrics.counter("pps.nmea_errors")
+            self._m_edge_error = metrics.histogram("pps.edge_error_us")
+            self._m_nmea_delay = metrics.histogram("pps.nmea_delay_us")
+
+    def record_edge(self, error):
+        """
+        A pulse fired `error` seconds after its deadline.
+        """
+        self.edges += 1
+        self.edge_error.append(error)
+        if self.metrics is not None:
+            self._m_edges.inc()
+            self._m_edge_error.observe(abs(error))
+
+    def record_missed(self, seconds):
+        self.missed += seconds
+        if self.metrics is not None:
+            self._m_missed.inc(seconds)
+
+    def record_nmea(self, delay, failed=False):
+        """
+        The NMEA callback of a pulse returned `delay` seconds after the edge.
+        """
+        self.nmea_delay.append(delay)
+        if failed:
+            self.nmea_errors += 1
+        if self.metrics is not None:
+            self._m_nmea_delay.observe(delay)
+            if failed:
+                self._m_nmea_errors.inc()
+
+    @staticmethod
+    def _percentiles(values):
+        if not values:
+            return 0., 0., 0.
+        values = np.abs(np.asarray(values))
+        p50, p99 = np.percentile(values, [50, 99])
+        return float(p50), float(p99), float(values.max())
+
+    def jitter(self):
+        """
+        Standard deviation of the edge error (s).
+        """
+        return float(np.std(self.edge_error)) if self.edge_error else 0.
+
+    def summary(self):
+        p50, p99, worst = self._percentiles(self.edge_error)
+        text = 'pps: {} edges, {} missed seconds\nedge error: p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms, jitter {:.3f} ms'.format(
+            self.edges, self.missed, p50 * 1e3, p99 * 1e3, worst * 1e3, self.jitter() * 1e3)
+        if self.nmea_delay:
+            p50, p99, worst = self._percentiles(self.nmea_delay)
+            text += '\nnmea after edge: p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms ({} errors)'.format(
+                p50 * 1e3, p99 * 1e3, worst * 1e3, self.nmea_errors)
+        return text
+
+
+class PPSScheduler:
+    """
+    Fire a pulse on the top of every UTC second and call `on_edge` a fixed
+    offset after it.
+
+    Parameters:
+    -----------
+    gpio: RPiGPIO or SimulatedGPIO
+        Backend with high(), low() and close().
+    on_edge: callable
+        Called as on_edge(edge, second) `nmea_offset` seconds after each rising
+        edge, with the monotonic time of the edge and the UTC second it marks
+        (epoch s), e.g. to send the matching NMEA sentence.
+    pulse_duration: float
+        Pulse width (s).
+    nmea_offset: float
+        Delay of on_edge after the rising edge (s).
+    history: int
+        Seconds of timing statistics kept.
+    metrics: MetricsRegistry
+        Registry also fed with the timing statistics (see metrics.py).
+
+    Example:
+    --------
+    >>> scheduler = PPSScheduler(RPiGPIO(12), on_edge=lambda edge, second: print(second))
+    >>> scheduler.start()
+    >>> scheduler.stop()
+    >>> print(scheduler.stats.summary())
+    """
+
+    def __init__(self, gpio, on_edge=None, pulse_duration=0.01, nmea_offset=0.05, history=3600, metrics=None):
+        if not 0 < pulse_duration < 0.5 or not 0 <= nmea_offset < 0.5:
+            raise ValueError('pulse_duration and nmea_offset must be under half a second')
+        self.gpio = gpio
+        self.on_edge = on_edge
+        self.pulse_duration = pulse_duration
+        self.nmea_offset = nmea_offset
+        self.stats = PPSStats(history, metrics)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _wait(self, deadline):
+        """
+        Sleep (interruptible by stop()) then spin until the monotonic deadline.
+
+        Returns:
+        --------
+        stopped: bool
+        """
+        wait = deadline - time.monotonic()
+        if wait > SPIN_MARGIN and self._stop.wait(wait - SPIN_MARGIN):
+            return True
+        while time.monotonic() < deadline:
+            pass
+        return self._stop.is_set()
+
+    def _next_second(self):
+        """
+        Next UTC second and its deadline on the monotonic clock.
+        """
+        mono = time.monotonic()
+        utc = time.time()
+        second = math.floor(utc) + 1
+        return second, mono + (second - utc)
+
+    def run(self, count=None):
+        """
+        Fire pulses until stop() is called (or `count` pulses).
+        """
+        self._stop.clear()
+        fired = 0
+        last_second = None
+        while count is None or fired < count:
+            second, deadline = self._next_second()
+            if last_second is not None and second > last_second + 1:
+                self.stats.record_missed(second - last_second - 1)
+            if self._wait(deadline):
+                break
+            self.gpio.high()
+            edge = time.monotonic()
+            self.stats.record_edge(edge - deadline)
+            events = [(self.pulse_duration, self.gpio.low), (self.nmea_offset, lambda: self._send(edge, second))]
+            for offset, action in sorted(events, key=lambda event: event[0]):
+                # the pin is still lowered (and no sentence skipped) if stopped meanwhile
+                self._wait(edge + offset)
+                action()
+            last_second = second
+            fired += 1
+        return self.stats
+
+    def _send(self, edge, second):
+        if self.on_edge is None:
+            return
+        failed = False
+        try:
+            self.on_edge(edge, second)
+        except Exception as e:
+            failed = True
+            print(f"[PPS] on_edge failed: {e}")
+        self.stats.record_nmea(time.monotonic() - edge, failed)
+
+    def start(self, count=None):
+        """
+        Run the scheduler in a background thread.
+        """
+        self._thread = threading.Thread(target=self.run, args=(count,), name="PPSScheduler", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        self.gpio.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fire a second-aligned PPS and report its timing')
+    parser.add_argument('--pin', type=int, default=12, help="Board pin of the PPS output.")
+    parser.add_argument('--simulate', action='store_true', help="Use the simulated GPIO backend.")
+    parser.add_argument('--count', type=int, default=10, help="Number of pulses.")
+    parser.add_argument('--pulse_duration', type=float, default=0.01)
+    parser.add_argument('--nmea_offset', type=float, default=0.05)
+    args = parser.parse_args()
+
+    gpio = SimulatedGPIO(args.pin) if args.simulate else RPiGPIO(args.pin)
+    scheduler = PPSScheduler(gpio, pulse_duration=args.pulse_duration, nmea_offset=args.nmea_offset,
+                             on_edge=lambda edge, second: print(f"edge {time.strftime('%H:%M:%S', time.gmtime(second))}"))
+    try:
+        scheduler.run(args.count)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.close()
+    print(scheduler.stats.summary())
@@ -1,5 +1,13 @@
 import datetime
-import socket
+import time
+
+from nmea_transmitter import NmeaTransmitter
+from telemetry_log import create_binary_log, pack_record
+from telemetry_ring import TelemetryRing
+from telemetry_state import HANDLERS, TelemetryState
+from telemetry_writer import TelemetryWriter
+
+EPOCH = datetime.datetime(1970, 1, 1)
 
 def decdeg2dms(decimal_degree, axis):
     """
@@ -19,16 +27,16 @@ def decdeg2dms(decimal_degree, axis):
     Returns:
     --------
     dms: string
-    Degrees Minutes Seconds
+    Degrees and decimal minutes as NMEA "ddmm.mm" (lat) or "dddmm.mm" (lon)
     orient: string
     North, South, East or West orientation
 
     """
     negative = decimal_degree < 0
-    decimal_degree = abs(decimal_degree)
-    minutes, seconds = divmod(decimal_degree*3600, 60)
-    degrees, minutes = divmod(minutes, 60)
-    minutes += seconds/60
+    # work in hundredths of minute so rounding carries into the degrees
+    # (59.996' must become 1 deg 00.00', not 59.100')
+    hundredths = round(abs(decimal_degree)*6000)
+    degrees, hundredths = divmod(hundredths, 6000)
     if negative:
         if axis == "lat":
             orient = "S"
@@ -40,7 +48,8 @@ def decdeg2dms(decimal_degree, axis):
         elif axis == "lon":
             orient = "E"
 
-    dms = f"{int(degrees)}{round(minutes,2)}"
+    width = 2 if axis == "lat" else 3
+    dms = f"{degrees:0{width}d}{hundredths // 100:02d}.{hundredths % 100:02d}"
     return dms, orient
 
 def make_nmea_checksum(nmea_sent):
@@ -67,6 +76,13 @@ def make_nmea_checksum(nmea_sent):
         checksum ^= ord(char)
     return checksum
 
+def nmea_wrap(nmea_str):
+    """
+    Frame the characters of a sentence (between "$" and "*") as a full NMEA
+    sentence with its two-digit hexadecimal checksum.
+    """
+    return f"${nmea_str}*{make_nmea_checksum(nmea_str):02X}"
+
 def mps2knots(mps):
     """
     Convert MPS to Knots.
@@ -104,59 +120,210 @@ class DataGenerator:
            *68          mandatory checksum
 
     Ref: http://aprs.gids.nl/nmea/#rmc
+
+    NMEA sentences are saved to `filepath` and telemetry to `filepath`.custom
+    (log_format="text") or to the binary `filepath`.tlog (log_format="binary",
+    see telemetry_log.py) through background TelemetryWriters, call close() to
+    flush them (`writer`=AsyncTelemetryWriter when the generator runs on an
+    asyncio loop, see acquisition_async.py). Telemetry is only echoed to the
+    console if verbose.
+
+    Telemetry is kept in a TelemetryState (see telemetry_state.py): call
+    attach(vehicle) to subscribe to the vehicle attributes, every sentence and
+    log line is built from one consistent snapshot of it. The last `history`
+    updates are also kept in a TelemetryRing (see telemetry_ring.py), so
+    sentences can be built with the telemetry interpolated at a given
+    monotonic time (e.g. the PPS edge) with send_sentences(..., at=t).
+
+    With a `metrics` registry (see metrics.py) telemetry updates, NMEA sends
+    and log writes are counted and timed ("telemetry.*", "nmea.*" and "log.*").
     """
 
-    def __init__(self, global_frame, local_frame, attitude, groundspeed, ekf_ok, filepath):
-        self.global_frame = global_frame
-        self.local_frame = local_frame
-        self.attitude = attitude
-        self.groundspeed = groundspeed
-        self.ekf_ok = "A" if ekf_ok else "V" # A: OK, V: warning
+    # attributes whose update writes a telemetry line
+    SAVE_ON = frozenset(['location.global_frame', 'attitude'])
+
+    def __init__(self, global_frame, local_frame, attitude, groundspeed, ekf_ok, filepath,
+                 verbose=False, flush_every=100, flush_interval=1.0, log_format="text", history=4096,
+                 writer=TelemetryWriter, metrics=None):
+        self.history = TelemetryRing(history)
+        self.state = TelemetryState(global_frame, local_frame, attitude, groundspeed, ekf_ok,
+                                    on_update=self._on_update)
+        self.history.append_snapshot(self.state.snapshot(), utc=time.time())
         self.course_made_good = 0.0 # TODO: function to calculate and update CMG
         self.magnetic_variation = 0.0 # TODO: set listener to extract this data
         self.filepath = filepath
-        self.utc = datetime.datetime.utcnow()
-        self.utc_time = self.utc.time().strftime("%H%M%S")
-        self.utc_date = self.utc.date().strftime("%d%m%y")
+        self.verbose = verbose
+        self.log_format = log_format
+        self._transmitters = {}
+        self._holding = False
+        self.nmea_writer = None
+        self.custom_writer = None
+        if log_format not in ("text", "binary"):
+            raise ValueError(f"unknown log format: {log_format}")
+        if filepath is not None:
+            self.nmea_writer = writer(filepath, flush_every=flush_every, flush_interval=flush_interval)
+            if log_format == "binary":
+                create_binary_log(filepath+".tlog")
+                self.custom_writer = writer(filepath+".tlog", flush_every=flush_every,
+                                            flush_interval=flush_interval, mode='ab')
+            else:
+                self.custom_writer = writer(filepath+".custom", flush_every=flush_every,
+                                            flush_interval=flush_interval, verbose=verbose)
+        self.metrics = metrics
+        if metrics is not None:
+            self._register_metrics(metrics)
+
+    def _register_metrics(self, metrics):
+        self._m_updates = {attr_name: metrics.counter(f"telemetry.updates.{attr_name}") for attr_name in HANDLERS}
+        self._m_ignored = metrics.counter("telemetry.ignored")
+        self._m_update = metrics.histogram("telemetry.update_us")
+        self._m_lag = metrics.histogram("telemetry.lag_us")
+        self._m_sentences = metrics.counter("nmea.sentences")
+        self._m_send_errors = metrics.counter("nmea.send_errors")
+        self._m_send = metrics.histogram("nmea.send_us")
+        self._m_lines = {True: metrics.counter("log.nmea_lines"), False: metrics.counter("log.telemetry_lines")}
+        self._m_dropped = metrics.counter("log.dropped")
+        self._m_save = metrics.histogram("log.save_us")
+        for name, writer in (("nmea", self.nmea_writer), ("telemetry", self.custom_writer)):
+            if writer is not None:
+                for field in ("written", "dropped", "flushes"):
+                    metrics.gauge(f"log.{name}_writer.{field}", lambda w=writer, f=field: getattr(w, f))
 
     def __str__(self):
-        return f"{self.utc}, {self.utc_time}, {self.utc_date}, {self.global_frame.lat}, {self.global_frame.lon}, {self.global_frame.alt}, {self.attitude.yaw}, {self.attitude.roll}, {self.attitude.pitch}"
-
-    def update_attr(self, attr_name, value):
-        if attr_name not in ['location.global_frame', 'location.local_frame', 'attitude', 'groundspeed', "ekf_ok"]:
-            # print(f"{attr_name} update passed")
-            pass
-        elif attr_name == 'location.global_frame':
-            self.global_frame = value
-            self.save2file(is_nmea=False)
-            # print(f"{attr_name} update as {value}")
-        elif attr_name == 'location.local_frame':
-            self.local_frame = value
-            # print(f"{attr_name} update as {value}")
-        elif attr_name == 'attitude':
-            self.utc = datetime.datetime.utcnow()
-            self.utc_time = self.utc.time().strftime("%H%M%S")
-            self.utc_date = self.utc.date().strftime("%d%m%y")
-            self.attitude = value
-            self.save2file(is_nmea=False)
-            # print(f"{attr_name} update as {value}")
-        elif attr_name == 'groundspeed':
-            self.groundspeed = value
-            # print(f"{attr_name} update as {value}")
-        elif attr_name == 'ekf_ok':
-            self.ekf_ok = "A" if value else "V"
-            # print(f"{attr_name} update as {value}")
-
-    def gen_sentence(self):
-        lat_val, lat_sign =  decdeg2dms(self.global_frame.lat, "lat")
-        lon_val, lon_sign =  decdeg2dms(self.global_frame.lon, "lon")
-
-        nmea_str = f"GPRMC,{self.utc_time},{self.ekf_ok},{lat_val},{lat_sign},{lon_val},{lon_sign},{mps2knots(self.groundspeed):06.2f},{self.course_made_good:06.2f},{self.utc_date},{self.magnetic_variation:06.2f},E"
-
-        checksum = make_nmea_checksum(nmea_str)
-        nmea_str = "$" + nmea_str + "*" + str(checksum)
-
-        return nmea_str
+        return self.format_line(self.state.snapshot())
+
+    @staticmethod
+    def format_line(snap):
+        """
+        Telemetry log line (".custom" format) of a snapshot.
+        """
+        return f"{snap.utc}, {snap.utc:%H%M%S}, {snap.utc:%d%m%y}, {snap.lat}, {snap.lon}, {snap.alt}, {snap.yaw}, {snap.roll}, {snap.pitch}"
+
+    def attach(self, vehicle):
+        """
+        Subscribe to the vehicle attributes used to build the sentences.
+        """
+        # with metrics the updates go through update_attr to be timed
+        self.state.attach(vehicle, None if self.metrics is None else self._listener)
+
+    def _listener(self, vehicle, attr_name, value):
+        self.update_attr(attr_name, value)
+
+    def update_attr(self, attr_name, value, mono=None):
+        """
+        Apply an attribute value received at monotonic time `mono` (now if None).
+        """
+        if self.metrics is None:
+            self.state.update(attr_name, value, mono)
+            return
+        start = time.perf_counter()
+        if self.state.update(attr_name, value, mono):
+            self._m_updates[attr_name].inc()
+        else:
+            self._m_ignored.inc()
+        self._m_update.observe(time.perf_counter() - start)
+        if mono is not None:
+            # time the update waited before being applied (see acquisition_async.py)
+            self._m_lag.observe(time.monotonic() - mono)
+
+    def _on_update(self, attr_name):
+        snap = self.state.snapshot()
+        # wall clock of the update, which may have been applied later (see acquisition_async.py)
+        self.history.append_snapshot(snap, utc=time.time() - (time.monotonic() - snap.mono))
+        if attr_name in self.SAVE_ON:
+            self.save2file(is_nmea=False, snap=snap)
+
+    def snapshot(self, at=None, utc=None):
+        """
+        Current telemetry, or the telemetry interpolated at monotonic time `at`.
+        `utc` (epoch s) replaces its time stamp, e.g. with the second marked by a PPS.
+        """
+        snap = None if at is None else self.history.at(at)
+        if snap is None:
+            snap = self.state.snapshot()
+        if utc is not None:
+            snap.utc = EPOCH + datetime.timedelta(seconds=utc)
+        return snap
+
+    def gen_sentence(self, snap=None):
+        snap = snap or self.state.snapshot()
+        lat_val, lat_sign =  decdeg2dms(snap.lat, "lat")
+        lon_val, lon_sign =  decdeg2dms(snap.lon, "lon")
+        status = "A" if snap.ekf_ok else "V" # A: OK, V: warning
+        # acquisition starts before the first VFR_HUD, groundspeed is None until then
+        groundspeed = 0. if snap.groundspeed is None else snap.groundspeed
+
+        nmea_str = f"GPRMC,{snap.utc:%H%M%S},{status},{lat_val},{lat_sign},{lon_val},{lon_sign},{mps2knots(groundspeed):06.2f},{self.course_made_good:06.2f},{snap.utc:%d%m%y},{self.magnetic_variation:06.2f},E"
+
+        return nmea_wrap(nmea_str)
+
+    def gen_gga(self, snap=None):
+        """
+        GPGGA sentence (fix data): time, position, fix quality (1 if the EKF is
+        OK), satellites in use and altitude above mean sea level.
+        """
+        snap = snap or self.state.snapshot()
+        lat_val, lat_sign =  decdeg2dms(snap.lat, "lat")
+        lon_val, lon_sign =  decdeg2dms(snap.lon, "lon")
+        quality = 1 if snap.ekf_ok else 0
+        satellites = "" if snap.satellites is None else f"{snap.satellites:02d}"
+        alt = "" if snap.alt is None else f"{snap.alt:.1f}"
+
+        nmea_str = f"GPGGA,{snap.utc:%H%M%S}.{snap.utc.microsecond // 10000:02d},{lat_val},{lat_sign},{lon_val},{lon_sign},{quality},{satellites},,{alt},M,,M,,"
+        return nmea_wrap(nmea_str)
+
+    def gen_zda(self, snap=None):
+        """
+        GPZDA sentence (UTC time and date).
+        """
+        utc = (snap or self.state.snapshot()).utc
+        nmea_str = f"GPZDA,{utc:%H%M%S}.{utc.microsecond // 10000:02d},{utc:%d},{utc:%m},{utc:%Y},00,00"
+        return nmea_wrap(nmea_str)
+
+    def gen_sentences(self, types=("GPRMC",), at=None, utc=None):
+        """
+        Generate one sentence of every given type ("GPRMC", "GPGGA", "GPZDA"),
+        all from the same telemetry snapshot (see snapshot()). None are
+        generated (empty list) until the vehicle reports a position.
+        """
+        generators = {"GPRMC": self.gen_sentence, "GPGGA": self.gen_gga, "GPZDA": self.gen_zda}
+        snap = self.snapshot(at, utc)
+        if snap.lat is None or snap.lon is None:
+            # e.g. started on --ready_timeout without a fix: hold the sentences
+            if not self._holding:
+                print("[NMEA] no position yet, sentences held")
+            self._holding = True
+            return []
+        self._holding = False
+        return [generators[t](snap) for t in types]
+
+    def send_sentences(self, transmitter, types=("GPRMC",), save=False, at=None, utc=None):
+        """
+        Send one sentence of every given type to every destination of an
+        NmeaTransmitter, built from the telemetry at monotonic time `at`
+        (e.g. the PPS edge) or the latest telemetry if None, stamped with
+        `utc` (epoch s) if given.
+
+        Returns:
+        --------
+        nmea_sents: list
+            NMEA formated sentences (none without a position, see gen_sentences).
+        """
+        start = time.perf_counter()
+        nmea_sents = self.gen_sentences(types, at, utc)
+        if not nmea_sents:
+            return nmea_sents
+        sent = transmitter.send(nmea_sents)
+        if self.metrics is not None:
+            self._m_send.observe(time.perf_counter() - start)
+            self._m_sentences.inc(len(nmea_sents))
+            failed = len(nmea_sents) * len(transmitter.destinations) - sent
+            if failed:
+                self._m_send_errors.inc(failed)
+        if save:
+            for nmea_sent in nmea_sents:
+                self.save2file(is_nmea=True, nmea_sent=nmea_sent)
+        return nmea_sents
 
     def send_sentence(self, udp_ip, udp_port, save=False):
         """
@@ -178,22 +345,74 @@ class DataGenerator:
         Returns:
         --------
         nmea_sent: str
-            NMEA formated sentence.
+            NMEA formated sentence, None if there is no position yet.
         """
-        nmea_sent = self.gen_sentence()
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) #UDP
-        sock.sendto(bytes(nmea_sent, "utf-8"), (udp_ip, udp_port))
-        if save:
-            self.save2file(is_nmea=True, nmea_sent=nmea_sent)
-        return nmea_sent
+        destination = (udp_ip, udp_port)
+        if destination not in self._transmitters:
+            # one long-lived socket per destination instead of one per call
+            self._transmitters[destination] = NmeaTransmitter([destination])
+        nmea_sents = self.send_sentences(self._transmitters[destination], save=save)
+        return nmea_sents[0] if nmea_sents else None
+
+    def save2file(self, is_nmea, nmea_sent=None, snap=None):
+        """
+        Queue the NMEA sentence (is_nmea=True) or the telemetry line of `snap`
+        (current telemetry if None, is_nmea=False) to be written by the
+        background writers.
+        """
+        if self.metrics is None:
+            self._save2file(is_nmea, nmea_sent, snap)
+            return
+        start = time.perf_counter()
+        queued = self._save2file(is_nmea, nmea_sent, snap)
+        self._m_save.observe(time.perf_counter() - start)
+        if queued is not None:
+            self._m_lines[bool(is_nmea)].inc()
+            if not queued:
+                self._m_dropped.inc()
 
-    def save2file(self, is_nmea, nmea_sent=None):
+    def _save2file(self, is_nmea, nmea_sent, snap):
+        """
+        Returns:
+        --------
+        queued: bool
+            Result of the writer's write(), None if there is no log file.
+        """
         if is_nmea:
+            if self.nmea_writer is None:
+                return None
             if nmea_sent == None:
                 nmea_sent = self.gen_sentence()
-            with open(self.filepath, 'a') as f:
-                f.write(nmea_sent+"\n")
-        else:
-            with open(self.filepath+".custom", 'a') as f:
-                f.write(self.__str__()+"\n")
-                print(self.__str__())
+            return self.nmea_writer.write(nmea_sent)
+        if self.custom_writer is None:
+            return None
+        snap = snap or self.state.snapshot()
+        if self.log_format == "binary":
+            queued = self.custom_writer.write(self.pack(snap))
+            if self.verbose:
+                print(self.format_line(snap))
+            return queued
+        return self.custom_writer.write(self.format_line(snap))
+
+    def pack(self, snap=None):
+        """
+        Telemetry snapshot (current one if None) as a binary log record (see
+        telemetry_log.pack_record).
+        """
+        snap = snap or self.state.snapshot()
+        return pack_record(snap.mono, (snap.utc - EPOCH).total_seconds(),
+                           snap.lat, snap.lon, snap.alt, snap.yaw, snap.roll, snap.pitch,
+                           snap.groundspeed, snap.ekf_ok)
+
+    def close(self):
+        """
+        Stop listening to the vehicle, flush and close the log files and the
+        sockets opened by send_sentence.
+        """
+        self.state.detach()
+        for writer in (self.nmea_writer, self.custom_writer):
+            if writer is not None:
+                writer.close()
+        for transmitter in self._transmitters.values():
+            transmitter.close()
+        self._transmitters.clear()
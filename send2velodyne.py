@@ -1,23 +1,13 @@
 import argparse
-import time
-import RPi.GPIO as GPIO
-from datetime import timedelta
-from dronekit import connect
+from fast_connect import StartupTimer, add_connect_arguments, connect_vehicle
+from metrics import MetricsReporter, MetricsRegistry
+from nmea_transmitter import NmeaTransmitter
+from pps_scheduler import PPSScheduler, RPiGPIO, SimulatedGPIO
 from rpi_gps_datagen import DataGenerator
-from timeloop import Timeloop
-
-def PPS(pin, pulse_duration):
-    """
-    Send pulse per second via a rpi gpio pin to Velodyne LiDAR.
-    """
-    GPIO.setmode(GPIO.BOARD)
-    GPIO.setup(pin, GPIO.OUT)
-    GPIO.output(pin, 1)
-    time.sleep(pulse_duration)
-    GPIO.output(pin, 0)
-    GPIO.cleanup()
 
 if __name__ == "__main__":
+    # time to the first valid NMEA sentence (see fast_connect.py)
+    startup = StartupTimer()
     parser = argparse.ArgumentParser(description='Send NMEA Sentence and PPS to Velodyne LiDAR')
     parser.add_argument('--connect',
                         help="Vehicle connection target string.")
@@ -25,41 +15,100 @@ if __name__ == "__main__":
                         help="IP Port string to send dato to LiDAR")
     parser.add_argument('--filepath',
                         help="Filepath string to save nmea sentences and imu data in txt.")
+    parser.add_argument('--verbose', action='store_true',
+                        help="Print every telemetry line saved.")
+    parser.add_argument('--log_format', choices=["text", "binary"], default="text",
+                        help="Telemetry log format: text (.custom) or binary (.tlog).")
+    parser.add_argument('--nmea_dest', action='append', default=[],
+                        help="Extra ip:port to send NMEA sentences to (e.g. a ground logger). Can be repeated.")
+    parser.add_argument('--sentences', default="GPRMC",
+                        help="Comma separated NMEA sentences to send every second (GPRMC, GPGGA, GPZDA).")
+    parser.add_argument('--pps_pin', type=int, default=12,
+                        help="Board pin of the PPS output.")
+    parser.add_argument('--nmea_offset', type=float, default=0.05,
+                        help="Seconds between the PPS rising edge and the NMEA sentence.")
+    parser.add_argument('--simulate_gpio', action='store_true',
+                        help="Do not drive the PPS pin (timing test without a Raspberry Pi).")
+    parser.add_argument('--simulate', action='store_true',
+                        help="Use a simulated vehicle (see sim_vehicle.py) and GPIO instead of --connect.")
+    parser.add_argument('--sim_log',
+                        help="Flight log (.custom, .tlog or NMEA) replayed by the simulated vehicle. A circle if not given.")
+    parser.add_argument('--sim_speed', type=float, default=1.,
+                        help="Speed multiplier of the simulated vehicle.")
+    parser.add_argument('--metrics',
+                        help="File the runtime metrics are written to every --metrics_interval s (.csv: appended, else JSON).")
+    parser.add_argument('--metrics_socket',
+                        help="UNIX socket answering metrics queries (python3 metrics.py --socket <path>).")
+    parser.add_argument('--metrics_interval', type=float, default=10.,
+                        help="Seconds between two metrics snapshots written to --metrics.")
+    add_connect_arguments(parser)
     args = parser.parse_args()
 
     UDP_IP = args.lidar_port
     CONNECTION_STRING = args.connect
     SAVE_FILEPATH = args.filepath
+    SENTENCES = args.sentences.split(",")
+
+    transmitter = NmeaTransmitter([(UDP_IP, 10110)])
+    for dest in args.nmea_dest:
+        ip, port = dest.rsplit(":", 1)
+        transmitter.add_destination(ip, int(port))
+
+    # counters and latency histograms of telemetry, NMEA, PPS and logs (see metrics.py)
+    metrics = reporter = None
+    if args.metrics or args.metrics_socket:
+        metrics = MetricsRegistry()
+        metrics.gauge("nmea.destinations", transmitter.stats)
+        startup.register(metrics)
+        reporter = MetricsReporter(metrics, args.metrics, args.metrics_interval, args.metrics_socket).start()
 
-    print("Connecting to vehicle on {}".format(CONNECTION_STRING))
-    vehicle = connect(CONNECTION_STRING, wait_ready=True)
+    if args.simulate:
+        from sim_vehicle import CircleTrajectory, LogTrajectory, SimulatedVehicle
+        trajectory = LogTrajectory.from_file(args.sim_log) if args.sim_log else CircleTrajectory()
+        vehicle = SimulatedVehicle(trajectory)
+    else:
+        print("Connecting to vehicle on {}".format(CONNECTION_STRING))
+        # only waits for attitude and position, parameters come from the cache
+        vehicle, _ = connect_vehicle(args, startup)
 
     datagen = DataGenerator(vehicle.location.global_frame,
                             vehicle.location.local_frame,
                             vehicle.attitude, vehicle.groundspeed,
-                            vehicle.ekf_ok, SAVE_FILEPATH)
+                            vehicle.ekf_ok, SAVE_FILEPATH, verbose=args.verbose,
+                            log_format=args.log_format, metrics=metrics)
 
+    # Listen only to the attributes used in the NMEA sentences and logs
+    datagen.attach(vehicle)
 
-    def wildcard_callback(self, attr_name, value):
+    def send_nmea(edge, second):
         """
-        Callback on any vehicle attribute change.
+        Send the sentences of the UTC second marked by the pulse, with the
+        position at the pulse interpolated from the telemetry history.
         """
-        datagen.update_attr(attr_name, value)
-
-    # Add attribute listener detecting any ('*') attribute change
-    vehicle.add_attribute_listener('*', wildcard_callback)
-
-    # Use timeloop module to schedule repetitive tasks
-    t1 = Timeloop()
+        startup.nmea_sent(datagen.send_sentences(transmitter, SENTENCES, save=True, at=edge, utc=second))
 
-    @t1.job(interval=timedelta(seconds=1))
-    def send_data_every_1s():
-        datagen.send_sentence(udp_ip=UDP_IP, udp_port=10110, save=True)
-        print("send data job")
+    # PPS on the top of every UTC second, NMEA a fixed offset after it
+    simulate_gpio = args.simulate_gpio or args.simulate
+    gpio = SimulatedGPIO(args.pps_pin) if simulate_gpio else RPiGPIO(args.pps_pin)
+    scheduler = PPSScheduler(gpio, on_edge=send_nmea, pulse_duration=0.01, nmea_offset=args.nmea_offset,
+                             metrics=metrics)
 
-    @t1.job(interval=timedelta(seconds=1))
-    def send_pps_every_1s():
-        PPS(pin=12, pulse_duration=0.01)
-        print("send pps job")
+    if args.simulate:
+        vehicle.start(speed=args.sim_speed)
+        # stop at the end of a replayed log
+        vehicle.on_finished(scheduler.stop)
 
-    t1.start(block=True)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scheduler.close()
+        datagen.close()
+        vehicle.close()
+        if reporter is not None:
+            reporter.close()
+        print(startup.summary())
+        print(scheduler.stats.summary())
+        print(transmitter.stats())
+        transmitter.close()
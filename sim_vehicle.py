@@ -0,0 +1,505 @@
+"""
+Lightweight stand-in for a dronekit Vehicle.
+
+Exposes the attributes used by DataGenerator (location.global_frame,
+location.local_frame, attitude, groundspeed, ekf_ok, gps_0) and calls the
+attribute listeners from a background thread, as dronekit does, so the
+acquisition code can run without a Pixhawk or dronekit_sitl. The vehicle
+follows a synthetic trajectory or replays a recorded flight (".custom",
+".tlog" or NMEA log), in real time, at any speed multiplier or as fast as
+possible.
+
+Usage:
+------
+    vehicle = SimulatedVehicle(LogTrajectory.from_file("flight.tlog"))
+    datagen.attach(vehicle)
+    vehicle.start(speed=20)         # or vehicle.run() to replay the whole flight at once
+    ...
+    vehicle.close()
+
+$ python3 sim_vehicle.py --log <filepath>.tlog [--filepath <out>]     # DataGenerator throughput
+"""
+import argparse
+import math
+import threading
+import time
+
+import numpy as np
+
+EARTH_RADIUS = 6378137.0
+
+
+class LocationGlobal:
+    __slots__ = ("lat", "lon", "alt")
+
+    def __init__(self, lat, lon, alt=None):
+        self.lat, self.lon, self.alt = lat, lon, alt
+
+    def __str__(self):
+        return f"LocationGlobal:lat={self.lat},lon={self.lon},alt={self.alt}"
+
+
+class LocationLocal:
+    __slots__ = ("north", "east", "down")
+
+    def __init__(self, north, east, down):
+        self.north, self.east, self.down = north, east, down
+
+    def __str__(self):
+        return f"LocationLocal:north={self.north},east={self.east},down={self.down}"
+
+
+class Attitude:
+    __slots__ = ("pitch", "yaw", "roll")
+
+    def __init__(self, pitch, yaw, roll):
+        self.pitch, self.yaw, self.roll = pitch, yaw, roll
+
+    def __str__(self):
+        return f"Attitude:pitch={self.pitch},yaw={self.yaw},roll={self.roll}"
+
+
+class GPSInfo:
+    __slots__ = ("eph", "epv", "fix_type", "satellites_visible")
+
+    def __init__(self, eph, epv, fix_type, satellites_visible):
+        self.eph, self.epv, self.fix_type, self.satellites_visible = eph, epv, fix_type, satellites_visible
+
+    def __str__(self):
+        return f"GPSInfo:fix={self.fix_type},num_sat={self.satellites_visible}"
+
+
+class _Location:
+    __slots__ = ("global_frame", "local_frame")
+
+    def __init__(self):
+        self.global_frame = None
+        self.local_frame = None
+
+
+class CircleTrajectory:
+    """
+    Constant speed circle around (lat, lon) at a fixed altitude.
+
+    Parameters:
+    -----------
+    lat, lon, alt: float
+        Center (decimal degrees) and altitude (m).
+    radius: float
+        Meters.
+    speed: float
+        m/s.
+    """
+
+    def __init__(self, lat=-12.0696, lon=-77.0796, alt=60., radius=50., speed=5.):
+        self.lat, self.lon, self.alt = lat, lon, alt
+        self.radius = radius
+        self.speed = speed
+
+    def __call__(self, t):
+        """
+        State at t seconds: lat, lon, alt, north, east, down, yaw, roll, pitch, groundspeed.
+        """
+        angle = self.speed * t / self.radius
+        north = self.radius * math.sin(angle)
+        east = self.radius * (1 - math.cos(angle))
+        lat = self.lat + math.degrees(north / EARTH_RADIUS)
+        lon = self.lon + math.degrees(east / (EARTH_RADIUS * math.cos(math.radians(self.lat))))
+        yaw = math.remainder(angle, 2 * math.pi)
+        roll = math.atan2(self.speed ** 2 / self.radius, 9.81)
+        return lat, lon, self.alt, north, east, -self.alt, yaw, roll, 0., self.speed
+
+
+class WaypointTrajectory:
+    """
+    Straight legs between waypoints, e.g. a survey_planner.py mission. With
+    `accel` the vehicle brakes to a stop at every waypoint and accelerates
+    again (a copter in AUTO slows down to its waypoints), never faster than
+    `speed` on short legs, and with `yaw_rate` it turns to the next leg on the
+    spot before leaving; `turn_time` seconds are added to every stop.
+
+    Parameters:
+    -----------
+    lat, lon: array_like
+        Waypoints (decimal degrees), at least two.
+    alt: float
+        Meters.
+    speed: float
+        m/s.
+    turn_time: float
+        Seconds.
+    accel: float
+        m/s^2, None for instant speed changes.
+    yaw_rate: float
+        deg/s, None for instant turns.
+    """
+
+    def __init__(self, lat, lon, alt=60., speed=5., turn_time=0., accel=None, yaw_rate=None):
+        lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        if len(lat) < 2:
+            raise ValueError("at least two waypoints are needed")
+        if speed <= 0:
+            raise ValueError("speed must be positive")
+        if accel is not None and accel <= 0 or yaw_rate is not None and yaw_rate <= 0:
+            raise ValueError("accel and yaw_rate must be positive")
+        self.lat, self.lon, self.alt = float(lat[0]), float(lon[0]), alt
+        self.speed = speed
+        self.accel = accel
+        north = np.radians(lat - lat[0]) * EARTH_RADIUS
+        east = np.radians(lon - lon[0]) * EARTH_RADIUS * math.cos(math.radians(lat[0]))
+        legs = np.hypot(np.diff(north), np.diff(east))
+        self._yaw = np.arctan2(np.diff(east), np.diff(north))
+        # top speed of every leg: a short one ends before `speed` is reached
+        self._top = np.full(len(legs), float(speed)) if accel is None else np.minimum(speed, np.sqrt(legs * accel))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self._leg_time = np.where(legs > 0, legs / self._top, 0.)
+        if accel is not None:
+            self._leg_time += self._top / accel
+        stops = np.full(len(lat) - 2, float(turn_time))
+        if yaw_rate is not None:
+            turns = np.abs((np.diff(self._yaw) + math.pi) % (2 * math.pi) - math.pi)
+            stops += np.degrees(turns) / yaw_rate
+        self._arrive = np.concatenate([[0.], np.cumsum(self._leg_time + np.concatenate([[0.], stops]))])
+        self._depart = np.concatenate([[0.], self._arrive[1:-1] + stops])
+        self.duration = float(self._arrive[-1])
+        self._north, self._east, self._legs = north, east, legs
+
+    def _along(self, leg, t):
+        """
+        Distance flown (m) and speed (m/s) t seconds after leaving a waypoint.
+        """
+        top, duration = self._top[leg], self._leg_time[leg]
+        if self.accel is None:
+            return top * t, top
+        ramp = top / self.accel
+        if t < ramp:
+            return 0.5 * self.accel * t * t, self.accel * t
+        if t > duration - ramp:
+            left = duration - t
+            return self._legs[leg] - 0.5 * self.accel * left * left, self.accel * left
+        return top * (t - 0.5 * ramp), top
+
+    def __call__(self, t):
+        t = min(max(t, 0.), self.duration)
+        leg = min(max(int(np.searchsorted(self._depart, t, side="right")) - 1, 0), len(self._yaw) - 1)
+        elapsed = t - self._depart[leg]
+        if elapsed < self._leg_time[leg]:
+            along, speed = self._along(leg, elapsed)
+            fraction = along / self._legs[leg]
+        else:
+            fraction, speed = 1., 0.
+        north = float(self._north[leg] + fraction * (self._north[leg + 1] - self._north[leg]))
+        east = float(self._east[leg] + fraction * (self._east[leg + 1] - self._east[leg]))
+        lat = self.lat + math.degrees(north / EARTH_RADIUS)
+        lon = self.lon + math.degrees(east / (EARTH_RADIUS * math.cos(math.radians(self.lat))))
+        return lat, lon, self.alt, north, east, -self.alt, float(self._yaw[leg]), 0., 0., float(speed)
+
+
+class LogTrajectory:
+    """
+    Trajectory of a recorded flight, interpolated between samples (yaw on the
+    unwrapped angle).
+
+    Parameters:
+    -----------
+    utc, lat, lon, alt, yaw, roll, pitch: np.ndarray
+        Samples sorted by utc (epoch s), angles in radians. NaN samples are dropped.
+    groundspeed: np.ndarray
+        m/s. Computed from the positions if None or all NaN.
+    """
+
+    def __init__(self, utc, lat, lon, alt=None, yaw=None, roll=None, pitch=None, groundspeed=None):
+        n = len(utc)
+        zeros = np.zeros(n)
+        columns = [np.asarray(c, dtype=np.float64) if c is not None else zeros
+                   for c in (utc, lat, lon, alt, yaw, roll, pitch)]
+        valid = np.all([np.isfinite(c) for c in columns[:3]], axis=0)
+        utc, lat, lon, alt, yaw, roll, pitch = [np.nan_to_num(c[valid]) for c in columns]
+        if len(utc) == 0:
+            raise ValueError("no valid samples in the trajectory")
+        # distances between samples (equirectangular)
+        north = np.radians(lat - lat[0]) * EARTH_RADIUS
+        east = np.radians(lon - lon[0]) * EARTH_RADIUS * math.cos(math.radians(lat[0]))
+        if groundspeed is None or not np.isfinite(np.asarray(groundspeed, dtype=np.float64)[valid]).any():
+            dt = np.diff(utc)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                step = np.where(dt > 0, np.hypot(np.diff(north), np.diff(east)) / dt, 0.)
+            groundspeed = np.concatenate([step[:1], step]) if len(utc) > 1 else np.zeros(len(utc))
+        else:
+            groundspeed = np.nan_to_num(np.asarray(groundspeed, dtype=np.float64)[valid])
+        self.start = utc[0]
+        self.duration = utc[-1] - utc[0]
+        self._t = utc - utc[0]
+        self._columns = [lat, lon, alt, north, east, -alt, np.unwrap(yaw), roll, pitch, groundspeed]
+
+    @classmethod
+    def from_telemetry(cls, telemetry):
+        """
+        From a telemetry_log array (".custom" or ".tlog").
+        """
+        names = telemetry.dtype.names
+        return cls(telemetry['utc'], telemetry['lat'], telemetry['lon'], telemetry['alt'],
+                   telemetry['yaw'], telemetry['roll'], telemetry['pitch'],
+                   telemetry['groundspeed'] if 'groundspeed' in names else None)
+
+    @classmethod
+    def from_nmea(cls, filepath):
+        """
+        From the GPRMC sentences of an NMEA log (as saved by DataGenerator).
+        Course is used as yaw, altitude is unknown (0).
+        """
+        from nmea_batch import parse_gprmc
+        rows = []
+        with open(filepath, 'rb') as f:
+            for line in f:
+                if line.startswith(b"$GPRMC"):
+                    try:
+                        fields = parse_gprmc(line)
+                    except ValueError:
+                        continue
+                    rows.append((fields["utc"], fields["lat"], fields["lon"],
+                                 math.radians(fields["course"]), fields["speed"] / 1.944))
+        if not rows:
+            raise ValueError(f"{filepath}: no GPRMC sentences")
+        utc, lat, lon, yaw, speed = np.array(sorted(rows)).T
+        return cls(utc, lat, lon, yaw=yaw, groundspeed=speed)
+
+    @classmethod
+    def from_file(cls, filepath):
+        """
+        From a telemetry log (".custom", ".tlog") or an NMEA log.
+        """
+        with open(filepath, 'rb') as f:
+            first = f.read(1)
+        if first == b"$":
+            return cls.from_nmea(filepath)
+        from telemetry_log import load_telemetry
+        return cls.from_telemetry(load_telemetry(filepath))
+
+    def __call__(self, t):
+        t = min(max(t, 0.), self.duration)
+        values = [float(np.interp(t, self._t, column)) for column in self._columns]
+        values[6] = math.remainder(values[6], 2 * math.pi)
+        return tuple(values)
+
+
+class SimulatedVehicle:
+    """
+    Vehicle whose attributes follow a trajectory and are reported to the
+    attribute listeners from a background thread.
+
+    Parameters:
+    -----------
+    trajectory: callable
+        Returns (lat, lon, alt, north, east, down, yaw, roll, pitch, groundspeed)
+        for a time in seconds. CircleTrajectory() if None. A trajectory with a
+        `duration` attribute (LogTrajectory) ends the simulation after it.
+    rates: dict
+        Updates per second of every attribute (attitude 10 Hz, positions 4 Hz
+        and groundspeed, ekf_ok, gps_0 1 Hz by default).
+    extra_rate: float
+        Updates per second of attributes no acquisition code uses (battery,
+        heartbeat...), reported to '*' listeners only.
+    """
+
+    DEFAULT_RATES = {'attitude': 10., 'location.global_frame': 4., 'location.local_frame': 4.,
+                     'groundspeed': 1., 'ekf_ok': 1., 'gps_0': 1.}
+    EXTRA_ATTRIBUTES = ('last_heartbeat', 'battery', 'velocity', 'heading', 'system_status')
+
+    def __init__(self, trajectory=None, rates=None, extra_rate=0.):
+        self.trajectory = trajectory or CircleTrajectory()
+        self.rates = dict(self.DEFAULT_RATES if rates is None else rates)
+        self.extra_rate = extra_rate
+        self.location = _Location()
+        self.attitude = None
+        self.groundspeed = None
+        self.ekf_ok = True
+        self.gps_0 = GPSInfo(121, 65535, 3, 10)
+        self.notifications = 0
+        self.duration = getattr(self.trajectory, "duration", None)
+        self.finished = threading.Event()
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.t = 0.
+        self._set_state(0.)
+
+    # dronekit listener API
+    def add_attribute_listener(self, attr_name, observer):
+        with self._lock:
+            observers = self._listeners.setdefault(attr_name, [])
+            if observer not in observers:
+                observers.append(observer)
+
+    def remove_attribute_listener(self, attr_name, observer):
+        with self._lock:
+            observers = self._listeners.get(attr_name, [])
+            if observer in observers:
+                observers.remove(observer)
+
+    def notify_attribute_listeners(self, attr_name, value):
+        with self._lock:
+            observers = self._listeners.get(attr_name, []) + self._listeners.get('*', [])
+        for observer in observers:
+            observer(self, attr_name, value)
+        self.notifications += len(observers)
+
+    def _set_state(self, t):
+        lat, lon, alt, north, east, down, yaw, roll, pitch, groundspeed = self.trajectory(t)
+        self.t = t
+        self.location.global_frame = LocationGlobal(lat, lon, alt)
+        self.location.local_frame = LocationLocal(north, east, down)
+        self.attitude = Attitude(pitch, yaw, roll)
+        self.groundspeed = groundspeed
+
+    def _value(self, attr_name):
+        if attr_name == 'location.global_frame':
+            return self.location.global_frame
+        if attr_name == 'location.local_frame':
+            return self.location.local_frame
+        return getattr(self, attr_name, None)
+
+    def step(self, t):
+        """
+        Move to time t (s) and report every attribute due in (previous t, t].
+        """
+        previous = self.t
+        self._set_state(t)
+        for attr_name, rate in self.rates.items():
+            if rate > 0:
+                # one notification per update due, as dronekit does per message
+                for i in range(math.floor(t * rate) - math.floor(previous * rate)):
+                    self.notify_attribute_listeners(attr_name, self._value(attr_name))
+        if self.extra_rate > 0:
+            due = math.floor(t * self.extra_rate) - math.floor(previous * self.extra_rate)
+            for i in range(due):
+                attr_name = self.EXTRA_ATTRIBUTES[i % len(self.EXTRA_ATTRIBUTES)]
+                self.notify_attribute_listeners(attr_name, t)
+
+    def _tick(self):
+        """
+        Seconds between two steps: the shortest update period.
+        """
+        rates = [rate for rate in self.rates.values() if rate > 0] + [self.extra_rate]
+        return 1. / max(rates) if max(rates) > 0 else 1.
+
+    def _run(self, speed):
+        start = time.monotonic()
+        tick = self._tick() / speed
+        n = 0
+        while not self._stop.is_set():
+            n += 1
+            wait = start + n * tick - time.monotonic()
+            if wait > 0 and self._stop.wait(wait):
+                break
+            t = (time.monotonic() - start) * speed
+            if self.duration is not None and t >= self.duration:
+                self.step(self.duration)
+                break
+            self.step(t)
+        self.finished.set()
+
+    def start(self, speed=1.):
+        """
+        Report attribute updates from a background thread, `speed` times faster
+        than real time. `finished` is set at the end of the trajectory.
+        """
+        if speed <= 0:
+            raise ValueError('speed must be positive')
+        self._stop.clear()
+        self.finished.clear()
+        self._thread = threading.Thread(target=self._run, args=(speed,), name="SimulatedVehicle", daemon=True)
+        self._thread.start()
+        return self
+
+    def on_finished(self, callback):
+        """
+        Call `callback()` from a daemon thread when the trajectory ends (or close() is called).
+        """
+        def wait():
+            self.finished.wait()
+            callback()
+        threading.Thread(target=wait, name="SimulatedVehicle.on_finished", daemon=True).start()
+
+    def run(self, duration=None, on_step=None):
+        """
+        Replay `duration` seconds (the whole trajectory if None) in the calling
+        thread as fast as possible, one step per shortest update period.
+
+        Parameters:
+        -----------
+        on_step: callable
+            Called with the simulated time after every step (e.g. to send the
+            sentences every simulated second).
+
+        Listeners stamp the updates with the real clocks, so logs written
+        during an accelerated replay carry the time of the replay.
+
+        Returns:
+        --------
+        notifications: int
+            Listener calls made.
+        """
+        duration = self.duration if duration is None else duration
+        if duration is None:
+            raise ValueError('duration is required for an endless trajectory')
+        tick = self._tick()
+        before = self.notifications
+        for n in range(1, int(math.ceil(duration / tick)) + 1):
+            t = min(n * tick, duration)
+            self.step(t)
+            if on_step is not None:
+                on_step(t)
+        self.finished.set()
+        return self.notifications - before
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a flight through DataGenerator as fast as possible')
+    parser.add_argument('--log', help="Telemetry (.custom, .tlog) or NMEA log to replay. A circle if not given.")
+    parser.add_argument('--duration', type=float, help="Simulated seconds (default: the whole log, 3600 for the circle).")
+    parser.add_argument('--filepath', help="Save the NMEA sentences and telemetry of the replay here.")
+    parser.add_argument('--log_format', choices=["text", "binary"], default="text")
+    parser.add_argument('--attitude_rate', type=float, default=10.)
+    parser.add_argument('--position_rate', type=float, default=4.)
+    args = parser.parse_args()
+
+    from rpi_gps_datagen import DataGenerator
+
+    trajectory = LogTrajectory.from_file(args.log) if args.log else CircleTrajectory()
+    rates = dict(SimulatedVehicle.DEFAULT_RATES, attitude=args.attitude_rate)
+    rates['location.global_frame'] = rates['location.local_frame'] = args.position_rate
+    vehicle = SimulatedVehicle(trajectory, rates=rates)
+    duration = args.duration
+    if duration is None:
+        duration = 3600. if vehicle.duration is None else vehicle.duration
+    datagen = DataGenerator(vehicle.location.global_frame, vehicle.location.local_frame, vehicle.attitude,
+                            vehicle.groundspeed, vehicle.ekf_ok, args.filepath, log_format=args.log_format,
+                            flush_every=10000)
+    datagen.attach(vehicle)
+    sentences = []
+    last_second = 0
+
+    def every_second(t):
+        global last_second
+        if int(t) > last_second:
+            last_second = int(t)
+            sentences.append(datagen.gen_sentence())
+            datagen.save2file(is_nmea=True, nmea_sent=sentences[-1])
+
+    t0 = time.perf_counter()
+    notifications = vehicle.run(duration, on_step=every_second)
+    elapsed = time.perf_counter() - t0
+    datagen.close()
+    print(f"{duration:.0f} s of flight in {elapsed:.2f} s ({duration / elapsed:.0f}x): "
+          f"{notifications} updates ({notifications / elapsed:.0f}/s), {len(sentences)} sentences")
+    dropped = sum(w.dropped for w in (datagen.nmea_writer, datagen.custom_writer) if w is not None)
+    if dropped:
+        print(f"{dropped} log lines dropped (writer queue full)")
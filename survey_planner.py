@@ -0,0 +1,616 @@
+"""
+Survey planner: lawnmower (boustrophedon) LiDAR survey missions over a polygon.
+
+The survey lines run along the direction that needs the fewest of them (the
+narrowest width of the polygon), spaced by the swath width minus the overlap,
+and every line spans the whole band of the polygon its swath sees.  The
+geometry is vectorized with NumPy on a local tangent plane around the
+polygon (WGS84 radii of curvature, as in georeference.py), accurate to
+centimeters over a few kilometers.
+
+The plan is uploaded as one mission (takeoff, speed, survey waypoints, RTL)
+through vehicle.commands and flown in AUTO mode: the autopilot goes to the
+next waypoint as soon as it reaches one, and progress is followed from the
+current mission item and the distance to it.  Flight time, batteries and
+hectares per battery are estimated before the flight, and the plan can be
+flown offline by a simulated vehicle (sim_vehicle.py) or dronekit_sitl to
+check the coverage and the estimate.
+
+The polygon is a text file with one "lat, lon" vertex per line or an inline
+"lat,lon;lat,lon;..." list (given as --polygon=<list>, argparse takes a
+value starting with a minus sign for an option otherwise).
+
+Usage:
+------
+$ python3 survey_planner.py --polygon area.txt --alt 60 --swath 80 --overlap 0.2 --speed 6    # plan and estimate
+$ python3 survey_planner.py --polygon area.txt --swath 80 --simulate                          # fly the plan offline
+$ python3 survey_planner.py --polygon area.txt --swath 80 --sitl                              # fly it on dronekit_sitl
+$ python3 survey_planner.py --polygon area.txt --swath 80 --connect /dev/ttyACM0 [--fly]       # upload (and fly)
+$ python3 survey_planner.py --polygon="-12.069,-77.081;-12.069,-77.077;-12.072,-77.077" --swath 80
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from georeference import EARTH_A, EARTH_E2
+
+# mission items uploaded before the survey waypoints: takeoff and speed
+# (dronekit numbers them from 1, item 0 is home)
+FIRST_WAYPOINT_SEQ = 3
+# seconds a copter spends slowing down, turning and speeding up at a waypoint
+DEFAULT_TURN_TIME = 4.
+# vehicle flown by simulate(): ArduCopter defaults of WPNAV_ACCEL (m/s^2) and ATC_SLEW_YAW (deg/s)
+SIM_ACCEL = 2.5
+SIM_YAW_RATE = 60.
+# polygon cells checked by SurveyPlan.coverage
+MAX_COVERAGE_CELLS = 1 << 20
+
+
+def local_scales(lat0):
+    """
+    Meters per radian of latitude and of longitude at latitude lat0 (WGS84
+    radii of curvature).
+    """
+    phi = math.radians(lat0)
+    denom = 1. - EARTH_E2 * math.sin(phi) ** 2
+    meridian = EARTH_A * (1. - EARTH_E2) / denom ** 1.5
+    normal = EARTH_A / math.sqrt(denom)
+    return meridian, normal * math.cos(phi)
+
+
+def polygon_area(x, y):
+    """
+    Area (m^2) of a simple polygon (shoelace formula).
+    """
+    return abs(float(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))) / 2.
+
+
+def inside_polygon(px, py, x, y):
+    """
+    Mask of the points (px, py) inside the polygon (x, y), even-odd rule.
+    """
+    inside = np.zeros(np.broadcast(px, py).shape, dtype=bool)
+    for x0, y0, x1, y1 in zip(x, y, np.roll(x, -1), np.roll(y, -1)):
+        if y0 == y1:
+            continue
+        crosses = (y0 > py) != (y1 > py)
+        inside ^= crosses & (px < x0 + (py - y0) * (x1 - x0) / (y1 - y0))
+    return inside
+
+
+def line_extents(u, v, centers, half):
+    """
+    Along-line extent of the polygon inside the band of every survey line.
+
+    Parameters:
+    -----------
+    u, v: np.ndarray
+        Polygon vertices, u along the lines and v across them.
+    centers: np.ndarray
+        v of the lines.
+    half: float
+        Half swath width: a line sees the band [center - half, center + half].
+
+    Returns:
+    --------
+    (u_min, u_max): np.ndarray
+        NaN for a band outside the polygon.
+    """
+    u1, v1 = np.roll(u, -1), np.roll(v, -1)
+    # the extremes of u over a band are at its borders or at vertices inside it
+    levels = np.concatenate([centers - half, centers, centers + half])[:, None]
+    crosses = (np.minimum(v, v1) <= levels) & (levels <= np.maximum(v, v1)) & (v != v1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        at_level = np.where(crosses, u + (levels - v) * (u1 - u) / (v1 - v), np.nan)
+    at_level = at_level.reshape(3, len(centers), -1).transpose(1, 0, 2).reshape(len(centers), -1)
+    vertices = np.where(np.abs(v[None, :] - centers[:, None]) <= half, u[None, :], np.nan)
+    candidates = np.concatenate([at_level, vertices], axis=1)
+    found = ~np.isnan(candidates)
+    u_min = np.where(found, candidates, np.inf).min(axis=1)
+    u_max = np.where(found, candidates, -np.inf).max(axis=1)
+    empty = ~found.any(axis=1)
+    u_min[empty] = np.nan
+    u_max[empty] = np.nan
+    return u_min, u_max
+
+
+def line_centers(v, swath, spacing):
+    """
+    Across-line position of the fewest lines whose swaths cover [min(v), max(v)],
+    centered on the polygon.
+    """
+    width = float(v.max() - v.min())
+    count = 1 if width <= swath else int(math.ceil((width - swath) / spacing - 1e-9)) + 1
+    middle = (float(v.max()) + float(v.min())) / 2.
+    return middle + (np.arange(count) - (count - 1) / 2.) * spacing
+
+
+def best_direction(x, y, swath, spacing, step=1.):
+    """
+    Line direction (radians counterclockwise from east) needing the fewest
+    lines, the shortest lines among those.
+    """
+    angles = np.radians(np.arange(0., 180., step))
+    v = -np.sin(angles)[:, None] * x[None, :] + np.cos(angles)[:, None] * y[None, :]
+    widths = v.max(axis=1) - v.min(axis=1)
+    counts = np.where(widths <= swath, 1, np.ceil((widths - swath) / spacing - 1e-9) + 1)
+    best, best_length = None, np.inf
+    for angle in angles[counts == counts.min()]:
+        u = np.cos(angle) * x + np.sin(angle) * y
+        v = -np.sin(angle) * x + np.cos(angle) * y
+        u_min, u_max = line_extents(u, v, line_centers(v, swath, spacing), swath / 2.)
+        length = np.nansum(u_max - u_min)
+        if length < best_length:
+            best, best_length = float(angle), length
+    return best
+
+
+class SurveyPlan:
+    """
+    Boustrophedon survey of a polygon.
+
+    Parameters:
+    -----------
+    lat, lon: array_like
+        Polygon vertices (decimal degrees).
+    swath: float
+        Width (m) of ground the LiDAR covers across the track.
+    overlap: float
+        Fraction of the swath shared by neighbouring lines.
+    alt: float
+        Flight altitude (m, relative to home).
+    speed: float
+        Ground speed (m/s).
+    direction: float
+        Line direction (degrees counterclockwise from east), the one needing
+        the fewest lines if None.
+    extend: float
+        Meters added at both ends of every line (run-in before the swath
+        reaches the polygon).
+    home: tuple
+        (lat, lon) of the launch point: the survey starts at the corner
+        closest to it.
+
+    Attributes:
+    -----------
+    lat, lon: np.ndarray
+        Survey waypoints: the start and end of every line.
+    east, north: np.ndarray
+        The waypoints in the local frame (m from the polygon centroid).
+    """
+
+    def __init__(self, lat, lon, swath, overlap=0.2, alt=60., speed=5., direction=None, extend=0., home=None):
+        polygon_lat, polygon_lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+        if len(polygon_lat) < 3:
+            raise ValueError("the polygon needs at least three vertices")
+        if swath <= 0 or not 0 <= overlap < 1:
+            raise ValueError("swath must be positive and overlap in [0, 1)")
+        if speed <= 0:
+            raise ValueError("speed must be positive")
+        self.polygon_lat, self.polygon_lon = polygon_lat, polygon_lon
+        self.swath, self.overlap, self.alt, self.speed = swath, overlap, alt, speed
+        self.spacing = swath * (1. - overlap)
+        self.origin = (float(polygon_lat.mean()), float(polygon_lon.mean()))
+        self._scales = local_scales(self.origin[0])
+        x, y = self.to_local(polygon_lat, polygon_lon)
+        self.area = polygon_area(x, y)
+        self.home = home
+
+        angle = best_direction(x, y, swath, self.spacing) if direction is None else math.radians(direction)
+        self.direction = math.degrees(angle)
+        u = np.cos(angle) * x + np.sin(angle) * y
+        v = -np.sin(angle) * x + np.cos(angle) * y
+        centers = line_centers(v, swath, self.spacing)
+        u_min, u_max = line_extents(u, v, centers, swath / 2.)
+        keep = ~np.isnan(u_min)
+        centers, u_min, u_max = centers[keep], u_min[keep] - extend, u_max[keep] + extend
+        self.lines = len(centers)
+        self.line_length = float(np.sum(u_max - u_min))
+
+        # boustrophedon: every other line flown backwards
+        backwards = np.arange(self.lines) % 2 == 1
+        line_u = np.column_stack([np.where(backwards, u_max, u_min), np.where(backwards, u_min, u_max)]).ravel()
+        line_v = np.repeat(centers, 2)
+        east = np.cos(angle) * line_u - np.sin(angle) * line_v
+        north = np.sin(angle) * line_u + np.cos(angle) * line_v
+        if home is not None:
+            # of the four ways to fly the lines, start at the corner closest to home
+            home_east, home_north = self.to_local(*home)
+            variants = [(east, north), (east[::-1], north[::-1])]
+            flipped = np.arange(len(east)) ^ 1      # every line flown the other way
+            variants += [(e[flipped], n[flipped]) for e, n in variants]
+            east, north = min(variants, key=lambda w: math.hypot(w[0][0] - home_east, w[1][0] - home_north))
+        self.east, self.north = east, north
+        self.lat, self.lon = self.to_geodetic(east, north)
+
+    def to_local(self, lat, lon):
+        """
+        (east, north) meters from the polygon centroid.
+        """
+        meridian, parallel = self._scales
+        east = np.radians(np.asarray(lon, dtype=np.float64) - self.origin[1]) * parallel
+        north = np.radians(np.asarray(lat, dtype=np.float64) - self.origin[0]) * meridian
+        return east, north
+
+    def to_geodetic(self, east, north):
+        meridian, parallel = self._scales
+        return self.origin[0] + np.degrees(np.asarray(north) / meridian), \
+            self.origin[1] + np.degrees(np.asarray(east) / parallel)
+
+    @property
+    def legs(self):
+        """
+        Length (m) of every leg between consecutive waypoints.
+        """
+        return np.hypot(np.diff(self.east), np.diff(self.north))
+
+    @property
+    def path_length(self):
+        return float(self.legs.sum())
+
+    def estimate(self, turn_time=DEFAULT_TURN_TIME, climb_rate=2.5, endurance=20., reserve=0.2):
+        """
+        Flight time and batteries of the survey.
+
+        Parameters:
+        -----------
+        turn_time: float
+            Seconds lost at every waypoint (deceleration, turn, acceleration).
+        climb_rate: float
+            m/s for the takeoff and the landing.
+        endurance: float
+            Minutes of flight on one battery.
+        reserve: float
+            Fraction of every battery kept for the landing.
+
+        Returns:
+        --------
+        estimate: dict
+            survey_s (the lines and turns), flight_s (with takeoff, landing
+            and the transit from and to home), batteries, hectares,
+            hectares_per_battery (surveyed on one battery at this spacing and speed).
+        """
+        survey = self.path_length / self.speed + max(len(self.east) - 2, 0) * turn_time
+        transit = 0.
+        if self.home is not None:
+            home_east, home_north = self.to_local(*self.home)
+            transit = (math.hypot(self.east[0] - home_east, self.north[0] - home_north) +
+                       math.hypot(self.east[-1] - home_east, self.north[-1] - home_north)) / self.speed + 2 * turn_time
+        overhead = transit + 2. * self.alt / climb_rate
+        flight = survey + overhead
+        usable = endurance * 60. * (1. - reserve)
+        hectares = self.area / 1e4
+        per_battery = hectares * max(0., usable - 2. * self.alt / climb_rate) / survey if survey > 0 else 0.
+        return {'lines': self.lines, 'waypoints': len(self.east), 'spacing_m': self.spacing,
+                'direction_deg': self.direction, 'path_m': self.path_length, 'survey_s': survey,
+                'flight_s': flight, 'batteries': int(math.ceil(flight / usable)) if usable > 0 else None,
+                'hectares': hectares, 'hectares_per_battery': per_battery}
+
+    def coverage(self, lat, lon, resolution=None):
+        """
+        Fraction of the polygon within half a swath of a flown track.
+
+        Parameters:
+        -----------
+        lat, lon: array_like
+            Track positions, dense compared to the swath (e.g. a telemetry log).
+        resolution: float
+            Grid cell (m), about a million cells over the polygon if None.
+
+        Returns:
+        --------
+        fraction: float
+        """
+        x, y = self.to_local(self.polygon_lat, self.polygon_lon)
+        if resolution is None:
+            resolution = max(self.swath / 16., math.sqrt(np.ptp(x) * np.ptp(y) / MAX_COVERAGE_CELLS))
+        radius = int(math.ceil(self.swath / 2. / resolution))
+        columns = int(math.ceil(np.ptp(x) / resolution)) + 1
+        rows = int(math.ceil(np.ptp(y) / resolution)) + 1
+        gx = x.min() + (np.arange(columns) + 0.5) * resolution
+        gy = y.min() + (np.arange(rows) + 0.5) * resolution
+        inside = inside_polygon(gx[None, :], gy[:, None], x, y)
+
+        # track cells up to a radius outside the grid count, the grid is padded
+        # so their disks never need clipping
+        pad = 2 * radius
+        covered = np.zeros((rows + 2 * pad, columns + 2 * pad), dtype=bool)
+        offsets = np.arange(-radius, radius + 1) * resolution
+        disk = np.hypot(offsets[None, :], offsets[:, None]) <= self.swath / 2.
+        east, north = self.to_local(lat, lon)
+        cells = np.unique(np.column_stack([np.round((east - gx[0]) / resolution),
+                                           np.round((north - gy[0]) / resolution)]).astype(np.int64), axis=0)
+        cells = cells[(cells[:, 0] >= -radius) & (cells[:, 0] < columns + radius) &
+                      (cells[:, 1] >= -radius) & (cells[:, 1] < rows + radius)]
+        size = 2 * radius + 1
+        for column, row in (cells + pad - radius).tolist():
+            covered[row:row + size, column:column + size] |= disk
+        covered = covered[pad:pad + rows, pad:pad + columns]
+        return float((covered & inside).sum() / max(1, inside.sum()))
+
+    def commands(self):
+        """
+        The mission as dronekit Commands: takeoff to the survey altitude, ground
+        speed, one waypoint per line end and return to launch.
+        """
+        from dronekit import Command
+        from pymavlink import mavutil
+        mavlink = mavutil.mavlink
+        frame = mavlink.MAV_FRAME_GLOBAL_RELATIVE_ALT
+        commands = [Command(0, 0, 0, frame, mavlink.MAV_CMD_NAV_TAKEOFF, 0, 0, 0, 0, 0, 0, 0, 0, self.alt),
+                    # param1 1: ground speed, param3 -1: throttle unchanged
+                    Command(0, 0, 0, frame, mavlink.MAV_CMD_DO_CHANGE_SPEED, 0, 0, 1, self.speed, -1, 0, 0, 0, 0)]
+        for lat, lon in zip(self.lat.tolist(), self.lon.tolist()):
+            commands.append(Command(0, 0, 0, frame, mavlink.MAV_CMD_NAV_WAYPOINT, 0, 0, 0, 0, 0, 0, lat, lon, self.alt))
+        commands.append(Command(0, 0, 0, frame, mavlink.MAV_CMD_NAV_RETURN_TO_LAUNCH, 0, 0, 0, 0, 0, 0, 0, 0, 0))
+        return commands
+
+    def upload(self, vehicle, timeout=60.):
+        """
+        Replace the vehicle mission with the plan, sent in one batch.
+
+        Returns:
+        --------
+        count: int
+            Mission items uploaded.
+        """
+        commands = vehicle.commands
+        commands.clear()
+        for command in self.commands():
+            commands.add(command)
+        commands.upload(timeout=timeout)
+        return commands.count
+
+    def to_json(self, path, estimate=None):
+        with open(path, 'w') as f:
+            json.dump({'polygon': list(zip(self.polygon_lat.tolist(), self.polygon_lon.tolist())),
+                       'swath': self.swath, 'overlap': self.overlap, 'alt': self.alt, 'speed': self.speed,
+                       'waypoints': list(zip(self.lat.tolist(), self.lon.tolist())),
+                       'estimate': estimate}, f, indent=2)
+
+
+class MissionProgress:
+    """
+    Progress along a survey from the vehicle position.
+
+    The target is the vehicle's current mission waypoint when known
+    (vehicle.commands.next), otherwise it moves on when the vehicle comes
+    within `tolerance` meters of it.
+
+    Attributes:
+    -----------
+    target: int
+        Index of the waypoint flown to, len(plan.lat) once the survey is done.
+    distance: float
+        Meters to the target.
+    """
+
+    def __init__(self, plan, tolerance=2., turn_time=DEFAULT_TURN_TIME):
+        self.plan = plan
+        self.tolerance = tolerance
+        self.turn_time = turn_time
+        self.target = 0
+        self.distance = math.nan
+        self._legs = plan.legs
+        self._done = np.concatenate([[0.], np.cumsum(self._legs)])
+
+    @property
+    def count(self):
+        return len(self.plan.east)
+
+    @property
+    def done(self):
+        return self.target >= self.count
+
+    def _distance(self, east, north):
+        return math.hypot(self.plan.east[self.target] - east, self.plan.north[self.target] - north)
+
+    def update(self, lat, lon, target=None):
+        """
+        Move to a new vehicle position.
+
+        Returns:
+        --------
+        fraction: float
+            Fraction of the survey path flown.
+        """
+        east, north = (float(v) for v in self.plan.to_local(lat, lon))
+        if target is not None:
+            self.target = min(max(int(target), 0), self.count)
+        if self.done:
+            self.distance = 0.
+            return 1.
+        self.distance = self._distance(east, north)
+        if target is None:
+            while self.distance <= self.tolerance:
+                self.target += 1
+                if self.done:
+                    self.distance = 0.
+                    return 1.
+                self.distance = self._distance(east, north)
+        return self.fraction
+
+    @property
+    def fraction(self):
+        if self.done:
+            return 1.
+        if self.target == 0:
+            return 0.
+        flown = self._done[self.target] - min(self.distance, self._legs[self.target - 1])
+        return flown / self._done[-1] if self._done[-1] > 0 else 0.
+
+    @property
+    def remaining(self):
+        """
+        Estimated seconds to the end of the survey.
+        """
+        if self.done:
+            return 0.
+        path = self._done[-1] - self._done[self.target] + self.distance
+        return path / self.plan.speed + (self.count - 1 - self.target) * self.turn_time
+
+    def __str__(self):
+        if self.done:
+            return "survey done"
+        return f"waypoint {self.target + 1}/{self.count}: {self.distance:.0f} m, " \
+               f"{self.fraction:.0%} flown, {self.remaining:.0f} s left"
+
+
+def fly_survey(vehicle, plan, poll=1., tolerance=2., turn_time=DEFAULT_TURN_TIME):
+    """
+    Upload the plan, take off and fly it in AUTO mode, printing the progress
+    every `poll` seconds until the vehicle returns to launch.
+
+    Returns:
+    --------
+    elapsed: float
+        Seconds from the takeoff to the end of the last survey line.
+    """
+    from dronekit import VehicleMode
+    from missions import arm_and_takeoff
+    plan.upload(vehicle)
+    start = time.monotonic()
+    arm_and_takeoff(vehicle, plan.alt)
+    vehicle.commands.next = 0
+    vehicle.mode = VehicleMode("AUTO")
+    progress = MissionProgress(plan, tolerance, turn_time)
+    while not progress.done:
+        location = vehicle.location.global_frame
+        # mission items 1..FIRST_WAYPOINT_SEQ - 1 are the takeoff and speed: target the first waypoint
+        progress.update(location.lat, location.lon, max(vehicle.commands.next - FIRST_WAYPOINT_SEQ, 0))
+        print(progress)
+        time.sleep(poll)
+    return time.monotonic() - start
+
+
+def simulate(plan, turn_time=DEFAULT_TURN_TIME, tolerance=2., accel=SIM_ACCEL, yaw_rate=SIM_YAW_RATE):
+    """
+    Fly the survey lines with a simulated vehicle (sim_vehicle.py) as fast as
+    possible, following the progress from its positions.  The vehicle does
+    not share the fixed `turn_time` of SurveyPlan.estimate: it brakes to a
+    stop at every waypoint at `accel` (m/s^2), yaws to the next line at
+    `yaw_rate` (deg/s) and accelerates again, so survey_s checks the estimate.
+
+    Returns:
+    --------
+    result: dict
+        survey_s (simulated), reached (waypoints), coverage (fraction of the
+        polygon seen by the swath).
+    """
+    from sim_vehicle import SimulatedVehicle, WaypointTrajectory
+    trajectory = WaypointTrajectory(plan.lat, plan.lon, plan.alt, plan.speed, accel=accel, yaw_rate=yaw_rate)
+    vehicle = SimulatedVehicle(trajectory, rates={'location.global_frame': 10.})
+    progress = MissionProgress(plan, tolerance, turn_time)
+    track = []
+
+    def on_step(t):
+        location = vehicle.location.global_frame
+        progress.update(location.lat, location.lon)
+        track.append((location.lat, location.lon))
+
+    vehicle.run(on_step=on_step)
+    lat, lon = np.array(track).T
+    return {'survey_s': trajectory.duration, 'reached': progress.target, 'coverage': plan.coverage(lat, lon)}
+
+
+def load_polygon(text):
+    """
+    Polygon vertices from a file (one "lat, lon" per line, "#" comments) or
+    an inline "lat,lon;lat,lon;..." list.
+
+    Returns:
+    --------
+    (lat, lon): np.ndarray
+    """
+    if os.path.exists(text):
+        with open(text) as f:
+            vertices = [line.split('#')[0] for line in f]
+    else:
+        vertices = text.split(';')
+    points = []
+    for vertex in vertices:
+        if vertex.strip():
+            try:
+                lat, lon = (float(value) for value in vertex.replace(',', ' ').split())
+            except ValueError:
+                raise ValueError(f"bad polygon vertex '{vertex.strip()}' (expected 'lat, lon')")
+            points.append((lat, lon))
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    return tuple(np.array(column) for column in zip(*points)) if points else (np.empty(0), np.empty(0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Plan, estimate and fly lawnmower LiDAR surveys')
+    parser.add_argument('--polygon', required=True, help="Polygon file (one 'lat, lon' per line) or --polygon='lat,lon;lat,lon;...' "
+                             "(with '=' when it starts with a minus sign).")
+    parser.add_argument('--swath', type=float, required=True, help="LiDAR swath width on the ground (m).")
+    parser.add_argument('--overlap', type=float, default=0.2, help="Fraction of the swath shared by neighbouring lines.")
+    parser.add_argument('--alt', type=float, default=60., help="Flight altitude relative to home (m).")
+    parser.add_argument('--speed', type=float, default=5., help="Ground speed (m/s).")
+    parser.add_argument('--direction', type=float, default=None,
+                        help="Line direction (degrees counterclockwise from east). Fewest lines if not given.")
+    parser.add_argument('--extend', type=float, default=0., help="Meters added at both ends of every line.")
+    parser.add_argument('--home', default=None, help="'lat,lon' of the launch point.")
+    parser.add_argument('--turn_time', type=float, default=DEFAULT_TURN_TIME, help="Seconds lost at every waypoint.")
+    parser.add_argument('--accel', type=float, default=SIM_ACCEL,
+                        help="With --simulate: acceleration and braking of the vehicle (m/s^2).")
+    parser.add_argument('--yaw_rate', type=float, default=SIM_YAW_RATE,
+                        help="With --simulate: yaw rate of the vehicle at the waypoints (deg/s).")
+    parser.add_argument('--endurance', type=float, default=20., help="Minutes of flight per battery.")
+    parser.add_argument('--reserve', type=float, default=0.2, help="Fraction of every battery kept in reserve.")
+    parser.add_argument('--out', help="Save the plan and its estimate as JSON.")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--simulate', action='store_true', help="Fly the plan on a simulated vehicle (no autopilot).")
+    group.add_argument('--sitl', action='store_true', help="Upload and fly the plan on dronekit_sitl.")
+    group.add_argument('--connect', help="Vehicle connection string: upload the plan.")
+    parser.add_argument('--fly', action='store_true', help="With --connect: take off and fly the uploaded plan.")
+    args = parser.parse_args()
+
+    try:
+        home = None if args.home is None else tuple(float(v) for v in args.home.split(','))
+        plan = SurveyPlan(*load_polygon(args.polygon), args.swath, args.overlap, args.alt, args.speed,
+                          args.direction, args.extend, home)
+    except ValueError as e:
+        print(f"error: {e}")
+        raise SystemExit(1)
+    estimate = plan.estimate(args.turn_time, endurance=args.endurance, reserve=args.reserve)
+    print(f"{estimate['hectares']:.2f} ha, {plan.lines} lines {plan.spacing:.1f} m apart at {plan.direction:.0f} deg, "
+          f"{estimate['waypoints']} waypoints, {estimate['path_m'] / 1000:.2f} km")
+    print(f"survey {estimate['survey_s'] / 60:.1f} min, flight {estimate['flight_s'] / 60:.1f} min: "
+          f"batteries of {args.endurance:.0f} min: {estimate['batteries']}, "
+          f"{estimate['hectares_per_battery']:.2f} ha per battery")
+    if args.out:
+        plan.to_json(args.out, estimate)
+
+    if args.simulate:
+        t0 = time.perf_counter()
+        result = simulate(plan, args.turn_time, accel=args.accel, yaw_rate=args.yaw_rate)
+        print(f"simulated: {result['reached']}/{estimate['waypoints']} waypoints reached, "
+              f"survey {result['survey_s'] / 60:.1f} min (estimate {estimate['survey_s'] / 60:.1f}), "
+              f"{result['coverage']:.1%} of the polygon covered ({time.perf_counter() - t0:.2f} s)")
+    elif args.sitl or args.connect:
+        from dronekit import connect
+        sitl = None
+        if args.sitl:
+            import dronekit_sitl
+            sitl = dronekit_sitl.start_default(*(home or plan.origin))
+            connection_string = sitl.connection_string()
+        else:
+            connection_string = args.connect
+        vehicle = connect(connection_string, wait_ready=True)
+        try:
+            if args.sitl or args.fly:
+                elapsed = fly_survey(vehicle, plan, turn_time=args.turn_time)
+                print(f"survey flown in {elapsed / 60:.1f} min from the takeoff (estimate: survey "
+                      f"{estimate['survey_s'] / 60:.1f} min, whole flight {estimate['flight_s'] / 60:.1f} min)")
+            else:
+                print(f"{plan.upload(vehicle)} mission items uploaded")
+        finally:
+            vehicle.close()
+            if sitl is not None:
+                sitl.stop()
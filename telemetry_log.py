@@ -0,0 +1,189 @@
+import argparse
+import os
+import struct
+
+import numpy as np
+
+# One row per line of the ".custom" log written by DataGenerator.save2file:
+# utc, utc_time, utc_date, lat, lon, alt, yaw, roll, pitch
+TELEMETRY_DTYPE = np.dtype([('utc', 'f8'), ('lat', 'f8'), ('lon', 'f8'), ('alt', 'f8'),
+                            ('yaw', 'f8'), ('roll', 'f8'), ('pitch', 'f8')])
+
+CUSTOM_FIELDS = 9
+
+# Binary log (".tlog"): a 16-byte header followed by fixed-size little-endian
+# records, so the file maps straight onto a NumPy structured array.
+BINARY_MAGIC = b"TLOG"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sHHQ")     # magic, version, record size, reserved
+BINARY_RECORD = struct.Struct("<ddddfffffB3x")
+BINARY_DTYPE = np.dtype([('mono', '<f8'), ('utc', '<f8'), ('lat', '<f8'), ('lon', '<f8'),
+                         ('alt', '<f4'), ('yaw', '<f4'), ('roll', '<f4'), ('pitch', '<f4'),
+                         ('groundspeed', '<f4'), ('ekf_ok', 'u1'), ('_pad', 'V3')])
+EKF_UNKNOWN = 255
+
+assert BINARY_DTYPE.itemsize == BINARY_RECORD.size
+
+
+def _to_float(values):
+    """
+    Convert text values to float, dronekit's "None" (no value yet) becomes NaN.
+    """
+    values = np.asarray(values)
+    values = np.where(values == "None", "nan", values)
+    return values.astype(np.float64)
+
+
+def load_custom_log(filepath):
+    """
+    Load a ".custom" telemetry log into a NumPy structured array.
+
+    Parameters:
+    -----------
+    filepath: str
+        Location of the log (e.g. "<filepath>.custom" from send2velodyne.py).
+
+    Returns:
+    --------
+    telemetry: np.ndarray
+        Structured array with TELEMETRY_DTYPE sorted by time. utc is the UTC
+        epoch in seconds, lat/lon in decimal degrees, alt in meters and
+        yaw/roll/pitch in radians (as reported by dronekit).
+    """
+    rows = []
+    with open(filepath) as f:
+        for line in f:
+            fields = line.rstrip("\n").split(", ")
+            if len(fields) == CUSTOM_FIELDS:
+                rows.append(fields)
+    telemetry = np.empty(len(rows), dtype=TELEMETRY_DTYPE)
+    if not rows:
+        return telemetry
+    columns = np.array(rows).T
+    utc = columns[0].astype("datetime64[us]")
+    telemetry['utc'] = (utc - np.datetime64(0, "us")).astype(np.int64) / 1e6
+    for name, column in zip(['lat', 'lon', 'alt', 'yaw', 'roll', 'pitch'], columns[3:]):
+        telemetry[name] = _to_float(column)
+    return telemetry[np.argsort(telemetry['utc'], kind="stable")]
+
+
+def pack_record(mono, utc, lat, lon, alt, yaw, roll, pitch, groundspeed, ekf_ok):
+    """
+    Encode one telemetry sample as a binary log record.
+
+    Parameters:
+    -----------
+    mono: float
+        Monotonic clock (s) when the sample was taken.
+    utc: float
+        UTC epoch (s).
+    lat, lon: float
+        Decimal degrees.
+    alt: float
+        Meters.
+    yaw, roll, pitch: float
+        Radians.
+    groundspeed: float
+        m/s.
+    ekf_ok: bool
+        EKF status, None if unknown.
+
+    None values are stored as NaN.
+    """
+    nan = float("nan")
+    return BINARY_RECORD.pack(mono, utc,
+                              nan if lat is None else lat, nan if lon is None else lon,
+                              nan if alt is None else alt, nan if yaw is None else yaw,
+                              nan if roll is None else roll, nan if pitch is None else pitch,
+                              nan if groundspeed is None else groundspeed,
+                              EKF_UNKNOWN if ekf_ok is None else int(bool(ekf_ok)))
+
+
+def binary_header():
+    return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, BINARY_RECORD.size, 0)
+
+
+def create_binary_log(filepath):
+    """
+    Write the header of a new binary log, an existing log is left untouched so
+    records can be appended to it.
+    """
+    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+        with open(filepath, 'wb') as f:
+            f.write(binary_header())
+
+
+def is_binary_log(filepath):
+    with open(filepath, 'rb') as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def load_binary_log(filepath):
+    """
+    Memory-map a binary telemetry log as a NumPy structured array.
+
+    Returns:
+    --------
+    telemetry: np.memmap
+        Read-only structured array with BINARY_DTYPE. A partially written
+        last record (e.g. power loss) is ignored.
+    """
+    size = os.path.getsize(filepath)
+    with open(filepath, 'rb') as f:
+        header = f.read(BINARY_HEADER.size)
+    if len(header) < BINARY_HEADER.size:
+        raise ValueError(f"{filepath}: not a binary telemetry log")
+    magic, version, record_size, _ = BINARY_HEADER.unpack(header)
+    if magic != BINARY_MAGIC:
+        raise ValueError(f"{filepath}: not a binary telemetry log")
+    if version != BINARY_VERSION or record_size != BINARY_DTYPE.itemsize:
+        raise ValueError(f"{filepath}: unsupported binary log version {version} (record size {record_size})")
+    count = (size - BINARY_HEADER.size) // record_size
+    if count == 0:
+        return np.empty(0, dtype=BINARY_DTYPE)
+    return np.memmap(filepath, dtype=BINARY_DTYPE, mode='r', offset=BINARY_HEADER.size, shape=(count,))
+
+
+def load_telemetry(filepath):
+    """
+    Load a telemetry log in either format (binary ".tlog" or text ".custom").
+    Both results have the utc, lat, lon, alt, yaw, roll and pitch fields.
+    """
+    if is_binary_log(filepath):
+        return load_binary_log(filepath)
+    return load_custom_log(filepath)
+
+
+def convert_custom_log(src, dst):
+    """
+    Convert a text ".custom" log to the binary format. The text log has no
+    monotonic clock, groundspeed or EKF status: mono is the time since the
+    first sample, groundspeed is NaN and the EKF status unknown.
+
+    Returns:
+    --------
+    count: int
+        Number of records written.
+    """
+    telemetry = load_custom_log(src)
+    records = np.zeros(len(telemetry), dtype=BINARY_DTYPE)
+    for name in TELEMETRY_DTYPE.names:
+        records[name] = telemetry[name]
+    if len(telemetry):
+        records['mono'] = telemetry['utc'] - telemetry['utc'][0]
+    records['groundspeed'] = np.nan
+    records['ekf_ok'] = EKF_UNKNOWN
+    with open(dst, 'wb') as f:
+        f.write(binary_header())
+        f.write(records.tobytes())
+    return len(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert a .custom telemetry log to the binary .tlog format')
+    parser.add_argument('src', help="Text telemetry log (.custom).")
+    parser.add_argument('dst', help="Binary telemetry log to write (.tlog).")
+    args = parser.parse_args()
+
+    count = convert_custom_log(args.src, args.dst)
+    print(f"{count} records: {os.path.getsize(args.src)} -> {os.path.getsize(args.dst)} bytes")
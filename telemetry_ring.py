@@ -0,0 +1,177 @@
+import datetime
+import math
+import threading
+
+import numpy as np
+
+from telemetry_state import TelemetrySnapshot
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Columns of the ring, every sample is one row of float64 (None -> NaN)
+RING_FIELDS = ("mono", "utc", "lat", "lon", "alt", "north", "east", "down",
+               "yaw", "roll", "pitch", "groundspeed", "ekf_ok", "satellites")
+# Interpolated on the shortest arc (radians)
+ANGLE_FIELDS = ("yaw", "roll", "pitch")
+# Held from the sample before t instead of interpolated
+STEP_FIELDS = ("ekf_ok", "satellites")
+
+_COLUMN = {name: i for i, name in enumerate(RING_FIELDS)}
+_NAN = float("nan")
+
+
+def _value(value):
+    return _NAN if value is None else float(value)
+
+
+class TelemetryRing:
+    """
+    Preallocated ring buffer of the most recent telemetry samples.
+
+    Samples are appended in monotonic-clock order into a fixed (capacity,
+    len(RING_FIELDS)) float64 array, the oldest sample being overwritten when
+    the ring is full. at(t) finds the two samples around t with a binary
+    search (np.searchsorted on the two sorted halves of the ring) and
+    interpolates between them, so consumers can get the telemetry at an exact
+    instant (e.g. the PPS edge) instead of the last value received.
+
+    Parameters:
+    -----------
+    capacity: int
+        Number of samples kept (e.g. 60 s at 50 updates/s = 3000).
+
+    Example:
+    --------
+    >>> ring = TelemetryRing(3000)
+    >>> ring.append_snapshot(state.snapshot())
+    >>> snap = ring.at(time.monotonic() - 0.1)
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = int(capacity)
+        self._data = np.full((self.capacity, len(RING_FIELDS)), np.nan)
+        self._mono = self._data[:, 0]
+        self._next = 0          # row written by the next append
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, mono, utc, lat=None, lon=None, alt=None, north=None, east=None, down=None,
+               yaw=None, roll=None, pitch=None, groundspeed=None, ekf_ok=None, satellites=None):
+        """
+        Store one sample. mono must not decrease between calls (older samples are ignored).
+
+        Parameters:
+        -----------
+        mono: float
+            Monotonic clock (s) of the sample.
+        utc: float
+            UTC epoch (s) of the sample.
+        """
+        with self._lock:
+            if self._count and mono < self._mono[self._next - 1]:
+                return
+            self._data[self._next] = (mono, utc, _value(lat), _value(lon), _value(alt),
+                                      _value(north), _value(east), _value(down),
+                                      _value(yaw), _value(roll), _value(pitch), _value(groundspeed),
+                                      _value(ekf_ok), _value(satellites))
+            self._next = (self._next + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def append_snapshot(self, snap, utc=None):
+        """
+        Store a TelemetrySnapshot at its monotonic time. utc (epoch s) defaults to
+        the snapshot's utc.
+        """
+        if utc is None:
+            utc = (snap.utc - EPOCH).total_seconds()
+        self.append(snap.mono, utc, snap.lat, snap.lon, snap.alt, snap.north, snap.east, snap.down,
+                    snap.yaw, snap.roll, snap.pitch, snap.groundspeed, snap.ekf_ok, snap.satellites)
+
+    def span(self):
+        """
+        (oldest, newest) monotonic time held, None if empty.
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            return self._mono[self._oldest()], self._mono[self._next - 1]
+
+    def _oldest(self):
+        return self._next if self._count == self.capacity else 0
+
+    def _search(self, t):
+        """
+        Row of the last sample at or before t (-1 if t is before the oldest).
+        """
+        oldest = self._oldest()
+        if oldest == 0:
+            i = np.searchsorted(self._mono[:self._count], t, side="right") - 1
+            return int(i)
+        # full ring: rows [oldest:] then [:oldest] are each sorted
+        if t >= self._mono[0]:
+            return int(np.searchsorted(self._mono[:oldest], t, side="right") - 1)
+        i = np.searchsorted(self._mono[oldest:], t, side="right") - 1
+        return -1 if i < 0 else int(oldest + i)
+
+    def sample(self, t):
+        """
+        Telemetry at monotonic time t as a float64 row (RING_FIELDS order).
+        Times outside the ring are clamped to the oldest/newest sample.
+
+        Returns:
+        --------
+        row: np.ndarray
+            None if the ring is empty.
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            before = self._search(t)
+            newest = self._next - 1
+            if before < 0:
+                return self._data[self._oldest()].copy()
+            if before == newest % self.capacity:
+                return self._data[before].copy()
+            after = (before + 1) % self.capacity
+            a, b = self._data[before].copy(), self._data[after].copy()
+        dt = b[0] - a[0]
+        w = (t - a[0]) / dt if dt > 0 else 0.
+        row = a + (b - a) * w
+        for name in ANGLE_FIELDS:
+            i = _COLUMN[name]
+            delta = math.remainder(b[i] - a[i], 2 * math.pi)
+            row[i] = math.remainder(a[i] + delta * w, 2 * math.pi)
+        for name in STEP_FIELDS:
+            i = _COLUMN[name]
+            row[i] = a[i]
+        row[0] = t
+        return row
+
+    def at(self, t):
+        """
+        Telemetry at monotonic time t as a TelemetrySnapshot (see sample()).
+        """
+        row = self.sample(t)
+        if row is None:
+            return None
+        snap = TelemetrySnapshot.__new__(TelemetrySnapshot)
+        for name, value in zip(RING_FIELDS, row.tolist()):
+            setattr(snap, name, None if value != value else value)
+        snap.seq = None
+        snap.utc = EPOCH + datetime.timedelta(seconds=row[1])
+        snap.ekf_ok = None if snap.ekf_ok is None else bool(snap.ekf_ok)
+        snap.satellites = None if snap.satellites is None else int(snap.satellites)
+        return snap
+
+    def to_array(self):
+        """
+        Copy of the samples held, oldest first, shape (len, len(RING_FIELDS)).
+        """
+        with self._lock:
+            oldest = self._oldest()
+            if oldest == 0:
+                return self._data[:self._count].copy()
+            return np.concatenate([self._data[oldest:], self._data[:oldest]])
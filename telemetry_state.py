@@ -0,0 +1,193 @@
+import datetime
+import threading
+import time
+
+
+class TelemetrySnapshot:
+    """
+    Consistent copy of the vehicle telemetry used to build NMEA sentences and
+    log lines. Fields are None until the attribute is first reported.
+
+    Attributes:
+    -----------
+    seq: int
+        Number of updates applied to the state when the copy was taken.
+    mono: float
+        Monotonic clock (s) of the last update.
+    utc: datetime.datetime
+        UTC time stamped on the last attitude update (as the log lines).
+    lat, lon, alt: float
+        Global frame (decimal degrees, meters).
+    north, east, down: float
+        Local frame (meters).
+    yaw, roll, pitch: float
+        Attitude (radians).
+    groundspeed: float
+        m/s.
+    ekf_ok: bool
+    satellites: int
+        Satellites visible (gps_0).
+    """
+    __slots__ = ("seq", "mono", "utc", "lat", "lon", "alt", "north", "east", "down",
+                 "yaw", "roll", "pitch", "groundspeed", "ekf_ok", "satellites")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.seq = 0
+        self.mono = time.monotonic()
+        self.utc = datetime.datetime.utcnow()
+
+    def copy(self):
+        other = TelemetrySnapshot.__new__(TelemetrySnapshot)
+        for name in self.__slots__:
+            setattr(other, name, getattr(self, name))
+        return other
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"TelemetrySnapshot({self.as_dict()})"
+
+
+def _set_global_frame(snap, value):
+    snap.lat, snap.lon, snap.alt = value.lat, value.lon, value.alt
+
+
+def _set_local_frame(snap, value):
+    snap.north, snap.east, snap.down = value.north, value.east, value.down
+
+
+def _set_attitude(snap, value):
+    snap.yaw, snap.roll, snap.pitch = value.yaw, value.roll, value.pitch
+
+
+def _set_groundspeed(snap, value):
+    snap.groundspeed = value
+
+
+def _set_ekf_ok(snap, value):
+    snap.ekf_ok = bool(value)
+
+
+def _set_gps_0(snap, value):
+    snap.satellites = value.satellites_visible
+
+
+# attributes whose update stamps the snapshot's utc (as the log lines)
+STAMP_UTC = frozenset(['attitude'])
+
+# dronekit attribute name -> function applying its value to the snapshot
+HANDLERS = {
+    'location.global_frame': _set_global_frame,
+    'location.local_frame': _set_local_frame,
+    'attitude': _set_attitude,
+    'groundspeed': _set_groundspeed,
+    'ekf_ok': _set_ekf_ok,
+    'gps_0': _set_gps_0,
+}
+
+
+class TelemetryState:
+    """
+    Latest vehicle telemetry shared between the dronekit listener thread and
+    the threads sending NMEA sentences and writing logs.
+
+    Only the attributes in HANDLERS are subscribed to (one listener each, no
+    wildcard), each update is applied to a `__slots__` snapshot under a lock
+    and readers get a copy with snapshot(), so a sentence never mixes a new
+    position with an old timestamp.
+
+    Parameters:
+    -----------
+    global_frame, local_frame, attitude, groundspeed, ekf_ok:
+        Initial values (dronekit objects), None if unknown.
+    on_update: callable
+        Called as on_update(attr_name) after every update, outside the lock.
+
+    Example:
+    --------
+    >>> state = TelemetryState(on_update=print)
+    >>> state.attach(vehicle)
+    >>> snap = state.snapshot()
+    >>> snap.lat, snap.lon, snap.utc
+    """
+
+    def __init__(self, global_frame=None, local_frame=None, attitude=None, groundspeed=None, ekf_ok=None,
+                 on_update=None):
+        self.on_update = on_update
+        self._lock = threading.Lock()
+        self._snap = TelemetrySnapshot()
+        self._vehicle = None
+        initial = [('location.global_frame', global_frame), ('location.local_frame', local_frame),
+                   ('attitude', attitude), ('groundspeed', groundspeed), ('ekf_ok', ekf_ok)]
+        for attr_name, value in initial:
+            if value is not None:
+                HANDLERS[attr_name](self._snap, value)
+
+    @property
+    def seq(self):
+        return self._snap.seq
+
+    def update(self, attr_name, value, mono=None):
+        """
+        Apply an attribute value, received at monotonic time `mono` (now if None).
+
+        Returns:
+        --------
+        updated: bool
+            False if the attribute is not tracked.
+        """
+        handler = HANDLERS.get(attr_name)
+        if handler is None:
+            return False
+        now = time.monotonic()
+        mono = now if mono is None else mono
+        with self._lock:
+            snap = self._snap
+            handler(snap, value)
+            snap.mono = mono
+            if attr_name in STAMP_UTC:
+                snap.utc = datetime.datetime.utcnow() - datetime.timedelta(seconds=now - mono)
+            snap.seq += 1
+        if self.on_update is not None:
+            self.on_update(attr_name)
+        return True
+
+    def set(self, **fields):
+        """
+        Overwrite snapshot fields directly (e.g. set(utc=...) when replaying a log).
+        """
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self._snap, name, value)
+            self._snap.seq += 1
+
+    def snapshot(self):
+        """
+        Consistent copy of the current telemetry.
+        """
+        with self._lock:
+            return self._snap.copy()
+
+    def _listener(self, vehicle, attr_name, value):
+        self.update(attr_name, value)
+
+    def attach(self, vehicle, listener=None):
+        """
+        Subscribe to the tracked attributes of a dronekit vehicle. `listener`
+        (called as listener(vehicle, attr_name, value), and in charge of
+        calling update()) replaces the default one, e.g. to time the updates.
+        """
+        self._attached = listener or self._listener
+        for attr_name in HANDLERS:
+            vehicle.add_attribute_listener(attr_name, self._attached)
+        self._vehicle = vehicle
+
+    def detach(self):
+        if self._vehicle is None:
+            return
+        for attr_name in HANDLERS:
+            self._vehicle.remove_attribute_listener(attr_name, self._attached)
+        self._vehicle = None
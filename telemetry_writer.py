@@ -0,0 +1,276 @@
+import asyncio
+import atexit
+import os
+import queue
+import threading
+import time
+
+# seconds close() waits for the writer thread before giving up on it
+CLOSE_TIMEOUT = 5.
+
+
+class TelemetryWriter:
+    """
+    Append lines to a log file from a background thread.
+
+    Callers (e.g. dronekit attribute listeners) only put the line in a bounded
+    in-memory queue.  A single writer thread keeps the file open, writes the
+    queued lines and flushes them to the OS every `flush_every` lines or
+    `flush_interval` seconds, whichever comes first.  The file is flushed and
+    fsync'ed when the writer is closed (also at interpreter exit).  A write
+    error (disk full, USB stick pulled) stops the writer: it is kept in
+    `error`, printed, and the lines written after it are dropped.
+
+    Parameters:
+    -----------
+    filepath: str
+        File to append to.
+    max_queue: int
+        Maximum number of lines waiting to be written. Lines written while the
+        queue is full are dropped (and counted) instead of blocking the caller.
+    flush_every: int
+        Flush after this many lines.
+    flush_interval: float
+        Flush at least every `flush_interval` seconds while lines are pending.
+    verbose: bool
+        If True print every line written to the console (from the writer thread).
+    mode: str
+        File mode, "a" (Default) for text lines, "ab" for bytes records.
+    """
+
+    _STOP = object()
+
+    def __init__(self, filepath, max_queue=4096, flush_every=100, flush_interval=1.0, verbose=False, mode='a'):
+        self.filepath = filepath
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.verbose = verbose
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._file = open(filepath, mode, buffering=1 << 16)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"TelemetryWriter({filepath})", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, line):
+        """
+        Queue a line (without trailing newline for text files) to be written.
+
+        Returns:
+        --------
+        queued: bool
+            False if the line was dropped because the queue is full.
+        """
+        if self._closed or self.error is not None:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _flush(self):
+        self._file.flush()
+        self.flushes += 1
+
+    def _fail(self, error):
+        self.error = error
+        print(f"[TelemetryWriter] {self.filepath}: {error}, logging stopped")
+
+    def _run(self):
+        try:
+            self._drain()
+        except OSError as e:
+            self._fail(e)
+
+    def _drain(self):
+        newline = "\n" if 'b' not in self._file.mode else b""
+        pending = 0
+        last_flush = time.monotonic()
+        while True:
+            timeout = None
+            if pending:
+                timeout = max(0., self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                line = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                line = None
+            if line is self._STOP:
+                break
+            if line is not None:
+                self._file.write(line + newline)
+                if self.verbose:
+                    print(line)
+                self.written += 1
+                pending += 1
+            if pending and (pending >= self.flush_every or time.monotonic() - last_flush >= self.flush_interval):
+                self._flush()
+                pending = 0
+                last_flush = time.monotonic()
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """
+        Write every queued line, flush and fsync the file and stop the thread,
+        waiting at most `timeout` seconds for it.
+
+        Returns:
+        --------
+        error: OSError
+            Write error of the writer (None if every line was written).
+        """
+        if self._closed:
+            return self.error
+        self._closed = True
+        atexit.unregister(self.close)
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            # stuck in a write: the file is left to the thread
+            print(f"[TelemetryWriter] {self.filepath}: writer still busy after {timeout:.0f} s, not closed")
+            return self.error
+        if self.error is not None:
+            self.dropped += self._queue.qsize()
+        try:
+            if self.error is None:
+                self._flush()
+                os.fsync(self._file.fileno())
+            self._file.close()
+        except OSError as e:
+            if self.error is None:
+                self._fail(e)
+        return self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncTelemetryWriter:
+    """
+    Append lines to a log file from an asyncio event loop.
+
+    Same interface as TelemetryWriter, but without a thread: write() only
+    appends to an in-memory list and the run() coroutine writes the pending
+    lines every `flush_interval` seconds (or as soon as `flush_every` lines
+    are pending) in an executor, so the event loop never blocks on the file.
+    close() writes what is left, flushes and fsyncs the file.  A write error
+    stops the writer as in TelemetryWriter.
+    """
+
+    def __init__(self, filepath, max_queue=4096, flush_every=100, flush_interval=1.0, verbose=False, mode='a'):
+        self.filepath = filepath
+        self.max_queue = max_queue
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.verbose = verbose
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.error = None
+        self._pending = []
+        self._file = open(filepath, mode, buffering=1 << 16)
+        self._newline = "\n" if 'b' not in mode else b""
+        self._wakeup = None
+        self._closed = False
+        atexit.register(self.close)
+
+    def write(self, line):
+        """
+        Queue a line to be written. Must be called from the event loop thread
+        once run() is running.
+
+        Returns:
+        --------
+        queued: bool
+            False if the line was dropped because `max_queue` lines are pending.
+        """
+        if self._closed or self.error is not None or len(self._pending) >= self.max_queue:
+            self.dropped += 1
+            return False
+        self._pending.append(line)
+        if self._wakeup is not None and len(self._pending) >= self.flush_every:
+            self._wakeup.set()
+        return True
+
+    def _fail(self, error):
+        self.error = error
+        print(f"[TelemetryWriter] {self.filepath}: {error}, logging stopped")
+
+    def _write(self, lines):
+        if self.error is not None:
+            self.dropped += len(lines)
+            return
+        try:
+            self._file.write(self._newline.join(lines) + self._newline)
+            self._file.flush()
+        except OSError as e:
+            self.dropped += len(lines)
+            self._fail(e)
+            return
+        if self.verbose:
+            for line in lines:
+                print(line)
+        self.written += len(lines)
+        self.flushes += 1
+
+    async def run(self, executor=None):
+        """
+        Write pending lines until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                if self._pending:
+                    lines, self._pending = self._pending, []
+                    await loop.run_in_executor(executor, self._write, lines)
+        finally:
+            self._wakeup = None
+
+    def close(self):
+        """
+        Write every pending line, flush and fsync the file.
+
+        Returns:
+        --------
+        error: OSError
+            Write error of the writer (None if every line was written).
+        """
+        if self._closed:
+            return self.error
+        self._closed = True
+        atexit.unregister(self.close)
+        if self._pending:
+            lines, self._pending = self._pending, []
+            self._write(lines)
+        try:
+            if self.error is None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._file.close()
+        except OSError as e:
+            if self.error is None:
+                self._fail(e)
+        return self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,43 @@
+import collections
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+sys.path.insert(0, os.path.join(ROOT, "Velodyne_pcap", "pcap"))
+
+from frame_assembler import FrameAssembler
+from synthetic import DATA_RATE, vlp16_data_payloads
+
+Packet = collections.namedtuple("Packet", "ts payload")
+
+SECONDS = 2.
+FIRINGS = 36000 / (600 / 60 * 36000 * 110.592e-6)     # firings per rotation at 600 rpm
+
+
+def stream(dual):
+    rate = 2 * DATA_RATE if dual else DATA_RATE
+    n = int(SECONDS * rate)
+    payloads = vlp16_data_payloads(n, dual=dual)
+    return [Packet(1600000000. + i / rate, payloads[i].tobytes()) for i in range(n)]
+
+
+@pytest.mark.parametrize("dual", [False, True])
+@pytest.mark.parametrize("cut", [0., 90., 359.99])
+def test_frames_are_whole_rotations(dual, cut):
+    assembler = FrameAssembler(cut=cut, drop_empty=False)
+    frames = [(len(frame.points), frame.packets, frame.complete)
+              for frame in assembler.frames(stream(dual))]
+    complete = [frame for frame in frames if frame[2]]
+    assert len(complete) == int(SECONDS * 10) - 1
+    blocks = 2 if dual else 1
+    packets_per_rotation = DATA_RATE * blocks / 10
+    for points, packets, _ in complete:
+        # a pair of dual return blocks is never split between frames
+        assert abs(points / (32 * blocks) - FIRINGS) <= 1
+        assert np.floor(packets_per_rotation) <= packets <= np.ceil(packets_per_rotation) + 1
+    assert sum(frame[0] for frame in frames) == len(stream(dual)) * 12 * 32
+    assert assembler.stats.rate == pytest.approx(10., rel=1e-3)
@@ -0,0 +1,101 @@
+import datetime
+import os
+import re
+import sys
+import types
+
+import numpy as np
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from nmea_batch import encode_gprmc, parse_gprmc
+from rpi_gps_datagen import DataGenerator, mps2knots
+
+UTC = 1600000000.
+
+
+def gen_sentence(utc, lat, lon, speed, course, status=True):
+    datagen = DataGenerator(types.SimpleNamespace(lat=lat, lon=lon, alt=0.), None, None, speed, status, None)
+    try:
+        datagen.state.set(utc=datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=int(utc)))
+        datagen.course_made_good = course
+        return datagen.gen_sentence().encode("ascii")
+    finally:
+        datagen.close()
+
+
+def encode(utc, lat, lon, speed, course, status=None):
+    return encode_gprmc(utc, lat, lon, speed, course, status).split(b"\r\n")[:-1]
+
+
+def test_random_track_round_trip():
+    rng = np.random.default_rng(0)
+    n = 5000
+    utc = rng.uniform(946684800, 4102444799, n)         # 2000-2099
+    lat = rng.uniform(-89.9, 89.9, n)
+    lon = rng.uniform(-179.9, 179.9, n)
+    speed = rng.uniform(0, 60, n)
+    course = rng.uniform(0, 360, n)
+    status = rng.random(n) < 0.9
+    lines = encode(utc, lat, lon, speed, course, status)
+    assert len(lines) == n
+    for i, line in enumerate(lines):
+        fields = parse_gprmc(line)
+        assert fields["utc"] == np.floor(utc[i])
+        assert fields["valid"] == status[i]
+        assert fields["lat"] == pytest.approx(lat[i], abs=0.005 / 60 + 1e-9)
+        assert fields["lon"] == pytest.approx(lon[i], abs=0.005 / 60 + 1e-9)
+        assert fields["speed"] == pytest.approx(mps2knots(speed[i]), abs=0.005 + 1e-9)
+        assert fields["course"] == pytest.approx(course[i], abs=0.005 + 1e-9)
+    for i in range(100):
+        assert lines[i] == gen_sentence(utc[i], lat[i], lon[i], speed[i], course[i], status[i])
+
+
+@pytest.mark.parametrize("lat, lon, fields", [
+    (-12.0696, -77.0796, ["1204.18", "S", "07704.78", "W"]),
+    (12.0696, 77.0796, ["1204.18", "N", "07704.78", "E"]),
+    (-1.05, -5.01, ["0103.00", "S", "00500.60", "W"]),
+    (0., 0., ["0000.00", "N", "00000.00", "E"]),
+    # minutes rounding up to 60 carry into the degrees
+    (-12.999999, -77.999999, ["1300.00", "S", "07800.00", "W"]),
+    (45.99999, 179.99999, ["4600.00", "N", "18000.00", "E"]),
+])
+def test_coordinate_fields(lat, lon, fields):
+    line, = encode([UTC], [lat], [lon], [5.], [90.])
+    assert line.split(b",")[3:7] == [field.encode("ascii") for field in fields]
+    assert line == gen_sentence(UTC, lat, lon, 5., 90.)
+    parsed = parse_gprmc(line)
+    assert parsed["lat"] == pytest.approx(lat, abs=0.005 / 60 + 1e-9)
+    assert parsed["lon"] == pytest.approx(lon, abs=0.005 / 60 + 1e-9)
+
+
+def test_time_and_date():
+    # 2020-02-29 23:59:59.7 (leap day, fraction truncated)
+    utc = 1583020799.7
+    line, = encode([utc], [-12.], [-77.], [0.], [0.])
+    fields = line.split(b",")
+    assert fields[1] == b"235959"
+    assert fields[9] == b"290220"
+    assert parse_gprmc(line)["utc"] == 1583020799.
+    assert line == gen_sentence(utc, -12., -77., 0., 0.)
+
+
+def test_checksum_is_two_hex_digits():
+    rng = np.random.default_rng(1)
+    n = 2000
+    utc = UTC + rng.uniform(0, 86400 * 365, n)
+    lat = rng.uniform(-89.9, 89.9, n)
+    lon = rng.uniform(-179.9, 179.9, n)
+    speed = rng.uniform(0, 60, n)
+    course = rng.uniform(0, 360, n)
+    lines = encode(utc, lat, lon, speed, course)
+    for line in lines:
+        assert re.fullmatch(rb"\$[^*]+\*[0-9A-F]{2}", line)
+        checksum = 0
+        for char in line[1:-3]:
+            checksum ^= char
+        assert int(line[-2:], 16) == checksum
+    for i in range(0, n, 10):
+        assert lines[i] == gen_sentence(utc[i], lat[i], lon[i], speed[i], course[i])